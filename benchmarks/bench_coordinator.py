@@ -0,0 +1,108 @@
+"""Poll cycle latency of the real coordinator against a simulated console.
+
+The simulator is served on a pseudo-terminal and PylontechCoordinator opens
+it like a serial port, through pyserial-asyncio-fast, so a cycle covers the
+whole path: scheduling, the transport's framing, the parsers, the snapshot
+and the cell collection. Jitter and garbage make the console misbehave the
+way a noisy line does; failed cycles are counted, not timed. With
+--protocol rs485 the coordinator reads the RS485 stand-in instead, all
+cells included in every cycle. With --metrics the coordinator's own
+round trip, queue wait and parse histograms (see metrics.py) are printed
+after the run.
+
+    python benchmarks/bench_coordinator.py [--protocol rs485] [--modules 8] [--cycles 50] [--jitter 0.002] [--garbage 0.01] [--metrics]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+from homeassistant.helpers.update_coordinator import UpdateFailed  # noqa: E402
+from simulator import ConsoleSimulator, Rs485Simulator  # noqa: E402
+from pylontech_serial.coordinator import PylontechCoordinator  # noqa: E402
+
+
+async def measure(args) -> dict:
+    cls = Rs485Simulator if args.protocol == "rs485" else ConsoleSimulator
+    simulator = cls(
+        args.modules, baud_rate=args.baud_rate, byte_delay=args.byte_delay,
+        jitter=args.jitter, garbage=args.garbage, seed=args.seed,
+    )
+    path = await simulator.start_pty()
+    hass = HomeAssistant(tempfile.mkdtemp())
+    coordinator = PylontechCoordinator(hass, path, args.baud_rate, 5, 2.4, entry_id="bench", protocol=args.protocol)
+
+    # First cycle opens the port and reads 'info', it isn't timed
+    coordinator.data = await coordinator._async_update_data()
+    sent = simulator.bytes_sent
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(args.cycles):
+        cycle_start = time.perf_counter()
+        try:
+            coordinator.data = await coordinator._async_update_data()
+        except UpdateFailed:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - cycle_start)
+    elapsed = time.perf_counter() - start
+
+    await coordinator.transport.close()
+    simulator.close()
+    await hass.async_stop(force=True)
+
+    latencies.sort()
+    return {
+        "cycles": len(latencies),
+        "failures": failures,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0,
+        "bytes_per_s": (simulator.bytes_sent - sent) / elapsed,
+        "metrics": coordinator.metrics,
+    }
+
+
+def print_metrics(metrics):
+    print(f"\n{'histogram':<28} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes':>9} {'retries':>7}")
+    rows = [(f"cmd {name}", command.latency, command.bytes_read, command.retries)
+            for name, command in sorted(metrics.commands.items())]
+    rows += [(f"parse {name}", histogram, "", "") for name, histogram in sorted(metrics.parse.items())]
+    rows += [("queue wait", metrics.queue_wait, "", ""), ("cycle", metrics.cycle, "", "")]
+    for name, histogram, size, retries in rows:
+        p50, p95, p99 = (histogram.quantile(q) * 1000 for q in (0.5, 0.95, 0.99))
+        print(f"{name:<28} {histogram.count:>6} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {size:>9} {retries:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--protocol", choices=("console", "rs485"), default="console")
+    parser.add_argument("--modules", type=int, default=8)
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--baud-rate", type=int, default=115200)
+    parser.add_argument("--byte-delay", type=float, default=None, help="seconds per byte, overrides --baud-rate")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max extra seconds before each chunk")
+    parser.add_argument("--garbage", type=float, default=0.0, help="probability of noise in a response")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metrics", action="store_true", help="print the coordinator's own histograms")
+    args = parser.parse_args()
+
+    result = asyncio.run(measure(args))
+    print(f"{'cycles':>6} {'failed':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'bytes/s':>9}")
+    print(
+        f"{result['cycles']:>6} {result['failures']:>6} {result['mean_ms']:>9.1f} {result['p50_ms']:>9.1f} "
+        f"{result['p95_ms']:>9.1f} {result['bytes_per_s']:>9.0f}"
+    )
+    if args.metrics:
+        print_metrics(result["metrics"])
+
+
+if __name__ == "__main__":
+    main()
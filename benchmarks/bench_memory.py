@@ -0,0 +1,112 @@
+"""Memory footprint and allocation churn of the coordinator's snapshots.
+
+Runs the synchronous part of a poll cycle on a real PylontechCoordinator,
+without the port: 'pwr' into a snapshot, the diff against the previous
+one and, every cycle, the 'bat' tables of a few modules. tracemalloc
+reports, per stack size:
+
+- retained: memory held by the current snapshot (and the cells it shares)
+- blocks: number of allocations behind it, roughly the number of objects
+- churn: memory allocated and released again during one cycle (peak)
+- growth: memory still held after all cycles that wasn't after warm-up,
+  it should stay flat
+
+    python benchmarks/bench_memory.py [--cycles 2000] [--modules 1 8 16]
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+from simulator import bat_table, pwr_table  # noqa: E402
+from pylontech_serial.coordinator import PylontechCoordinator  # noqa: E402
+from pylontech_serial.statefilter import changed_fields  # noqa: E402
+
+CELLS = 15
+# 'bat' tables read per cycle, like the default cell budget does
+CELLS_PER_CYCLE = 2
+WARMUP = 50
+
+
+async def measure(modules: int, cycles: int) -> dict:
+    hass = HomeAssistant(tempfile.mkdtemp())
+    coordinator = PylontechCoordinator(hass, "/dev/null", 115200, 5, 2.4, entry_id="bench")
+    rng = random.Random(0)
+    # Pre-rendered so generating them isn't measured
+    tables = [pwr_table(modules, rng) for _ in range(64)]
+    cell_tables = [bat_table(1, CELLS, rng) for _ in range(64)]
+
+    def cycle(i):
+        system = coordinator._build_snapshot(tables[i % len(tables)])
+        for module_id in range(i * CELLS_PER_CYCLE, (i + 1) * CELLS_PER_CYCLE):
+            coordinator._store_cells(module_id % modules + 1, cell_tables[module_id % len(cell_tables)], time.monotonic())
+        system.cells = dict(coordinator._cells)
+        coordinator.changed_fields = changed_fields(coordinator.data, system)
+        coordinator.data = system
+
+    tracemalloc.start()
+    for i in range(WARMUP):
+        cycle(i)
+    gc.collect()
+
+    # What the current snapshot holds, measured by dropping it
+    held = tracemalloc.take_snapshot()
+    coordinator.data = None
+    coordinator._cells.clear()
+    gc.collect()
+    released = tracemalloc.take_snapshot().compare_to(held, "filename")
+    retained = -sum(stat.size_diff for stat in released)
+    blocks = -sum(stat.count_diff for stat in released)
+    for i in range(WARMUP):
+        cycle(i)
+    gc.collect()
+    warm = tracemalloc.get_traced_memory()[0]
+
+    churn = 0
+    for i in range(cycles):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        cycle(i)
+        churn += tracemalloc.get_traced_memory()[1] - before
+    gc.collect()
+    growth = tracemalloc.get_traced_memory()[0] - warm
+    tracemalloc.stop()
+    await hass.async_stop(force=True)
+
+    return {
+        "modules": modules,
+        "retained_kib": retained / 1024,
+        "blocks": blocks,
+        "churn_kib": churn / cycles / 1024,
+        "growth_kib": growth / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--modules", type=int, nargs="+", default=[1, 8, 16])
+    args = parser.parse_args()
+    # Keeps the 'Parsed device info' style logging out of the numbers
+    logging.disable(logging.INFO)
+
+    print(f"{'modules':>7} {'retained KiB':>13} {'blocks':>7} {'churn KiB':>10} {'growth KiB':>11}")
+    for modules in args.modules:
+        result = asyncio.run(measure(modules, args.cycles))
+        print(
+            f"{result['modules']:>7} {result['retained_kib']:>13.1f} {result['blocks']:>7} "
+            f"{result['churn_kib']:>10.1f} {result['growth_kib']:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
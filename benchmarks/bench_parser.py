@@ -0,0 +1,57 @@
+"""Parser throughput on simulated 'pwr' and 'bat' tables.
+
+Parses pre-generated console output in a tight loop, without any I/O, and
+prints tables/s and MB/s per command and stack size.
+
+    python benchmarks/bench_parser.py [--modules 1 8 16] [--tables 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from simulator import bat_table, pwr_table  # noqa: E402
+from pylontech_serial.parser import PylontechParser  # noqa: E402
+from pylontech_serial.structs import PylontechSystem  # noqa: E402
+
+CELLS = 15
+# Distinct tables parsed in turn, so the values vary like on a live stack
+VARIANTS = 16
+
+
+def throughput(tables: list, parse, count: int) -> tuple:
+    size = 0
+    start = time.perf_counter()
+    for n in range(count):
+        table = tables[n % len(tables)]
+        parse(table)
+        size += len(table)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, size / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--tables", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'command':>8} {'modules':>8} {'tables/s':>10} {'MB/s':>8}")
+    for modules in args.modules:
+        tables = [pwr_table(modules, rng) for _ in range(VARIANTS)]
+        rate, mbs = throughput(
+            tables, lambda raw: PylontechParser.parse_pwr(raw, PylontechSystem(0, 0, 0, 0, 0, 0, 0)), args.tables
+        )
+        print(f"{'pwr':>8} {modules:>8} {rate:>10.0f} {mbs:>8.2f}")
+
+    tables = [bat_table(1, CELLS, rng) for _ in range(VARIANTS)]
+    rate, mbs = throughput(tables, PylontechParser.parse_bat, args.tables)
+    print(f"{'bat':>8} {'-':>8} {rate:>10.0f} {mbs:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Total poll cycle time as stacks are added.
+
+Every stack is a simulated console paced at its baud rate, read through
+its own PylontechTransport like one config entry does. A cycle reads 'pwr'
+and 'stat' in one batch, then the cells of one module, and parses them.
+Stacks are polled one after the other and then concurrently; with
+independent ports the concurrent cycle should stay close to a single one.
+
+    python benchmarks/bench_stacks.py [--stacks 1 2 3 4] [--modules 8] [--cycles 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from simulator import ConsoleSimulator  # noqa: E402
+from pylontech_serial.parser import PylontechParser  # noqa: E402
+from pylontech_serial.structs import PylontechSystem  # noqa: E402
+from pylontech_serial.transport import PylontechTransport  # noqa: E402
+
+
+async def cycle(transport: PylontechTransport, module: int):
+    pwr, _ = await transport.execute_batch(["pwr", "stat"])
+    PylontechParser.parse_pwr(pwr, PylontechSystem(0, 0, 0, 0, 0, 0, 0))
+    (cells,) = await transport.execute_batch([f"bat {module}"])
+    PylontechParser.parse_bat(cells)
+
+
+async def measure(stacks: int, modules: int, cycles: int, baud_rate: int) -> dict:
+    consoles = [ConsoleSimulator(modules, baud_rate=baud_rate, seed=n) for n in range(stacks)]
+    transports = [PylontechTransport(f"sim{n}", baud_rate, open_connection=console.open_connection)
+                  for n, console in enumerate(consoles)]
+    # Open the ports before timing
+    await asyncio.gather(*(transport.execute("") for transport in transports))
+
+    sequential = concurrent = 0.0
+    for n in range(cycles):
+        module = n % modules + 1
+        start = time.perf_counter()
+        for transport in transports:
+            await cycle(transport, module)
+        sequential += time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(*(cycle(transport, module) for transport in transports))
+        concurrent += time.perf_counter() - start
+
+    for transport in transports:
+        await transport.close()
+    return {
+        "stacks": stacks,
+        "sequential_ms": sequential / cycles * 1000,
+        "concurrent_ms": concurrent / cycles * 1000,
+        "bytes": sum(console.bytes_sent for console in consoles) / (2 * cycles),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stacks", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--modules", type=int, default=8)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--baud-rate", type=int, default=115200)
+    args = parser.parse_args()
+
+    print(f"{'stacks':>6} {'sequential ms':>14} {'concurrent ms':>14} {'bytes/cycle':>12}")
+    for stacks in args.stacks:
+        result = asyncio.run(measure(stacks, args.modules, args.cycles, args.baud_rate))
+        print(
+            f"{result['stacks']:>6} {result['sequential_ms']:>14.1f} "
+            f"{result['concurrent_ms']:>14.1f} {result['bytes']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
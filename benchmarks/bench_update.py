@@ -0,0 +1,128 @@
+"""Event-loop time per coordinator update, for stacks of 1, 8 and 16 modules.
+
+Times the synchronous work an update does on the event loop: parsing the
+'pwr' table into a snapshot, diffing it against the previous one, and
+running every enabled sensor's update handler. Sensors are created by the
+real sensor platform; state writes are counted, not performed.
+
+    python benchmarks/bench_update.py [--updates 500] [--modules 1 8 16]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from simulator import pwr_table  # noqa: E402
+from pylontech_serial import sensor  # noqa: E402
+from pylontech_serial.const import DOMAIN  # noqa: E402
+from pylontech_serial.history import PylontechHistory  # noqa: E402
+from pylontech_serial.parser import PylontechParser  # noqa: E402
+from pylontech_serial.scheduler import CellCollector  # noqa: E402
+from pylontech_serial.statefilter import StateFilter, changed_fields  # noqa: E402
+from pylontech_serial.structs import PylontechSystem, PylontechCell, PylontechCellTable, PylontechInfo  # noqa: E402
+
+CELLS = 15
+# Shared by every snapshot, like the coordinator's cached 'info'
+INFO = PylontechInfo(cell_count=CELLS)
+DEADBANDS = {"voltage": (0.01, 0), "current": (0.1, 0), "power": (10, 0.02), "temperature": (0.5, 0), "cell_voltage": (0.002, 0)}
+
+
+def cell_table(module: int) -> PylontechCellTable:
+    cells = [PylontechCell(i, 3.379 + i / 1000, 4.0, 14.0, "Normal", 89) for i in range(CELLS)]
+    return PylontechCellTable.from_cells(module, cells, time.monotonic())
+
+
+def make_coordinator(modules: int):
+    coordinator = SimpleNamespace(
+        data=None,
+        changed_fields=None,
+        last_update_success=True,
+        state_filter=StateFilter(DEADBANDS, heartbeat=300),
+        history=PylontechHistory(),
+        stats_window=300,
+        cell_collector=CellCollector(0.3),
+        reads_cells=True,
+        topology={module: CELLS for module in range(1, modules + 1)},
+        cells={module: cell_table(module) for module in range(1, modules + 1)},
+        async_add_topology_listener=lambda update_callback: lambda: None,
+        system_device_info=dict,
+        module_device_info=lambda bat_id: {},
+    )
+    coordinator.data = build_snapshot(coordinator, pwr_table(modules, random.Random(0)))
+    return coordinator
+
+
+def build_snapshot(coordinator, raw: bytes) -> PylontechSystem:
+    system = PylontechSystem(0, 0, 0, 0, 0, 0, 0, info=INFO)
+    PylontechParser.parse_pwr(raw, system)
+    system.cells = dict(coordinator.cells)
+    coordinator.history.record(system)
+    return system
+
+
+async def create_sensors(coordinator):
+    hass = SimpleNamespace(data={DOMAIN: {"bench": coordinator}})
+    entry = SimpleNamespace(entry_id="bench", async_on_unload=lambda remove: None)
+    entities = []
+    await sensor.async_setup_entry(hass, entry, entities.extend)
+    return [entity for entity in entities if entity.entity_registry_enabled_default]
+
+
+def run(modules: int, updates: int) -> dict:
+    coordinator = make_coordinator(modules)
+    entities = asyncio.run(create_sensors(coordinator))
+    writes = 0
+
+    def count_write():
+        nonlocal writes
+        writes += 1
+
+    for entity in entities:
+        entity.async_write_ha_state = count_write
+
+    rng = random.Random(1)
+    tables = [pwr_table(modules, rng) for _ in range(updates)]
+    snapshot_time = listener_time = 0.0
+    for raw in tables:
+        start = time.perf_counter()
+        system = build_snapshot(coordinator, raw)
+        coordinator.changed_fields = changed_fields(coordinator.data, system)
+        coordinator.data = system
+        middle = time.perf_counter()
+        for entity in entities:
+            entity._handle_coordinator_update()
+        listener_time += time.perf_counter() - middle
+        snapshot_time += middle - start
+
+    return {
+        "modules": modules,
+        "entities": len(entities),
+        "snapshot_us": snapshot_time / updates * 1e6,
+        "listeners_us": listener_time / updates * 1e6,
+        "writes": writes / updates,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--modules", type=int, nargs="+", default=[1, 8, 16])
+    args = parser.parse_args()
+
+    print(f"{'modules':>7} {'entities':>8} {'snapshot µs':>12} {'listeners µs':>13} {'total µs':>9} {'writes':>7}")
+    for modules in args.modules:
+        result = run(modules, args.updates)
+        total = result["snapshot_us"] + result["listeners_us"]
+        print(
+            f"{result['modules']:>7} {result['entities']:>8} {result['snapshot_us']:>12.1f} "
+            f"{result['listeners_us']:>13.1f} {total:>9.1f} {result['writes']:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
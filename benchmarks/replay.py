@@ -0,0 +1,117 @@
+"""Replays a recorded transcript through the parser at full speed.
+
+Reads a transcript directory (the "Record Raw Console Transcripts" option
+writes them under <config>/pylontech_transcripts/<entry id>), parses every
+response with PylontechParser and prints records/s, MB/s and the parse
+errors per command. With --dump, the parsed results are written as JSON
+lines; dumps made before and after a parser change can simply be diffed.
+
+    python benchmarks/replay.py <transcript dir> [--since 2025-12-01] [--until 2026-01-01] [--dump out.jsonl]
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from pylontech_serial.parser import PylontechParser, PwrStreamParser  # noqa: E402
+from pylontech_serial.structs import PylontechSystem  # noqa: E402
+from pylontech_serial.transcript import TranscriptReader  # noqa: E402
+
+
+class ErrorCounter(logging.Handler):
+    """Counts the errors the parser logs instead of printing them."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def parse(command: str, response: bytes, stream: PwrStreamParser):
+    """Parses one response the way the coordinator would, returns the results."""
+    name, _, argument = command.partition(" ")
+    if name == "pwr":
+        return [PylontechParser.parse_pwr(response, PylontechSystem(0, 0, 0, 0, 0, 0, 0))]
+    if name == "bat":
+        return [PylontechParser.parse_bat(response)]
+    if name in ("info", "stat", "time"):
+        system = PylontechSystem(0, 0, 0, 0, 0, 0, 0)
+        getattr(PylontechParser, f"parse_{name}")(response.decode("ascii", errors="ignore"), system)
+        return [system]
+    if name == "data" and argument.startswith("history "):
+        return [PylontechParser.parse_history(response, int(argument.split()[1]))]
+    if name == "disp":
+        return [PylontechParser.parse_pwr(table, PylontechSystem(0, 0, 0, 0, 0, 0, 0)) for table in stream.feed(response)]
+    return []
+
+
+def _as_json(result):
+    if isinstance(result, PylontechSystem):
+        # Flat, like the saved snapshot
+        return result.as_dict()
+    if dataclasses.is_dataclass(result):
+        return dataclasses.asdict(result)
+    if isinstance(result, list):
+        return [_as_json(item) for item in result]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--dump", default=None, help="write the parsed results to this file")
+    args = parser.parse_args()
+
+    errors = ErrorCounter()
+    parser_logger = logging.getLogger("pylontech_serial.parser")
+    parser_logger.addHandler(errors)
+    parser_logger.propagate = False
+
+    reader = TranscriptReader(args.directory)
+    records = Counter()
+    failures = Counter()
+    size = 0
+    stream = PwrStreamParser()
+    dump = open(args.dump, "w", encoding="utf-8") if args.dump else None
+    start = time.perf_counter()
+    for record in reader.read(
+        args.since.timestamp() if args.since else None, args.until.timestamp() if args.until else None
+    ):
+        name = record.command.split(" ")[0]
+        if name != "disp":
+            # The stream was paused for this command
+            stream.reset()
+        before = errors.count
+        results = parse(record.command, record.response, stream)
+        records[name] += 1
+        failures[name] += errors.count - before
+        size += len(record.response)
+        if dump is not None:
+            for result in results:
+                line = {"timestamp": record.timestamp, "command": record.command, "result": _as_json(result)}
+                dump.write(json.dumps(line, default=str) + "\n")
+    elapsed = time.perf_counter() - start
+    if dump is not None:
+        dump.close()
+
+    total = sum(records.values())
+    print(f"{total} records, {size / 1e6:.1f} MB in {elapsed:.2f}s: "
+          f"{total / elapsed if elapsed else 0:.0f} records/s, {size / 1e6 / elapsed if elapsed else 0:.1f} MB/s")
+    print(f"{'command':>8} {'records':>9} {'errors':>7}")
+    for name, count in records.most_common():
+        print(f"{name:>8} {count:>9} {failures[name]:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Simulated Pylontech stack, for benchmarks and testing without one.
+
+Speaks the console protocol documented in docs.md: 'pwr' and 'bat N' are
+generated for the configured modules and cells, 'info', 'stat' and 'soh'
+are the responses recorded in docs.md, 'time' reads and sets a simulated
+clock and 'disp' prints the power table until any key is pressed. Output
+is paced to the time the bytes take on the line, optionally with jitter
+and injected garbage. Rs485Simulator stands in for the RS485 port
+instead, at the frame level.
+
+It's served over a socket pair (ConsoleSimulator.open_connection, for
+PylontechTransport) or a pseudo-terminal that anything opening a serial
+port can use:
+
+    python benchmarks/simulator.py --modules 8 --jitter 0.002 --garbage 0.01
+    console on /dev/pts/5
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import socket
+import tty
+from datetime import datetime, timedelta
+
+DOCS = os.path.join(os.path.dirname(__file__), "..", "docs.md")
+
+PWR_HEADER = (
+    "Power Volt   Curr   Tempr  Tlow   Thigh  Vlow   Vhigh  Base.St  Volt.St  Curr.St  "
+    "Temp.St  Coulomb  Time                 B.V.St   B.T.St  "
+)
+BAT_HEADER = (
+    "Battery  Volt     Curr     Tempr    Base State   Volt. State  Curr. State  Temp. State  Coulomb     "
+)
+PROMPT = b"\n\rpylon>"
+# Start and stop bits included
+BITS_PER_BYTE = 10
+# Bytes written per paced chunk
+CHUNK = 64
+# Modules the console lists in 'pwr', the others show as Absent
+PWR_ROWS = 16
+
+RS485_VERSION = 0x20
+RS485_CID1 = 0x46
+FIRST_RS485_ADDRESS = 2
+RTN_CHECKSUM_ERROR = 0x02
+RTN_INVALID_CID2 = 0x04
+
+
+def _widths(header):
+    # Names are separated by two or more spaces ('Base State'), except the first one ('Power Volt')
+    runs = list(re.finditer(r"\S+(?: \S+)*", header))
+    starts = [run.start() for run in runs]
+    if " " in runs[0].group():
+        starts.insert(1, runs[0].group().index(" ") + 1)
+    return [(starts[n + 1] if n + 1 < len(starts) else len(header)) - start for n, start in enumerate(starts)]
+
+
+def _row(values, widths):
+    return "".join(str(value).ljust(width) for value, width in zip(values, widths))
+
+
+def response(command: str, lines) -> bytes:
+    """Wraps table lines the way the console prints a command's output."""
+    body = "\r\r\n".join(lines)
+    return f"{command}\n\r@\r\r\n{body}\r\n\rCommand completed successfully\r\n\r$$\r\n\rpylon>".encode("ascii")
+
+
+def pwr_lines(modules: int, rng: random.Random, now: datetime = None) -> list:
+    """Header and rows of a 'pwr' table, absent rows included."""
+    widths = _widths(PWR_HEADER)
+    stamp = f"{now or datetime(2025, 12, 21, 20, 53, 6):%Y-%m-%d %H:%M:%S}"
+    rows = [PWR_HEADER]
+    for module in range(1, max(modules, PWR_ROWS) + 1):
+        if module > modules:
+            values = [module] + ["-"] * 7 + ["Absent"] + ["-"] * 7
+        else:
+            values = [
+                module, rng.randint(50600, 50700), rng.randint(3000, 4200), rng.choice((16000, 17000)), 13000, 14000,
+                3378, 3381, "Charge", "Normal", "Normal", "Normal", f"{rng.randint(88, 90)}%",
+                stamp, "Normal", "Normal",
+            ]
+        rows.append(_row(values, widths))
+    return rows
+
+
+def pwr_table(modules: int, rng: random.Random, now: datetime = None) -> bytes:
+    return response("pwr", pwr_lines(modules, rng, now))
+
+
+def bat_table(module: int, cells: int, rng: random.Random) -> bytes:
+    widths = _widths(BAT_HEADER)
+    rows = []
+    for cell in range(cells):
+        values = [
+            cell, rng.randint(3370, 3390), 4076, 14000, "Charge", "Normal", "Normal", "Normal",
+            f"{rng.randint(88, 90)}%      42586 mAH",
+        ]
+        rows.append(_row(values, widths))
+    return response(f"bat {module}", [BAT_HEADER] + rows)
+
+
+def recorded_responses(path: str = DOCS) -> dict:
+    """Raw responses from docs.md, by command."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            docs = file.read()
+    except OSError:
+        return {}
+    responses = {}
+    for command in ("info", "stat", "soh"):
+        match = re.search(r"## `%s`\n(?:_[^\n]*\n)?### Raw:\n```\n(.*?)\n```" % command, docs, re.S)
+        if match:
+            responses[command] = match.group(1).encode("ascii").decode("unicode_escape").encode("latin-1")
+    return responses
+
+
+class _Simulator:
+    """Line pacing and serving, shared by the console and the RS485 stand-in.
+
+    `byte_delay` is the line time of one byte (from `baud_rate` unless
+    given), `jitter` the most extra delay added before each chunk, and
+    `garbage` the probability of corrupting a response.
+    """
+
+    def __init__(self, modules: int = 2, cells: int = 15, baud_rate: int = 115200, byte_delay: float = None,
+                 jitter: float = 0.0, garbage: float = 0.0, seed: int = 0):
+        self.modules = modules
+        self.cells = cells
+        self.byte_delay = byte_delay if byte_delay is not None else (BITS_PER_BYTE / baud_rate if baud_rate else 0)
+        self.jitter = jitter
+        self.garbage = garbage
+        self.rng = random.Random(seed)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.commands = 0
+        self._pty = None
+        # Sessions served by open_connection(), the loop only keeps weak references
+        self._sessions = set()
+
+    async def session(self, read, write):
+        """Runs the simulator on async `read()` (b"" at the end) and `write(data)`."""
+        raise NotImplementedError
+
+    async def _send(self, write, data: bytes):
+        for start in range(0, len(data), CHUNK):
+            chunk = data[start:start + CHUNK]
+            delay = len(chunk) * self.byte_delay
+            if self.jitter:
+                delay += self.rng.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            await write(chunk)
+            self.bytes_sent += len(chunk)
+
+    async def serve(self, reader, writer):
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            await self.session(lambda: reader.read(256), write)
+        finally:
+            writer.close()
+
+    async def open_connection(self):
+        """Returns (reader, writer) for PylontechTransport(open_connection=...)."""
+        ours, theirs = socket.socketpair()
+        reader, writer = await asyncio.open_connection(sock=ours)
+        task = asyncio.get_running_loop().create_task(self.serve(reader, writer))
+        self._sessions.add(task)
+        task.add_done_callback(self._sessions.discard)
+        return await asyncio.open_connection(sock=theirs)
+
+    async def start_pty(self) -> str:
+        """Serves the simulator on a new pseudo-terminal, returns its path."""
+        loop = asyncio.get_running_loop()
+        master, slave = os.openpty()
+        # No echo or line editing, the other end sees bytes as the console sends them
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        received = asyncio.Queue()
+
+        def on_readable():
+            try:
+                received.put_nowait(os.read(master, 1024))
+            except BlockingIOError:
+                pass
+            except OSError:
+                # The slave side was closed for good
+                loop.remove_reader(master)
+                received.put_nowait(b"")
+
+        async def read():
+            return await received.get()
+
+        async def write(data):
+            while data:
+                try:
+                    data = data[os.write(master, data):]
+                except BlockingIOError:
+                    # Nobody is reading the terminal, wait for room
+                    await asyncio.sleep(0.001)
+
+        loop.add_reader(master, on_readable)
+        task = loop.create_task(self.session(read, write))
+        self._pty = (master, slave, task)
+        return os.ttyname(slave)
+
+    def close(self):
+        if self._pty is not None:
+            master, slave, task = self._pty
+            task.cancel()
+            asyncio.get_running_loop().remove_reader(master)
+            os.close(master)
+            os.close(slave)
+            self._pty = None
+
+
+class ConsoleSimulator(_Simulator):
+    """One simulated stack behind its console port."""
+
+    def __init__(self, modules: int = 2, cells: int = 15, baud_rate: int = 115200, byte_delay: float = None,
+                 jitter: float = 0.0, garbage: float = 0.0, disp_interval: float = 1.0, seed: int = 0):
+        super().__init__(modules, cells, baud_rate, byte_delay, jitter, garbage, seed)
+        self.disp_interval = disp_interval
+        self.recorded = recorded_responses()
+        self._clock_offset = timedelta()
+
+    def now(self) -> datetime:
+        return datetime.now() + self._clock_offset
+
+    def answer(self, command: str) -> bytes:
+        name, _, argument = command.partition(" ")
+        if not name:
+            return PROMPT
+        self.commands += 1
+        if name == "pwr":
+            return pwr_table(self.modules, self.rng, self.now())
+        if name == "bat":
+            return bat_table(int(argument) if argument.isdigit() else 1, self.cells, self.rng)
+        if name == "time":
+            parts = argument.split()
+            if len(parts) == 6 and all(part.isdigit() for part in parts):
+                year, month, day, hour, minute, second = (int(part) for part in parts)
+                self._clock_offset = datetime(2000 + year, month, day, hour, minute, second) - datetime.now()
+                return response(command, [])
+            return f"time\n\r@\r\n\rDs3231 {self.now():%Y-%m-%d %H:%M:%S}\r\n\rCommand completed successfully\r\n\r$$\r\n\rpylon>".encode("ascii")
+        if name in self.recorded:
+            return self.recorded[name]
+        return response(command, [])
+
+    def _corrupt(self, data: bytes) -> bytes:
+        if not self.garbage or self.rng.random() >= self.garbage:
+            return data
+        # Line noise somewhere before the closing prompt
+        noise = self.rng.randbytes(self.rng.randint(1, 16))
+        position = self.rng.randint(0, max(0, len(data) - len(b"$$\r\n\rpylon>")))
+        return data[:position] + noise + data[position:]
+
+    async def _disp(self, write):
+        while True:
+            table = "\r\r\n".join(pwr_lines(self.modules, self.rng, self.now())) + "\r\n"
+            await self._send(write, table.encode("ascii"))
+            await asyncio.sleep(self.disp_interval)
+
+    async def session(self, read, write):
+        buffer = b""
+        streaming = None
+        try:
+            while True:
+                data = await read()
+                if not data:
+                    break
+                self.bytes_received += len(data)
+                if streaming is not None:
+                    # Any key stops 'disp'
+                    streaming.cancel()
+                    streaming = None
+                    await self._send(write, PROMPT)
+                    buffer = b""
+                    continue
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    command = line.decode("ascii", errors="ignore").strip()
+                    if command.split(" ")[0] == "disp":
+                        self.commands += 1
+                        await self._send(write, b"disp\n\r@\r\r\n")
+                        streaming = asyncio.get_running_loop().create_task(self._disp(write))
+                        buffer = b""
+                        break
+                    await self._send(write, self._corrupt(self.answer(command)))
+        finally:
+            if streaming is not None:
+                streaming.cancel()
+
+
+def _rs485_checksum(body: bytes) -> int:
+    return (~sum(body) + 1) & 0xFFFF
+
+
+def rs485_frame(address: int, cid2: int, info: bytes = b"") -> bytes:
+    """Encodes a response frame, written separately from the integration's encoder."""
+    info_hex = info.hex().upper().encode("ascii")
+    length = len(info_hex)
+    lchksum = (~((length >> 8) + ((length >> 4) & 0xF) + (length & 0xF)) + 1) & 0xF
+    body = b"%02X%02X%02X%02X%04X" % (RS485_VERSION, address, RS485_CID1, cid2, lchksum << 12 | length) + info_hex
+    return b"~" + body + b"%04X" % _rs485_checksum(body) + b"\r"
+
+
+class Rs485Simulator(_Simulator):
+    """One simulated stack behind its RS485 port.
+
+    Modules answer from address 2 up, analog values (0x42), alarms (0x44)
+    and manufacturer info (0x51). Addresses without a module stay silent,
+    as on a real bus, and bad requests get an error return code. Garbage
+    flips a byte of the response, so it fails its checksum.
+    """
+
+    TEMPERATURES = 5
+
+    async def session(self, read, write):
+        buffer = b""
+        while True:
+            data = await read()
+            if not data:
+                break
+            self.bytes_received += len(data)
+            buffer += data
+            while b"\r" in buffer:
+                frame, buffer = buffer.split(b"\r", 1)
+                answer = self.answer(frame[frame.find(b"~"):] if b"~" in frame else b"")
+                if answer:
+                    await self._send(write, self._corrupt(answer))
+
+    def answer(self, frame: bytes) -> bytes:
+        body = frame[1:-4]
+        if len(body) < 12:
+            return b""
+        try:
+            address, cid2 = int(body[2:4], 16), int(body[6:8], 16)
+            valid = int(frame[-4:], 16) == _rs485_checksum(body)
+        except ValueError:
+            return b""
+        if not FIRST_RS485_ADDRESS <= address < FIRST_RS485_ADDRESS + self.modules:
+            return b""
+        self.commands += 1
+        if not valid:
+            return rs485_frame(address, RTN_CHECKSUM_ERROR)
+        if cid2 == 0x42:
+            return rs485_frame(address, 0, self._analog(address))
+        if cid2 == 0x44:
+            return rs485_frame(address, 0, self._alarm(address))
+        if cid2 == 0x51:
+            return rs485_frame(address, 0, b"US2000C".ljust(10, b" ") + bytes([2, 1]) + b"PYLON".ljust(20, b" "))
+        return rs485_frame(address, RTN_INVALID_CID2)
+
+    def _analog(self, address: int) -> bytes:
+        info = bytearray([0x00, address, self.cells])
+        for _ in range(self.cells):
+            info += self.rng.randint(3370, 3390).to_bytes(2, "big")
+        info.append(self.TEMPERATURES)
+        for _ in range(self.TEMPERATURES):
+            info += (2731 + self.rng.randint(150, 170)).to_bytes(2, "big")
+        info += self.rng.randint(300, 420).to_bytes(2, "big", signed=True)  # 10 mA
+        info += self.rng.randint(50600, 50700).to_bytes(2, "big")  # mV
+        info += (4400).to_bytes(2, "big")  # 10 mAh left
+        info.append(2)
+        info += (5000).to_bytes(2, "big")  # 10 mAh total
+        info += (123).to_bytes(2, "big")  # cycles
+        return bytes(info)
+
+    def _alarm(self, address: int) -> bytes:
+        return bytes([0x00, address, self.cells] + [0] * self.cells + [self.TEMPERATURES] + [0] * self.TEMPERATURES
+                     + [0, 0, 0] + [0] * 5)
+
+    def _corrupt(self, data: bytes) -> bytes:
+        if not self.garbage or self.rng.random() >= self.garbage:
+            return data
+        position = self.rng.randrange(1, len(data) - 1)
+        return data[:position] + b"0123456789ABCDEF"[self.rng.randrange(16):][:1] + data[position + 1:]
+
+
+async def _run(args):
+    cls = Rs485Simulator if args.protocol == "rs485" else ConsoleSimulator
+    simulator = cls(
+        args.modules, args.cells, args.baud_rate, args.byte_delay, args.jitter, args.garbage, seed=args.seed
+    )
+    print(f"{args.protocol} on {await simulator.start_pty()}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        simulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a simulated Pylontech stack on a pseudo-terminal.")
+    parser.add_argument("--protocol", choices=("console", "rs485"), default="console")
+    parser.add_argument("--modules", type=int, default=2)
+    parser.add_argument("--cells", type=int, default=15)
+    parser.add_argument("--baud-rate", type=int, default=115200)
+    parser.add_argument("--byte-delay", type=float, default=None, help="seconds per byte, overrides --baud-rate")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max extra seconds before each chunk")
+    parser.add_argument("--garbage", type=float, default=0.0, help="probability of noise in a response")
+    parser.add_argument("--seed", type=int, default=0)
+    try:
+        asyncio.run(_run(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
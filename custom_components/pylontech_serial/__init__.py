@@ -1,17 +1,61 @@
 """The Pylontech Serial integration."""
 import asyncio
 import logging
+import re
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse
 from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.storage import Store
 import voluptuous as vol
 
-from .const import DOMAIN, CONF_SERIAL_PORT, CONF_BAUD_RATE, CONF_POLL_INTERVAL, CONF_BATTERY_CAPACITY
-from .coordinator import PylontechCoordinator
+from .const import (
+    DOMAIN, CONF_SERIAL_PORT, CONF_BAUD_RATE, CONF_POLL_INTERVAL, CONF_BATTERY_CAPACITY,
+    CONF_STAT_INTERVAL, CONF_TIME_INTERVAL, DEFAULT_STAT_INTERVAL, DEFAULT_TIME_INTERVAL,
+    CONF_CELL_BUDGET, DEFAULT_CELL_BUDGET, CONF_MODE, DEFAULT_MODE, MODE_STREAM,
+    CONF_STATS_WINDOW, DEFAULT_STATS_WINDOW,
+    CONF_DEADBAND_VOLTAGE, DEFAULT_DEADBAND_VOLTAGE, CONF_DEADBAND_CURRENT, DEFAULT_DEADBAND_CURRENT,
+    CONF_DEADBAND_POWER, DEFAULT_DEADBAND_POWER, CONF_DEADBAND_POWER_RELATIVE, DEFAULT_DEADBAND_POWER_RELATIVE,
+    CONF_DEADBAND_TEMPERATURE, DEFAULT_DEADBAND_TEMPERATURE, CONF_HEARTBEAT, DEFAULT_HEARTBEAT,
+    CONF_DEADBAND_CELL_VOLTAGE, DEFAULT_DEADBAND_CELL_VOLTAGE,
+    CONF_BACKFILL, DEFAULT_BACKFILL,
+    CONF_PROTOCOL, DEFAULT_PROTOCOL, PROTOCOL_RS485,
+    CONF_ADAPTIVE_POLL, DEFAULT_ADAPTIVE_POLL, CONF_MIN_POLL_INTERVAL, DEFAULT_MIN_POLL_INTERVAL,
+    CONF_MAX_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL,
+    CONF_TRANSCRIPT, DEFAULT_TRANSCRIPT, CONF_TRANSCRIPT_SIZE, DEFAULT_TRANSCRIPT_SIZE, TRANSCRIPT_DIR,
+)
+from .coordinator import (
+    PylontechCoordinator, STORAGE_VERSION, storage_key, system_identifier, module_identifier,
+)
 
 PLATFORMS = ["sensor", "button", "switch"]
 
+ATTR_COMMAND = "command"
+ATTR_ENTRY_ID = "entry_id"
+ATTR_DEVICE_ID = "device_id"
+ATTR_LIMIT = "limit"
+
+SEND_COMMAND_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_COMMAND): cv.string,
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_DEVICE_ID): cv.string,
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
+GET_RAW_RESPONSES_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_COMMAND): cv.string,
+        vol.Optional(ATTR_LIMIT): cv.positive_int,
+        vol.Optional(ATTR_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_DEVICE_ID): cv.string,
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
@@ -23,11 +67,73 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     interval = entry.options.get(CONF_POLL_INTERVAL, entry.data.get(CONF_POLL_INTERVAL))
     # Battery capacity might be in data (old) or options (new)
     capacity = entry.options.get(CONF_BATTERY_CAPACITY, entry.data.get(CONF_BATTERY_CAPACITY, 2.4))
+    stat_interval = entry.options.get(CONF_STAT_INTERVAL, DEFAULT_STAT_INTERVAL)
+    time_interval = entry.options.get(CONF_TIME_INTERVAL, DEFAULT_TIME_INTERVAL)
+    cell_budget = entry.options.get(CONF_CELL_BUDGET, DEFAULT_CELL_BUDGET)
+    stats_window = entry.options.get(CONF_STATS_WINDOW, DEFAULT_STATS_WINDOW)
+    # (absolute, relative) per sensor device class, in the sensor's unit
+    deadbands = {
+        "voltage": (entry.options.get(CONF_DEADBAND_VOLTAGE, DEFAULT_DEADBAND_VOLTAGE), 0),
+        "current": (entry.options.get(CONF_DEADBAND_CURRENT, DEFAULT_DEADBAND_CURRENT), 0),
+        "power": (
+            entry.options.get(CONF_DEADBAND_POWER, DEFAULT_DEADBAND_POWER),
+            entry.options.get(CONF_DEADBAND_POWER_RELATIVE, DEFAULT_DEADBAND_POWER_RELATIVE) / 100.0,
+        ),
+        "temperature": (entry.options.get(CONF_DEADBAND_TEMPERATURE, DEFAULT_DEADBAND_TEMPERATURE), 0),
+        # Set in mV, kept in V like the other voltages
+        "cell_voltage": (entry.options.get(CONF_DEADBAND_CELL_VOLTAGE, DEFAULT_DEADBAND_CELL_VOLTAGE) / 1000.0, 0),
+    }
+    heartbeat = entry.options.get(CONF_HEARTBEAT, DEFAULT_HEARTBEAT)
+    protocol = entry.options.get(CONF_PROTOCOL, DEFAULT_PROTOCOL)
+    mode = entry.options.get(CONF_MODE, DEFAULT_MODE)
+    backfill = entry.options.get(CONF_BACKFILL, DEFAULT_BACKFILL)
+    if protocol == PROTOCOL_RS485:
+        # 'disp' and 'data history' are console commands
+        mode, backfill = DEFAULT_MODE, False
+    # Adaptive polling only makes sense when 'pwr' is polled, the stream is already live
+    poll_bounds = None
+    if entry.options.get(CONF_ADAPTIVE_POLL, DEFAULT_ADAPTIVE_POLL) and mode != MODE_STREAM:
+        poll_bounds = (
+            entry.options.get(CONF_MIN_POLL_INTERVAL, DEFAULT_MIN_POLL_INTERVAL),
+            entry.options.get(CONF_MAX_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL),
+        )
+    transcript_dir = None
+    if entry.options.get(CONF_TRANSCRIPT, DEFAULT_TRANSCRIPT):
+        transcript_dir = hass.config.path(TRANSCRIPT_DIR, entry.entry_id)
 
-    coordinator = PylontechCoordinator(hass, port, baud, interval, capacity)
+    coordinator = PylontechCoordinator(
+        hass, port, baud, interval, capacity,
+        stat_interval=stat_interval,
+        time_interval=time_interval,
+        cell_budget=cell_budget,
+        stats_window=stats_window,
+        deadbands=deadbands,
+        heartbeat=heartbeat,
+        backfill=backfill,
+        entry_id=entry.entry_id,
+        poll_bounds=poll_bounds,
+        transcript_dir=transcript_dir,
+        transcript_size=entry.options.get(CONF_TRANSCRIPT_SIZE, DEFAULT_TRANSCRIPT_SIZE),
+        protocol=protocol,
+    )
+    await coordinator.async_restore_energy()
+    if coordinator.backfill is not None:
+        await coordinator.backfill.async_load()
+
+    if await coordinator.async_restore_snapshot():
+        # Entities start from the last run's snapshot, the port is read in the background
+        entry.async_create_background_task(hass, coordinator.async_refresh(), f"{DOMAIN} first refresh")
+    else:
+        # Nothing saved yet, entities need real data to know the modules
+        try:
+            await coordinator.async_config_entry_first_refresh()
+        except Exception:
+            # HA retries the setup with a new coordinator, let go of the port and recorder thread
+            await coordinator.async_shutdown()
+            raise
 
-    # Fetch initial data so we have data when entities subscribe
-    await coordinator.async_config_entry_first_refresh()
+    if mode == MODE_STREAM:
+        coordinator.start_streaming()
 
     hass.data[DOMAIN][entry.entry_id] = coordinator
 
@@ -35,32 +141,102 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     
     entry.async_on_unload(entry.add_update_listener(async_reload_entry))
 
-    async def async_send_command(call: ServiceCall) -> dict:
-        """Handle the service call."""
-        command = call.data.get("command")
-        
-        # Get the coordinator (assuming one entry for now, or use entry_id if passed)
-        # Service is registered globally for the integration, so we need to pick a target or default to the first
-        # Ideally services are registered per device, but simple global service is common for single-instance per integration
-        # If multiple instances, we might pick the first one from hass.data[DOMAIN]
-        
-        if not hass.data.get(DOMAIN):
-            raise ValueError("No Pylontech integration found")
-        
-        # Pick the first coordinator
-        entry_id = next(iter(hass.data[DOMAIN]))
-        coordinator: PylontechCoordinator = hass.data[DOMAIN][entry_id]
-        
-        response = await hass.async_add_executor_job(coordinator.send_raw_command, command)
-        return {"response": response}
-
-    hass.services.async_register(
-        DOMAIN, 
-        "send_command", 
-        async_send_command,
-        schema=vol.Schema({vol.Required("command"): cv.string}, extra=vol.ALLOW_EXTRA),
-        supports_response=SupportsResponse.OPTIONAL
-    )
+    # One service for all stacks, registered with the first entry
+    if not hass.services.has_service(DOMAIN, "send_command"):
+        async def async_send_command(call: ServiceCall) -> dict:
+            """Handle the service call."""
+            coordinator = _target_coordinator(hass, call)
+            response = await coordinator.async_send_raw_command(call.data[ATTR_COMMAND])
+            return {"response": response}
+
+        hass.services.async_register(
+            DOMAIN,
+            "send_command",
+            async_send_command,
+            schema=SEND_COMMAND_SCHEMA,
+            supports_response=SupportsResponse.OPTIONAL
+        )
+
+    if not hass.services.has_service(DOMAIN, "get_raw_responses"):
+        async def async_get_raw_responses(call: ServiceCall) -> dict:
+            """Returns the latest raw responses, they aren't kept in any entity."""
+            coordinator = _target_coordinator(hass, call)
+            return {"responses": coordinator.get_raw_responses(call.data.get(ATTR_COMMAND), call.data.get(ATTR_LIMIT))}
+
+        hass.services.async_register(
+            DOMAIN,
+            "get_raw_responses",
+            async_get_raw_responses,
+            schema=GET_RAW_RESPONSES_SCHEMA,
+            supports_response=SupportsResponse.ONLY
+        )
+
+    return True
+
+def _target_coordinator(hass: HomeAssistant, call: ServiceCall) -> PylontechCoordinator:
+    """Finds the stack a service call is meant for.
+
+    The target is given by config entry or by device (the stack or any of
+    its modules). Without one, the call only works with a single stack.
+    """
+    coordinators = hass.data.get(DOMAIN)
+    if not coordinators:
+        raise ValueError("No Pylontech integration found")
+
+    entry_id = call.data.get(ATTR_ENTRY_ID)
+    device_id = call.data.get(ATTR_DEVICE_ID)
+    if device_id:
+        device = dr.async_get(hass).async_get(device_id)
+        if device is None:
+            raise ValueError(f"Unknown device {device_id}")
+        entry_id = next((entry for entry in device.config_entries if entry in coordinators), None)
+        if entry_id is None:
+            raise ValueError(f"Device {device_id} is not a Pylontech stack")
+
+    if entry_id:
+        if entry_id not in coordinators:
+            raise ValueError(f"Unknown or unloaded config entry {entry_id}")
+        return coordinators[entry_id]
+
+    if len(coordinators) > 1:
+        raise ValueError("Several stacks are configured, pass entry_id or device_id")
+    return next(iter(coordinators.values()))
+
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Migrate old entries."""
+    if entry.version == 1:
+        # Devices used fixed identifiers, they're now per entry so stacks don't collide
+        registry = dr.async_get(hass)
+        for device in dr.async_entries_for_config_entry(registry, entry.entry_id):
+            if len(device.config_entries) > 1:
+                _LOGGER.warning(f"Device {device.name} is shared by several entries, not migrating it")
+                continue
+            identifiers = set()
+            for domain, identifier in device.identifiers:
+                if domain == DOMAIN and identifier == "system":
+                    identifiers.add(system_identifier(entry.entry_id))
+                elif domain == DOMAIN and identifier.startswith("battery_"):
+                    identifiers.add(module_identifier(entry.entry_id, identifier[len("battery_"):]))
+                else:
+                    identifiers.add((domain, identifier))
+            if identifiers != device.identifiers:
+                _LOGGER.debug(f"Migrating device {device.name} to {identifiers}")
+                registry.async_update_device(device.id, new_identifiers=identifiers)
+
+        hass.config_entries.async_update_entry(entry, version=2)
+        _LOGGER.info(f"Migrated config entry {entry.entry_id} to version 2")
+
+    if entry.version == 2:
+        # Raw text used to be sensor states, it's in the diagnostics and the get_raw_responses service now
+        registry = er.async_get(hass)
+        raw_unique_id = re.compile(rf"{re.escape(entry.entry_id)}_(sys|bat\d+)_raw")
+        for registry_entry in er.async_entries_for_config_entry(registry, entry.entry_id):
+            if registry_entry.domain == "sensor" and raw_unique_id.fullmatch(registry_entry.unique_id):
+                _LOGGER.debug(f"Removing {registry_entry.entity_id}")
+                registry.async_remove(registry_entry.entity_id)
+
+        hass.config_entries.async_update_entry(entry, version=3)
+        _LOGGER.info(f"Migrated config entry {entry.entry_id} to version 3")
 
     return True
 
@@ -72,6 +248,15 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        coordinator: PylontechCoordinator = hass.data[DOMAIN].pop(entry.entry_id)
+        await coordinator.async_shutdown()
+        if not hass.data[DOMAIN]:
+            hass.services.async_remove(DOMAIN, "send_command")
+            hass.services.async_remove(DOMAIN, "get_raw_responses")
 
     return unload_ok
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the persisted counters of a deleted entry."""
+    for name in ("energy", "history", "snapshot"):
+        await Store(hass, STORAGE_VERSION, storage_key(entry.entry_id, name)).async_remove()
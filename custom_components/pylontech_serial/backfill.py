@@ -0,0 +1,281 @@
+"""Backfill of the BMS's own history into Home Assistant long-term statistics."""
+import logging
+import time
+from datetime import datetime
+
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import async_add_external_statistics
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+from .parser import PylontechParser
+from .transport import PylontechTransportError, PRIORITY_BACKFILL
+
+_LOGGER = logging.getLogger(__name__)
+
+HISTORY_COMMAND = "data history {item}"
+# Records read after each poll
+BACKFILL_CHUNK = 8
+# The cursor is written at most this often
+BACKFILL_SAVE_DELAY = 60  # seconds
+# Once caught up, how often to look for records written since
+BACKFILL_CHECK_INTERVAL = 300  # seconds
+
+# Imported fields: (statistic name, unit)
+HISTORY_FIELDS = {
+    "voltage": ("Voltage", "V"),
+    "current": ("Current", "A"),
+    "temperature": ("Temperature", "°C"),
+    "soc": ("SOC", "%"),
+}
+
+
+class HourlyBuckets:
+    """Mean/min/max of every history field, per hour.
+
+    An hour is imported once a record from a later hour was seen, so its
+    statistics are written once with all of its records.
+    """
+
+    def __init__(self):
+        # Hour start (ISO, UTC) -> field -> [sum, count, min, max]
+        self._hours = {}
+
+    def add(self, start: datetime, record):
+        hour = self._hours.setdefault(start.isoformat(), {})
+        for name in HISTORY_FIELDS:
+            value = getattr(record, name)
+            if value is None:
+                continue
+            bucket = hour.get(name)
+            if bucket is None:
+                hour[name] = [value, 1, value, value]
+            else:
+                bucket[0] += value
+                bucket[1] += 1
+                bucket[2] = min(bucket[2], value)
+                bucket[3] = max(bucket[3], value)
+
+    def pop_closed(self, before: datetime) -> list:
+        """Removes and returns (start, field buckets) of the hours before `before`."""
+        closed = []
+        for key in sorted(self._hours):
+            start = datetime.fromisoformat(key)
+            if start < before:
+                closed.append((start, self._hours.pop(key)))
+        return closed
+
+    def as_dict(self) -> dict:
+        return self._hours
+
+    def restore(self, data: dict):
+        self._hours = {key: {name: list(bucket) for name, bucket in fields.items()} for key, fields in data.items()}
+
+
+class HistoryBackfill:
+    """Reads the BMS history a few records at a time and imports it as statistics.
+
+    Records are read with 'data history N' after regular polls, at a lower
+    priority so they never delay one. The cursor (next item, newest
+    imported timestamp and its item) is persisted, so a restart resumes
+    where it stopped and only records newer than the last import are used.
+    When the BMS reports fewer records than the cursor (history cleared),
+    the items are read again from the start and the timestamp filters out
+    what was already imported.
+
+    Once the history is full its count stays the same while the oldest
+    records are overwritten, so reaching the count doesn't mean nothing new
+    will come. When caught up, the item after the newest imported one and
+    the last item are read every BACKFILL_CHECK_INTERVAL: a newer record in
+    the former means the BMS overwrites its slots in turn, reading resumes
+    there up to the first older record. A newer one in the latter means the
+    records shift down as new ones are appended, reading steps back from the
+    end until it meets imported records, then goes forward again.
+
+    New records are expected oldest first, as the BMS appends them. If a
+    chunk comes back newest first the backfill stops rather than import
+    partial hours.
+    """
+
+    def __init__(self, hass: HomeAssistant, coordinator, store: Store, entry_id):
+        self.hass = hass
+        self.coordinator = coordinator
+        self._store = store
+        self._statistic_prefix = f"{DOMAIN}:{str(entry_id).lower()}_history"
+        self._item = 1
+        self._newest = None
+        # Item the newest imported record was read from
+        self._newest_item = None
+        # Stepping back from the end to find where the imported records stop
+        self._rewinding = False
+        self._checked = None
+        self._buckets = HourlyBuckets()
+        self._task = None
+        self._unparsed = 0
+        self._stopped = False
+
+    async def async_load(self):
+        data = await self._store.async_load()
+        if data:
+            self._item = data.get("item", 1)
+            self._newest = datetime.fromisoformat(data["newest"]) if data.get("newest") else None
+            self._newest_item = data.get("newest_item")
+            self._buckets.restore(data.get("buckets", {}))
+            _LOGGER.debug(f"Resuming history backfill at item {self._item}, newest {self._newest}")
+
+    def _as_dict(self) -> dict:
+        return {
+            "item": self._item,
+            "newest": self._newest.isoformat() if self._newest else None,
+            "newest_item": self._newest_item,
+            "buckets": self._buckets.as_dict(),
+        }
+
+    def schedule(self):
+        """Reads the next chunk in the background, unless one is still running."""
+        if self._stopped:
+            return
+        if self._task is None or self._task.done():
+            self._task = self.hass.async_create_background_task(
+                self._async_run_chunk(), f"{DOMAIN} history backfill"
+            )
+
+    async def async_shutdown(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        await self._store.async_save(self._as_dict())
+
+    async def _async_run_chunk(self):
+        total = self.coordinator.data.history_items if self.coordinator.data else None
+        if not total:
+            # 'stat' wasn't read yet
+            return
+        if self._item > total + 1:
+            _LOGGER.info(f"BMS history shrank to {total} records, reading it again from the start")
+            self._item = 1
+            self._rewinding = False
+        if self._item > total:
+            await self._async_check_new(total)
+            return
+
+        items = list(range(self._item, min(total, self._item + BACKFILL_CHUNK - 1) + 1))
+        start = time.monotonic()
+        records = await self._async_read(items)
+        if records is None:
+            return
+        fresh = [self._is_new(record) for record in records]
+        new_records = [record for record, new in zip(records, fresh) if new]
+        if any(later.timestamp < earlier.timestamp for earlier, later in zip(new_records, new_records[1:])):
+            _LOGGER.warning("BMS history records aren't oldest first, stopping the history backfill")
+            self._stopped = True
+            return
+
+        if self._rewinding:
+            if records and all(fresh) and items[0] > 1:
+                # Everything here is new, the last import is further back
+                self._item = max(1, items[0] - BACKFILL_CHUNK)
+                return
+            self._rewinding = False
+        if any(new and not next_new for new, next_new in zip(fresh, fresh[1:])):
+            # Past the newest slot of a history that overwrites in turn, the rest is older
+            self._item = total + 1
+        else:
+            self._item = items[-1] + 1
+
+        imported = self._add_records(records)
+        _LOGGER.debug(
+            f"History backfill read items {items[0]}-{items[-1]} of {total} in {time.monotonic() - start:.2f}s, "
+            f"{len(records)} records, {imported} hours imported"
+        )
+        self._store.async_delay_save(self._as_dict, BACKFILL_SAVE_DELAY)
+
+    async def _async_check_new(self, total: int):
+        """Looks for records written since the history was caught up with."""
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < BACKFILL_CHECK_INTERVAL:
+            return
+        self._checked = now
+        next_item = (self._newest_item or total) % total + 1
+        records = await self._async_read(sorted({next_item, total}))
+        if not records:
+            return
+        by_item = {record.item: record for record in records}
+        if any(self._is_new(record) for record in records):
+            # Look again as soon as these are read, there may be more than one pass's worth
+            self._checked = None
+        if next_item in by_item and self._is_new(by_item[next_item]):
+            _LOGGER.debug(f"BMS history overwrote item {next_item}, reading on from there")
+            self._item = next_item
+        elif total in by_item and self._is_new(by_item[total]):
+            _LOGGER.debug("BMS history moved on, looking back for the last imported record")
+            self._item = max(1, total - BACKFILL_CHUNK + 1)
+            self._rewinding = True
+
+    async def _async_read(self, items: list):
+        """Reads and parses history items, None if the port failed."""
+        commands = [HISTORY_COMMAND.format(item=item) for item in items]
+        try:
+            responses = await self.coordinator.transport.execute_batch(commands, PRIORITY_BACKFILL)
+        except (PylontechTransportError, TimeoutError) as e:
+            _LOGGER.debug(f"Could not read history records: {e}")
+            return None
+
+        records = []
+        for item, raw in zip(items, responses):
+            record = PylontechParser.parse_history(raw, item)
+            if record is None:
+                self._unparsed += 1
+                if self._unparsed == BACKFILL_CHUNK:
+                    _LOGGER.warning(f"Could not parse BMS history records, e.g. item {item}: {raw[:200]!r}")
+                continue
+            records.append(record)
+        return records
+
+    def _is_new(self, record) -> bool:
+        return self._newest is None or record.timestamp > self._newest
+
+    def _add_records(self, records) -> int:
+        """Buckets the new records and imports the hours they completed."""
+        for record in records:
+            if not self._is_new(record):
+                continue
+            self._buckets.add(_hour_start(_bms_to_utc(record.timestamp)), record)
+            self._newest = record.timestamp
+            self._newest_item = record.item
+
+        if self._newest is None:
+            return 0
+        closed = self._buckets.pop_closed(_hour_start(_bms_to_utc(self._newest)))
+        if closed:
+            self._import(closed)
+        return len(closed)
+
+    def _import(self, hours):
+        for name, (label, unit) in HISTORY_FIELDS.items():
+            statistics = []
+            for start, fields in hours:
+                if name in fields:
+                    total, count, low, high = fields[name]
+                    statistics.append(StatisticData(start=start, mean=total / count, min=low, max=high))
+            if not statistics:
+                continue
+            metadata = StatisticMetaData(
+                has_mean=True,
+                has_sum=False,
+                name=f"Pylontech BMS history {label.lower()}",
+                source=DOMAIN,
+                statistic_id=f"{self._statistic_prefix}_{name}",
+                unit_of_measurement=unit,
+            )
+            async_add_external_statistics(self.hass, metadata, statistics)
+
+
+def _hour_start(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _bms_to_utc(timestamp: datetime) -> datetime:
+    # The BMS clock is local time
+    return dt_util.as_utc(timestamp.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE))
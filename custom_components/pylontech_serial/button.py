@@ -26,12 +26,8 @@ class PylontechSyncTimeButton(CoordinatorEntity, ButtonEntity):
     def __init__(self, coordinator, unique_id_prefix):
         super().__init__(coordinator)
         self._attr_unique_id = f"{unique_id_prefix}_sync_time"
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, "system")},
-            "name": "Pylontech Stack",
-            "manufacturer": "Pylontech",
-        }
+        self._attr_device_info = coordinator.system_device_info()
 
     async def async_press(self) -> None:
         """Handle the button press."""
-        await self.hass.async_add_executor_job(self.coordinator.sync_time)
+        await self.coordinator.async_sync_time()
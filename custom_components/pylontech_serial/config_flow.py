@@ -7,12 +7,43 @@ from homeassistant.helpers.service_info.usb import UsbServiceInfo
 from homeassistant.const import CONF_NAME
 from homeassistant.core import callback
 
-from .const import DOMAIN, CONF_SERIAL_PORT, CONF_BAUD_RATE, CONF_POLL_INTERVAL, CONF_BATTERY_CAPACITY, DEFAULT_BAUD_RATE, DEFAULT_POLL_INTERVAL, DEFAULT_BATTERY_CAPACITY
+from .const import (
+    DOMAIN, CONF_SERIAL_PORT, CONF_BAUD_RATE, CONF_POLL_INTERVAL, CONF_BATTERY_CAPACITY,
+    DEFAULT_BAUD_RATE, DEFAULT_POLL_INTERVAL, DEFAULT_BATTERY_CAPACITY,
+    CONF_STAT_INTERVAL, CONF_TIME_INTERVAL, DEFAULT_STAT_INTERVAL, DEFAULT_TIME_INTERVAL,
+    CONF_CELL_BUDGET, DEFAULT_CELL_BUDGET, CONF_MODE, DEFAULT_MODE, MODE_POLL, MODE_STREAM,
+    CONF_STATS_WINDOW, DEFAULT_STATS_WINDOW,
+    CONF_DEADBAND_VOLTAGE, DEFAULT_DEADBAND_VOLTAGE, CONF_DEADBAND_CURRENT, DEFAULT_DEADBAND_CURRENT,
+    CONF_DEADBAND_POWER, DEFAULT_DEADBAND_POWER, CONF_DEADBAND_POWER_RELATIVE, DEFAULT_DEADBAND_POWER_RELATIVE,
+    CONF_DEADBAND_TEMPERATURE, DEFAULT_DEADBAND_TEMPERATURE, CONF_HEARTBEAT, DEFAULT_HEARTBEAT,
+    CONF_DEADBAND_CELL_VOLTAGE, DEFAULT_DEADBAND_CELL_VOLTAGE,
+    CONF_BACKFILL, DEFAULT_BACKFILL,
+    CONF_PROTOCOL, DEFAULT_PROTOCOL, PROTOCOL_CONSOLE, PROTOCOL_RS485,
+    CONF_ADAPTIVE_POLL, DEFAULT_ADAPTIVE_POLL, CONF_MIN_POLL_INTERVAL, DEFAULT_MIN_POLL_INTERVAL,
+    CONF_MAX_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL,
+    CONF_TRANSCRIPT, DEFAULT_TRANSCRIPT, CONF_TRANSCRIPT_SIZE, DEFAULT_TRANSCRIPT_SIZE,
+)
+
+# Option values that reach the schedulers and filters, checked before they're stored
+POSITIVE = vol.All(vol.Coerce(int), vol.Range(min=1))
+# 0 means on every poll for the stat/time intervals, off for the cell budget and heartbeat
+POSITIVE_OR_ZERO = vol.All(vol.Coerce(int), vol.Range(min=0))
+DEADBAND = vol.All(vol.Coerce(float), vol.Range(min=0))
+BAUD_RATE = vol.All(vol.Coerce(int), vol.Range(min=1200))
+CAPACITY = vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False))
+
+def _port_in_use(hass, port, entry_id=None) -> bool:
+    """Whether an entry other than `entry_id` reads `port`, its options override the initial setup."""
+    return any(
+        entry.options.get(CONF_SERIAL_PORT, entry.data.get(CONF_SERIAL_PORT)) == port
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        if entry.entry_id != entry_id
+    )
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for Pylontech Serial."""
 
-    VERSION = 1
+    VERSION = 3
 
 
     async def async_step_usb(self, discovery_info: UsbServiceInfo):
@@ -27,7 +58,10 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         errors = {}
 
         if user_input is not None:
-            return self.async_create_entry(title="Pylontech Battery", data=user_input)
+            # Each stack needs its own port, two entries can't share one
+            if _port_in_use(self.hass, user_input[CONF_SERIAL_PORT]):
+                return self.async_abort(reason="already_configured")
+            return self.async_create_entry(title=f"Pylontech Battery ({user_input[CONF_SERIAL_PORT]})", data=user_input)
 
         ports = await self.hass.async_add_executor_job(serial.tools.list_ports.comports)
         list_of_ports = {}
@@ -41,9 +75,9 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         schema = vol.Schema({
             vol.Required(CONF_SERIAL_PORT, default=default_port): vol.In(list_of_ports),
-            vol.Required(CONF_BAUD_RATE, default=DEFAULT_BAUD_RATE): int,
-            vol.Required(CONF_POLL_INTERVAL, default=DEFAULT_POLL_INTERVAL): int,
-            vol.Required(CONF_BATTERY_CAPACITY, default=DEFAULT_BATTERY_CAPACITY): float,
+            vol.Required(CONF_BAUD_RATE, default=DEFAULT_BAUD_RATE): BAUD_RATE,
+            vol.Required(CONF_POLL_INTERVAL, default=DEFAULT_POLL_INTERVAL): POSITIVE,
+            vol.Required(CONF_BATTERY_CAPACITY, default=DEFAULT_BATTERY_CAPACITY): CAPACITY,
         })
 
         return self.async_show_form(
@@ -73,9 +107,35 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         current_baud = self.config_entry.options.get(CONF_BAUD_RATE, self.config_entry.data.get(CONF_BAUD_RATE))
         current_poll = self.config_entry.options.get(CONF_POLL_INTERVAL, self.config_entry.data.get(CONF_POLL_INTERVAL))
         current_cap = self.config_entry.options.get(CONF_BATTERY_CAPACITY, self.config_entry.data.get(CONF_BATTERY_CAPACITY))
+        current_stat = self.config_entry.options.get(CONF_STAT_INTERVAL, DEFAULT_STAT_INTERVAL)
+        current_time = self.config_entry.options.get(CONF_TIME_INTERVAL, DEFAULT_TIME_INTERVAL)
+        current_cell_budget = self.config_entry.options.get(CONF_CELL_BUDGET, DEFAULT_CELL_BUDGET)
+        current_mode = self.config_entry.options.get(CONF_MODE, DEFAULT_MODE)
+        current_window = self.config_entry.options.get(CONF_STATS_WINDOW, DEFAULT_STATS_WINDOW)
+        options = self.config_entry.options
+        current_protocol = options.get(CONF_PROTOCOL, DEFAULT_PROTOCOL)
+        current_adaptive = options.get(CONF_ADAPTIVE_POLL, DEFAULT_ADAPTIVE_POLL)
+        current_min_poll = options.get(CONF_MIN_POLL_INTERVAL, DEFAULT_MIN_POLL_INTERVAL)
+        current_max_poll = options.get(CONF_MAX_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL)
+        current_db_volt = options.get(CONF_DEADBAND_VOLTAGE, DEFAULT_DEADBAND_VOLTAGE)
+        current_db_curr = options.get(CONF_DEADBAND_CURRENT, DEFAULT_DEADBAND_CURRENT)
+        current_db_power = options.get(CONF_DEADBAND_POWER, DEFAULT_DEADBAND_POWER)
+        current_db_power_rel = options.get(CONF_DEADBAND_POWER_RELATIVE, DEFAULT_DEADBAND_POWER_RELATIVE)
+        current_db_temp = options.get(CONF_DEADBAND_TEMPERATURE, DEFAULT_DEADBAND_TEMPERATURE)
+        current_db_cell = options.get(CONF_DEADBAND_CELL_VOLTAGE, DEFAULT_DEADBAND_CELL_VOLTAGE)
+        current_heartbeat = options.get(CONF_HEARTBEAT, DEFAULT_HEARTBEAT)
+        current_backfill = options.get(CONF_BACKFILL, DEFAULT_BACKFILL)
+        current_transcript = options.get(CONF_TRANSCRIPT, DEFAULT_TRANSCRIPT)
+        current_transcript_size = options.get(CONF_TRANSCRIPT_SIZE, DEFAULT_TRANSCRIPT_SIZE)
 
         if user_input is not None:
-             return self.async_create_entry(title="", data=user_input)
+            if user_input[CONF_MIN_POLL_INTERVAL] > user_input[CONF_MAX_POLL_INTERVAL]:
+                errors[CONF_MIN_POLL_INTERVAL] = "min_above_max"
+            if _port_in_use(self.hass, user_input[CONF_SERIAL_PORT], self.config_entry.entry_id):
+                # Two coordinators would fight over the same tty
+                errors[CONF_SERIAL_PORT] = "already_configured"
+            if not errors:
+                return self.async_create_entry(title="", data=user_input)
 
         ports = await self.hass.async_add_executor_job(serial.tools.list_ports.comports)
         list_of_ports = {}
@@ -88,9 +148,33 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
 
         schema = vol.Schema({
             vol.Required(CONF_SERIAL_PORT, default=current_port): vol.In(list_of_ports),
-            vol.Required(CONF_BAUD_RATE, default=current_baud): int,
-            vol.Required(CONF_POLL_INTERVAL, default=current_poll): int,
-            vol.Required(CONF_BATTERY_CAPACITY, default=current_cap): float,
+            vol.Required(CONF_BAUD_RATE, default=current_baud): BAUD_RATE,
+            vol.Required(CONF_POLL_INTERVAL, default=current_poll): POSITIVE,
+            vol.Required(CONF_ADAPTIVE_POLL, default=current_adaptive): bool,
+            vol.Required(CONF_MIN_POLL_INTERVAL, default=current_min_poll): POSITIVE,
+            vol.Required(CONF_MAX_POLL_INTERVAL, default=current_max_poll): POSITIVE,
+            vol.Required(CONF_BATTERY_CAPACITY, default=current_cap): CAPACITY,
+            vol.Required(CONF_STAT_INTERVAL, default=current_stat): POSITIVE_OR_ZERO,
+            vol.Required(CONF_TIME_INTERVAL, default=current_time): POSITIVE_OR_ZERO,
+            vol.Required(CONF_CELL_BUDGET, default=current_cell_budget): POSITIVE_OR_ZERO,
+            vol.Required(CONF_MODE, default=current_mode): vol.In([MODE_POLL, MODE_STREAM]),
+            vol.Required(CONF_PROTOCOL, default=current_protocol): vol.In([PROTOCOL_CONSOLE, PROTOCOL_RS485]),
+            vol.Required(CONF_STATS_WINDOW, default=current_window): POSITIVE,
+            vol.Required(CONF_DEADBAND_VOLTAGE, default=current_db_volt): DEADBAND,
+            vol.Required(CONF_DEADBAND_CURRENT, default=current_db_curr): DEADBAND,
+            vol.Required(CONF_DEADBAND_POWER, default=current_db_power): DEADBAND,
+            vol.Required(CONF_DEADBAND_POWER_RELATIVE, default=current_db_power_rel): vol.All(
+                vol.Coerce(float), vol.Range(min=0, max=100)
+            ),
+            vol.Required(CONF_DEADBAND_TEMPERATURE, default=current_db_temp): DEADBAND,
+            vol.Required(CONF_DEADBAND_CELL_VOLTAGE, default=current_db_cell): DEADBAND,
+            vol.Required(CONF_HEARTBEAT, default=current_heartbeat): POSITIVE_OR_ZERO,
+            vol.Required(CONF_BACKFILL, default=current_backfill): bool,
+            vol.Required(CONF_TRANSCRIPT, default=current_transcript): bool,
+            vol.Required(CONF_TRANSCRIPT_SIZE, default=current_transcript_size): POSITIVE,
         })
+        if errors:
+            # Show what was entered, not the stored options
+            schema = self.add_suggested_values_to_schema(schema, user_input)
 
         return self.async_show_form(step_id="user", data_schema=schema, errors=errors)
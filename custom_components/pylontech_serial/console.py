@@ -0,0 +1,98 @@
+"""Framing helpers for the Pylontech console port."""
+
+# Every console response ends with:
+#   ...\r\n\rCommand completed successfully\r\n\r$$\r\n\rpylon>
+PROMPT = b"pylon>"
+COMPLETED = b"Command completed successfully"
+END_MARK = b"$$"
+# Paged output (e.g. 'help') stops here until a key is pressed
+CONTINUE = b"Press [Enter] to be continued"
+# Enter prints the next page, any other key leaves the pager
+PAGER_EXIT = b"\x1b"
+
+DEFAULT_TIMEOUT = 2.0  # seconds
+WAKE_TIMEOUT = 0.5  # seconds
+# How long to wait for the trailing prompt once the completion marker was seen
+PROMPT_GRACE = 0.05  # seconds
+
+# Upper bounds per command, the reader returns as soon as the frame is complete
+COMMAND_TIMEOUTS = {
+    "pwr": 2.0,
+    "bat": 2.0,
+    "info": 2.0,
+    "stat": 2.0,
+    "soh": 2.0,
+    "time": 1.0,
+}
+
+
+def find_frame_end(buffer, start: int = 0) -> int:
+    """Returns the index just past the end of the first complete frame, or -1."""
+    idx = buffer.find(PROMPT, start)
+    if idx != -1:
+        return idx + len(PROMPT)
+    idx = buffer.find(CONTINUE, start)
+    if idx != -1:
+        return idx + len(CONTINUE)
+    return -1
+
+
+def command_timeout(command: str) -> float:
+    """Returns the timeout to use for a console command line."""
+    name = command.split(" ", 1)[0].strip().lower()
+    return COMMAND_TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+
+
+def echo_of(frame) -> bytes:
+    """The command line the console echoed at the start of a frame."""
+    return bytes(frame).lstrip(b"\r\n").split(b"\n", 1)[0].strip()
+
+
+def is_response(frame, command: str) -> bool:
+    """Tells whether `frame` is the whole answer to `command`, from its echo to the prompt.
+
+    A page of paged output, up to the pager's prompt, counts as a whole
+    answer too.
+    """
+    if PROMPT not in frame and CONTINUE not in frame:
+        return False
+    # An empty line only gets a prompt back
+    command = command.strip()
+    return not command or echo_of(frame) == command.encode("ascii")
+
+
+def is_paged(frame) -> bool:
+    """Tells whether the console stopped at the pager instead of its prompt."""
+    return CONTINUE in frame and PROMPT not in frame
+
+
+def count_frames(buffer) -> int:
+    """Returns how many complete frames the buffer holds."""
+    return buffer.count(PROMPT) + buffer.count(CONTINUE)
+
+
+def split_responses(buffer, commands) -> list:
+    """Splits a pipelined response stream into one payload per command.
+
+    Frames are cut after each prompt and matched to the commands by their
+    echo, so stray prompts are skipped and a command the console dropped
+    only loses its own payload. Commands without a frame get b"".
+    """
+    payloads = [b""] * len(commands)
+    echoes = [command.strip().encode("ascii") for command in commands]
+    index = 0
+    start = 0
+    while index < len(commands):
+        end = find_frame_end(buffer, start)
+        if end == -1:
+            break
+        frame = bytes(buffer[start:end])
+        start = end
+
+        echo = echo_of(frame)
+        for i in range(index, len(commands)):
+            if echo == echoes[i]:
+                payloads[i] = frame
+                index = i + 1
+                break
+    return payloads
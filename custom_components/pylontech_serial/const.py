@@ -10,3 +10,48 @@ DEFAULT_BAUD_RATE = 115200
 DEFAULT_POLL_INTERVAL = 15  # seconds
 CONF_BATTERY_CAPACITY = "battery_capacity"
 DEFAULT_BATTERY_CAPACITY = 2.4 # kWh (US2000 standard)
+CONF_STAT_INTERVAL = "stat_interval"
+DEFAULT_STAT_INTERVAL = 900  # seconds
+CONF_TIME_INTERVAL = "time_interval"
+DEFAULT_TIME_INTERVAL = 3600  # seconds
+CONF_CELL_BUDGET = "cell_budget"
+DEFAULT_CELL_BUDGET = 300  # ms of bus time per poll spent on 'bat' queries, 0 disables
+CONF_MODE = "mode"
+MODE_POLL = "poll"
+MODE_STREAM = "stream" # 'pwr' data pushed by the console's 'disp' command
+DEFAULT_MODE = MODE_POLL
+STREAM_COMMAND = "disp"
+CONF_PROTOCOL = "protocol"
+PROTOCOL_CONSOLE = "console"
+PROTOCOL_RS485 = "rs485" # framed protocol of the RS485 port, console commands aren't available
+DEFAULT_PROTOCOL = PROTOCOL_CONSOLE
+CONF_STATS_WINDOW = "stats_window"
+DEFAULT_STATS_WINDOW = 300  # seconds covered by the min/max/avg sensors
+# Sensor states are only written when they move past these deadbands
+CONF_DEADBAND_VOLTAGE = "deadband_voltage"
+DEFAULT_DEADBAND_VOLTAGE = 0.01  # V
+CONF_DEADBAND_CURRENT = "deadband_current"
+DEFAULT_DEADBAND_CURRENT = 0.1  # A
+CONF_DEADBAND_POWER = "deadband_power"
+DEFAULT_DEADBAND_POWER = 10  # W
+CONF_DEADBAND_POWER_RELATIVE = "deadband_power_relative"
+DEFAULT_DEADBAND_POWER_RELATIVE = 2  # % of the last written value
+CONF_DEADBAND_TEMPERATURE = "deadband_temperature"
+DEFAULT_DEADBAND_TEMPERATURE = 0.5  # °C
+CONF_DEADBAND_CELL_VOLTAGE = "deadband_cell_voltage"
+DEFAULT_DEADBAND_CELL_VOLTAGE = 2  # mV, cell min/max/delta and per-cell voltages
+CONF_HEARTBEAT = "heartbeat"
+DEFAULT_HEARTBEAT = 300  # seconds, states are rewritten at least this often
+CONF_BACKFILL = "backfill"
+DEFAULT_BACKFILL = False # reads the BMS history ('data history') into long-term statistics
+CONF_ADAPTIVE_POLL = "adaptive_poll"
+DEFAULT_ADAPTIVE_POLL = False # poll faster while the stack is busy, slower while idle
+CONF_MIN_POLL_INTERVAL = "min_poll_interval"
+DEFAULT_MIN_POLL_INTERVAL = 3  # seconds
+CONF_MAX_POLL_INTERVAL = "max_poll_interval"
+DEFAULT_MAX_POLL_INTERVAL = 120  # seconds
+CONF_TRANSCRIPT = "transcript"
+DEFAULT_TRANSCRIPT = False # records every raw console response to disk
+CONF_TRANSCRIPT_SIZE = "transcript_size"
+DEFAULT_TRANSCRIPT_SIZE = 256  # MB kept on disk, the oldest segments are removed
+TRANSCRIPT_DIR = "pylontech_transcripts"  # under the HA config directory, one folder per entry
@@ -1,237 +1,633 @@
 """DataUpdateCoordinator for Pylontech Serial."""
+import asyncio
 import logging
-import serial
 import time
-import threading
-from datetime import datetime, timedelta
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
-from .const import DOMAIN
-from .structs import PylontechSystem
-from .parser import PylontechParser
+from .const import (
+    DOMAIN, DEFAULT_STAT_INTERVAL, DEFAULT_TIME_INTERVAL, DEFAULT_CELL_BUDGET, DEFAULT_STATS_WINDOW,
+    DEFAULT_HEARTBEAT, DEFAULT_TRANSCRIPT_SIZE,
+    STREAM_COMMAND, PROTOCOL_RS485, DEFAULT_PROTOCOL,
+)
+from .structs import PylontechSystem, PylontechInfo
+from .parser import PylontechParser, PwrStreamParser, apply_batteries
+from .rs485 import (
+    CID2_ALARM, CID2_ANALOG, CID2_MANUFACTURER, FIRST_ADDRESS, MAX_MODULES, Rs485FrameError,
+    decode_frame, encode_frame, parse_alarm, parse_analog, parse_manufacturer, to_battery, to_cell_table,
+)
+from .scheduler import CommandScheduler, CellCollector, AdaptiveInterval
+from .history import PylontechHistory
+from .energy import EnergyCounter
+from .backfill import HistoryBackfill
+from .statefilter import StateFilter, changed_fields
+from .transcript import TranscriptRecorder
+from .transport import (
+    PylontechTransport, PylontechRS485Transport, PylontechTransportError, PylontechNoAnswerError,
+    PRIORITY_POLL, PRIORITY_TIME_SYNC, PRIORITY_USER,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+STORAGE_VERSION = 1
+# Energy counters are written at most this often
+ENERGY_SAVE_DELAY = 60  # seconds
+# Same for the last snapshot, it's only read back on startup
+SNAPSHOT_SAVE_DELAY = 60  # seconds
+
+# Max time an interactive command may wait behind a running poll
+USER_COMMAND_DEADLINE = 10  # seconds
+
+# Fields filled by 'info', remembered per stack barcode
+INFO_FIELDS = ("cell_count", "spec", "fw_version", "manufacturer", "model")
+
+def storage_key(entry_id, name: str) -> str:
+    """Key of the HA storage file holding `name` for a config entry."""
+    return f"{DOMAIN}.{entry_id}.{name}"
+
+def system_identifier(entry_id) -> tuple:
+    """Device registry identifier of the stack of a config entry."""
+    return (DOMAIN, f"{entry_id}_system")
+
+def module_identifier(entry_id, bat_id) -> tuple:
+    """Device registry identifier of a module of a config entry."""
+    return (DOMAIN, f"{entry_id}_battery_{bat_id}")
+
 class PylontechCoordinator(DataUpdateCoordinator):
     """Class to manage fetching data from the Pylontech battery."""
 
-    def __init__(self, hass: HomeAssistant, port, baud_rate, poll_interval, battery_capacity):
+    def __init__(self, hass: HomeAssistant, port, baud_rate, poll_interval, battery_capacity,
+                 stat_interval=DEFAULT_STAT_INTERVAL, time_interval=DEFAULT_TIME_INTERVAL,
+                 cell_budget=DEFAULT_CELL_BUDGET, stats_window=DEFAULT_STATS_WINDOW,
+                 deadbands=None, heartbeat=DEFAULT_HEARTBEAT, backfill=False, entry_id=None,
+                 poll_bounds=None, transcript_dir=None, transcript_size=DEFAULT_TRANSCRIPT_SIZE,
+                 protocol=DEFAULT_PROTOCOL):
         """Initialize."""
+        self.entry_id = entry_id
         self.port = port
         self.baud_rate = baud_rate
         self.battery_capacity = battery_capacity
-        self.serial = None
-        self._lock = threading.Lock()
+
+        # Optional raw transcript of everything read from the console
+        self.recorder = None
+        if transcript_dir:
+            self.recorder = TranscriptRecorder(transcript_dir, transcript_size * 1024 * 1024)
+            self.recorder.start()
+        # The console (text commands) or the RS485 port (binary frames)
+        self.protocol = protocol
+        if protocol == PROTOCOL_RS485:
+            self.transport = PylontechRS485Transport(port, baud_rate, recorder=self.recorder)
+        else:
+            self.transport = PylontechTransport(port, baud_rate, recorder=self.recorder)
+        # Round trips, queue waits, parse and cycle times (see metrics.py)
+        self.metrics = self.transport.metrics
+        # Latest raw responses, (time, command, bytes), only read on request
+        self.raw_responses = self.transport.recent
+        # RS485 addresses of the modules that answered the last probe
+        self._addresses = []
+
+        # 'pwr' runs on every poll, the slower commands only when due.
+        # 'info' runs whenever the port was (re)opened.
+        self.scheduler = CommandScheduler({"stat": stat_interval, "time": time_interval})
+        self._info_connection_id = None
+        # Latest 'info'/'stat'/'time' results, shared by every snapshot.
+        # Never changed in place once taken, see _edit_info().
+        self._info = PylontechInfo()
+        # Module rows reused between snapshots, see _claim_rows()
+        self._rows = ({}, {}, {})
+        self._pending_rows = None
+        # Set when the 'disp' stream updated the data since the last poll, which can then skip 'pwr'
+        self._streamed = False
+
+        # With (min, max) bounds, the poll interval follows the stack's activity
+        self.adaptive_interval = None
+        if poll_bounds:
+            self.adaptive_interval = AdaptiveInterval(poll_interval, *poll_bounds)
+
+        # 'bat N' reads, a few modules per poll within the budget (ms)
+        self.cell_collector = CellCollector(cell_budget / 1000.0)
+        self._cells = {}
+
+        # Recent samples for windowed statistics sensors
+        self.history = PylontechHistory()
+        self.stats_window = stats_window
+
+        # Sensors skip state writes for changes inside their deadband.
+        # changed_fields holds what moved in the latest snapshot (None: unknown).
+        self.state_filter = StateFilter(deadbands, heartbeat)
+        self.changed_fields = None
+
+        # Module id -> cell count of the latest snapshot, platforms are told when it changes
+        self.topology = None
+        self._topology_listeners = []
         
-        # Energy calculation state
-        self.last_update_time = None
-        self.system_energy_in = 0.0
-        self.system_energy_out = 0.0
+        # Energy calculation state, persisted across restarts
+        self.energy = EnergyCounter()
+        self._energy_store = Store(hass, STORAGE_VERSION, storage_key(entry_id, "energy"))
+
+        # Last snapshot and 'info' results, so entities exist before the port answers
+        self._snapshot_store = Store(hass, STORAGE_VERSION, storage_key(entry_id, "snapshot"))
+        self._info_by_barcode = {}
+        # Set after the first successful read of this run, restored data doesn't count
+        self._refreshed = False
+        # Store key -> monotonic time before which a delayed save is already pending
+        self._save_due = {}
+        # Set by async_shutdown, which may be called more than once
+        self._closed = False
         
+        # Optional import of the BMS's own history, run after polls
+        self.backfill = None
+        if backfill:
+            self.backfill = HistoryBackfill(
+                hass, self, Store(hass, STORAGE_VERSION, storage_key(entry_id, "history")), entry_id
+            )
+
         self.auto_sync_time = False # Configurable via switch/options
 
         super().__init__(
             hass,
             _LOGGER,
-            name=DOMAIN,
+            name=f"{DOMAIN} {port}",
             update_interval=timedelta(seconds=poll_interval),
         )
 
-    def _open_serial(self):
-        if self.serial is None:
-            _LOGGER.debug(f"Opening serial port {self.port} at {self.baud_rate}")
-            self.serial = serial.Serial(self.port, self.baud_rate, timeout=2)
-        elif not self.serial.is_open:
-             self.serial.open()
+    def system_device_info(self) -> dict:
+        return {
+            "identifiers": {system_identifier(self.entry_id)},
+            "name": "Pylontech Stack",
+            "manufacturer": "Pylontech",
+            "model": "US Series Stack", # Fallback, updated from data usually
+        }
+
+    def module_device_info(self, bat_id) -> dict:
+        return {
+            "identifiers": {module_identifier(self.entry_id, bat_id)},
+            "name": f"Pylontech Module {bat_id}",
+            "manufacturer": "Pylontech",
+            "model": "US Module",
+            "via_device": system_identifier(self.entry_id),
+        }
+
+    async def async_restore_energy(self):
+        """Load the energy counters saved by a previous run."""
+        data = await self._energy_store.async_load()
+        if data:
+            self.energy.restore(data)
+            _LOGGER.debug(f"Restored energy counters: in={self.energy.energy_in}, out={self.energy.energy_out}")
+
+    async def async_restore_snapshot(self) -> bool:
+        """Load the snapshot saved by a previous run as the current data.
+
+        Returns False when there is none, the first refresh then has to
+        wait for the port.
+        """
+        data = await self._snapshot_store.async_load()
+        if not data or not data.get("system"):
+            return False
+        try:
+            system = PylontechSystem.from_dict(data["system"])
+        except (TypeError, ValueError, KeyError) as e:
+            _LOGGER.warning(f"Ignoring the saved snapshot: {e}")
+            return False
 
-    def _close_serial(self):
-        if self.serial and self.serial.is_open:
-            self.serial.close()
-            self.serial = None
+        self._info_by_barcode = data.get("info", {})
+        info = self._info_by_barcode.get(system.barcode) if system.barcode else None
+        for name in INFO_FIELDS:
+            if info and info.get(name) is not None:
+                setattr(system, name, info[name])
+        self._info = system.info
+        self._cells = dict(system.cells)
+        self.topology = self._topology(system)
+        self.data = system
+        _LOGGER.debug(f"Restored snapshot with {len(system.batteries)} modules, saved {data.get('saved')}")
+        return True
+
+    def _snapshot_data(self) -> dict:
+        return {
+            "saved": datetime.now(timezone.utc).isoformat(),
+            "system": self.data.as_dict() if self.data is not None else None,
+            "info": self._info_by_barcode,
+        }
+
+    async def async_shutdown(self) -> None:
+        """Close the serial port and save the counters and snapshot, once.
+
+        Unloading the entry calls it too (DataUpdateCoordinator registers
+        it), the stores mustn't be written again after the teardown.
+        """
+        await super().async_shutdown()
+        if self._closed:
+            return
+        self._closed = True
+        if self.backfill is not None:
+            await self.backfill.async_shutdown()
+        await self.transport.close()
+        if self.recorder is not None:
+            await self.hass.async_add_executor_job(self.recorder.close)
+        await self._energy_store.async_save(self.energy.as_dict())
+        if self.data is not None:
+            await self._snapshot_store.async_save(self._snapshot_data())
 
     async def _async_update_data(self):
         """Fetch data from the device."""
-        # On first run, we might want to read info
-        if self.data is None:
-             await self.hass.async_add_executor_job(self._read_info_data)
-             
-             # Check auto-sync on first connection?
-             if self.auto_sync_time:
-                 await self.hass.async_add_executor_job(self.sync_time)
-
-        return await self.hass.async_add_executor_job(self._read_full_data)
-
-    def _read_info_data(self):
-        """Read device info once."""
-        with self._lock:
+        first_run = not self._refreshed
+        start = time.perf_counter()
+        try:
+            system = await self._async_read_full_data()
+        except UpdateFailed:
+            self._pending_rows = None
+            self.metrics.cycle_errors += 1
+            raise
+        self.metrics.cycle.observe(time.perf_counter() - start)
+        self._refreshed = True
+
+        # Check auto-sync on first connection?
+        if first_run and self.auto_sync_time:
+            await self.async_sync_time()
+
+        if self.backfill is not None:
+            self.backfill.schedule()
+
+        if system.batteries:
+            self._schedule_save(self._snapshot_store, self._snapshot_data, SNAPSHOT_SAVE_DELAY)
+
+        if self.adaptive_interval is not None:
+            interval = self.adaptive_interval.update(system)
+            if interval != self.update_interval.total_seconds():
+                _LOGGER.debug(f"Poll interval now {interval:.1f}s")
+                self.update_interval = timedelta(seconds=interval)
+
+        # Becomes the data as this returns, that keeps its rows from being claimed
+        self._pending_rows = None
+        return system
+
+    async def _async_read_full_data(self):
+        """Read data from the console or the RS485 port."""
+        try:
+            if self.protocol == PROTOCOL_RS485:
+                system = await self._async_read_rs485()
+            else:
+                system = await self._async_read_console()
+            self.changed_fields = changed_fields(self.data, system)
+            return system
+
+        except PylontechTransportError as e:
+            # The transport already closed the port, it's reopened on the next command
+            raise UpdateFailed(str(e))
+        except UpdateFailed:
+            # Logic error raised above
+            raise
+        except Exception as e:
+            # For other errors (parsing, etc), log but keep connection open
+            _LOGGER.error(f"Unexpected error updating data: {e}", exc_info=True)
+            raise UpdateFailed(f"Data update error: {e}")
+
+    async def _async_read_console(self) -> PylontechSystem:
+        """Reads 'pwr' and the due slower commands from the console.
+
+        While the 'disp' stream keeps the data current, 'pwr' is left out
+        and the snapshot is the latest streamed one, with what this poll read.
+        """
+        streamed = self._streamed and self.data is not None
+        commands = self.scheduler.due() if streamed else ["pwr"] + self.scheduler.due()
+        if not self.transport.connected or self.transport.connection_id != self._info_connection_id:
+            commands.insert(0, "info")
+
+        responses = {}
+        if commands:
+            # All due commands are written in one go and split back per command
+            _LOGGER.debug(f"Sending {commands} commands")
+            responses = dict(zip(commands, await self.transport.execute_batch(commands, PRIORITY_POLL)))
+
+        if not streamed:
+            raw_data_pwr = responses["pwr"]
+            if b"Power Volt" not in raw_data_pwr:
+                # Retry once, the console might have been busy with something else
+                raw_data_pwr = await self.transport.execute("pwr", PRIORITY_POLL)
+
+            if b"Power Volt" not in raw_data_pwr:
+                raise UpdateFailed("Did not receive valid 'pwr' response.")
+
+        # Slower commands update the cache, which is then merged into this snapshot
+        responses = {command: raw.decode("ascii", errors="ignore") for command, raw in responses.items() if command != "pwr"}
+        if responses.get("info"):
+            info = self._edit_info()
+            with self.metrics.time_parse("info"):
+                PylontechParser.parse_info(responses["info"], info)
+            _LOGGER.info(f"Parsed device info: Model={info.model}, Ver={info.fw_version}")
+            self._info_connection_id = self.transport.connection_id
+            if info.barcode:
+                self._info_by_barcode[info.barcode] = {name: getattr(info, name) for name in INFO_FIELDS}
+        fresh_stat = bool(responses.get("stat"))
+        if fresh_stat:
+            with self.metrics.time_parse("stat"):
+                PylontechParser.parse_stat(responses["stat"], self._edit_info())
+            self.scheduler.mark_done("stat")
+        if responses.get("time"):
+            with self.metrics.time_parse("time"):
+                PylontechParser.parse_time(responses["time"], self._edit_info())
+            self.scheduler.mark_done("time")
+
+        if streamed:
+            present = list(self.data.modules)
+        else:
+            system = self._build_snapshot(raw_data_pwr, rows=self._claim_rows(pending=True))
+            present = list(system.modules)
+        await self._async_collect_cells(present)
+        if self._streamed:
+            # A streamed table is newer than any 'pwr' read here (checked after the last await).
+            # Its samples were recorded as it came in, only info and cells are new.
+            self._streamed = False
+            system = replace(self.data, info=self._info, cells=dict(self._cells))
+        else:
+            system.cells = dict(self._cells)
+        if fresh_stat and system.batteries:
+            # Settle the energy since the previous reading from the BMS counters
+            self.energy.add_counters(self._info.discharged, self._info.coulomb, system.voltage, len(system.batteries))
+            self._apply_energy(system)
+
+        return system
+
+    async def _async_read_rs485(self) -> PylontechSystem:
+        """Reads the analog values and alarms of every module over RS485.
+
+        Cells come with the analog values, so every module's cells are
+        refreshed on every poll. The bus is probed for modules when the port
+        was (re)opened and every statistics interval.
+        """
+        if (not self.transport.connected or self.transport.connection_id != self._info_connection_id
+                or "stat" in self.scheduler.due()):
+            await self._async_probe_rs485()
+        if not self._addresses:
+            raise UpdateFailed("No module answered on the RS485 port.")
+
+        commands = []
+        for address in self._addresses:
+            commands.append(encode_frame(address, CID2_ANALOG, bytes([address])))
+            commands.append(encode_frame(address, CID2_ALARM, bytes([address])))
+        responses = await self.transport.execute_batch(commands, PRIORITY_POLL)
+
+        batteries = []
+        rows = self._claim_rows(pending=True)
+        now = time.monotonic()
+        self._cells.clear()
+        for index, address in enumerate(self._addresses):
+            module_id = address - FIRST_ADDRESS + 1
+            analog_raw, alarm_raw = responses[2 * index], responses[2 * index + 1]
             try:
-                self._open_serial()
-                self.serial.reset_input_buffer()
-                self.serial.write(b"\n")
-                time.sleep(0.1)
-                self.serial.read_all()
-
-                _LOGGER.debug("Sending 'info' command")
-                self.serial.write(b"info\n")
-                time.sleep(1.0)
-                
-                raw_data = self.serial.read_all().decode('ascii', errors='ignore')
-                
-                # Initialize system if needed, or use a temp one
-                # We store persistent data in self.data later, but here we can just parse into a temp object 
-                # or attach to self.device_info logic? 
-                # Actually, better to store 'info' fields in the main System object.
-                # But self.data might be None yet.
-                
-                # We will create a partial system to hold info logic if we want, 
-                # but typically this updates self.device_info or similar for HA entity registry.
-                # For now, let's just parse it and store it temporarily or structure it.
-                # The Parser expects a System object.
-                
-                temp_sys = PylontechSystem(0,0,0,0,0,0,0)
-                PylontechParser.parse_info(raw_data, temp_sys)
-                
-                # Store these so we can apply them to the main system object later
-                self._cached_info = temp_sys
-                
-                _LOGGER.info(f"Parsed device info: Model={temp_sys.model}, Ver={temp_sys.fw_version}")
-
-            except Exception as e:
-                _LOGGER.warning(f"Failed to fetch device info: {e}")
-
-    def _read_full_data(self):
-        """Read data from serial synchronously."""
-        with self._lock:
+                with self.metrics.time_parse("rs485_analog"):
+                    analog = parse_analog(decode_frame(analog_raw).info)
+            except Rs485FrameError as e:
+                _LOGGER.debug(f"No analog values from module {module_id}: {e}")
+                continue
+            try:
+                with self.metrics.time_parse("rs485_alarm"):
+                    alarm = parse_alarm(decode_frame(alarm_raw).info)
+            except Rs485FrameError as e:
+                _LOGGER.debug(f"No alarm info from module {module_id}: {e}")
+                alarm = None
+            batteries.append(to_battery(module_id, analog, alarm, rows.get(module_id)))
+            self._cells[module_id] = to_cell_table(module_id, analog, now)
+            if module_id == 1 and (analog.cycles, len(analog.cell_voltages)) != (self._info.cycles, self._info.cell_count):
+                info = self._edit_info()
+                info.cycles = analog.cycles
+                info.cell_count = len(analog.cell_voltages)
+
+        if not batteries:
+            raise UpdateFailed("Did not receive valid RS485 analog values.")
+        return self._build_snapshot(batteries=batteries, rows=rows)
+
+    async def _async_probe_rs485(self):
+        """Finds the modules on the bus, they answer from consecutive addresses."""
+        addresses = []
+        for address in range(FIRST_ADDRESS, FIRST_ADDRESS + MAX_MODULES):
+            try:
+                await self.transport.execute(encode_frame(address, CID2_ANALOG, bytes([address])), PRIORITY_POLL)
+            except PylontechNoAnswerError:
+                break
+            addresses.append(address)
+        if addresses != self._addresses:
+            _LOGGER.info(f"Found {len(addresses)} modules on the RS485 port")
+        self._addresses = addresses
+
+        if addresses and self.transport.connection_id != self._info_connection_id:
             try:
-                self._open_serial()
-                
-                self.serial.reset_input_buffer()
-                self.serial.write(b"\n")
-                time.sleep(0.1)
-                self.serial.read_all()
-
-                # 1. PWR
-                _LOGGER.debug("Sending 'pwr' command")
-                self.serial.write(b"pwr\n")
-                time.sleep(1.0)
-                raw_data_pwr = self.serial.read_all().decode('ascii', errors='ignore')
-                
-                if "Power Volt" not in raw_data_pwr:
-                    # Retry once
-                    time.sleep(1.0)
-                    raw_data_pwr = self.serial.read_all().decode('ascii', errors='ignore')
-
-                if "Power Volt" not in raw_data_pwr:
-                     raise UpdateFailed("Did not receive valid 'pwr' response.")
-
-                # 2. STAT
-                _LOGGER.debug("Sending 'stat' command")
-                self.serial.write(b"stat\n")
-                time.sleep(1.0)
-                raw_data_stat = self.serial.read_all().decode('ascii', errors='ignore')
-
-                # 3. TIME
-                _LOGGER.debug("Sending 'time' command")
-                self.serial.write(b"time\n")
-                time.sleep(0.5)
-                raw_data_time = self.serial.read_all().decode('ascii', errors='ignore')
-
-                # Prepare System Object
-                # Reuse existing if possible to keep energy counters? 
-                # Actually energy counters are stored in self.system_energy_in/out variables in init.
-                # So we can create a fresh object and populate it.
-                
-                # Initialize from cached info if available
-                if hasattr(self, '_cached_info'):
-                    system = self._cached_info
-                    # Reset dynamic values?
-                    # The parser overwrites them anyway or assumes defaults.
-                    # But better to create strict object.
-                    # Lets create new and copy info.
-                    info = self._cached_info
-                    system = PylontechSystem(
-                        voltage=0, current=0, soc=0, power=0, 
-                        energy_in=self.system_energy_in, 
-                        energy_out=self.system_energy_out, 
-                        energy_stored=0,
-                        cell_count=info.cell_count,
-                        spec=info.spec,
-                        barcode=info.barcode,
-                        fw_version=info.fw_version,
-                        manufacturer=info.manufacturer,
-                        model=info.model
-                    )
-                else:
-                    system = PylontechSystem(0,0,0,0, self.system_energy_in, self.system_energy_out, 0)
-
-                # Parse
-                PylontechParser.parse_pwr(raw_data_pwr, system)
-                PylontechParser.parse_stat(raw_data_stat, system)
-                PylontechParser.parse_time(raw_data_time, system)
-                
-                # Update Energy Integration
-                self._update_energy(system)
-                
-                # Update Energy Stored
-                # Formula: Count * Cap * SOC%
-                count = len(system.batteries)
-                if count > 0:
-                    system.energy_stored = round(count * self.battery_capacity * (system.soc / 100.0), 3)
-
-                return system
-
-            except serial.SerialException as e:
-                self._close_serial()
-                raise UpdateFailed(f"Serial Error: {e}")
-            except UpdateFailed:
-                # Logic error raised above, do not close serial
-                raise
-            except Exception as e:
-                # If we hit the FD limit, we must close
-                if "filedescriptor out of range" in str(e):
-                    self._close_serial()
-                    raise UpdateFailed(f"serial error: {e}")
-                
-                 # For other errors (parsing, etc), log but keep connection open
-                _LOGGER.error(f"Unexpected error updating data: {e}", exc_info=True)
-                raise UpdateFailed(f"Data update error: {e}")
-
-    def _update_energy(self, system: PylontechSystem):
-        now = datetime.now()
-        if self.last_update_time:
-            time_diff = (now - self.last_update_time).total_seconds() / 3600.0
-            energy_kwh = (system.power * time_diff) / 1000.0
-            
-            if system.power >= 0:
-                self.system_energy_in += abs(energy_kwh)
+                raw = await self.transport.execute(encode_frame(FIRST_ADDRESS, CID2_MANUFACTURER), PRIORITY_POLL)
+                info = parse_manufacturer(decode_frame(raw).info)
+            except (PylontechNoAnswerError, Rs485FrameError) as e:
+                _LOGGER.debug(f"No manufacturer info: {e}")
             else:
-                self.system_energy_out += abs(energy_kwh)
+                cached = self._edit_info()
+                cached.model = info.device
+                cached.fw_version = info.software
+                cached.manufacturer = info.manufacturer
+                _LOGGER.info(f"Parsed device info: Model={cached.model}, Ver={cached.fw_version}")
+            self._info_connection_id = self.transport.connection_id
+        self.scheduler.mark_done("stat")
+
+    def _edit_info(self) -> PylontechInfo:
+        """Copy of the cached info to update, older snapshots keep the one they have."""
+        self._info = replace(self._info)
+        return self._info
+
+    def _claim_rows(self, pending: bool = False) -> dict:
+        """A module index whose rows the next snapshot may overwrite.
+
+        One the current snapshot (what entities read and the next one is
+        diffed against) doesn't use, nor the snapshot of a poll still being
+        read: stream tables arrive while a poll waits for its cells. With
+        `pending`, the index stays claimed until the poll ends.
+        """
+        current = self.data.modules if self.data is not None else None
+        rows = next(rows for rows in self._rows if rows is not current and rows is not self._pending_rows)
+        if pending:
+            self._pending_rows = rows
+        return rows
+
+    def _build_snapshot(self, raw_data_pwr=None, batteries=None, rows=None) -> PylontechSystem:
+        """Builds a snapshot from a 'pwr' table (or modules read over RS485) and the cached slower data.
+
+        `rows` is the module index to reuse, one is claimed if not given.
+        """
+        # Energy counters are kept in self.energy,
+        # so we can create a fresh object and populate it.
+        system = PylontechSystem(0,0,0,0, self.energy.energy_in, self.energy.energy_out, 0, info=self._info)
+        if batteries is None:
+            with self.metrics.time_parse("pwr"):
+                PylontechParser.parse_pwr(raw_data_pwr, system, self._claim_rows() if rows is None else rows)
+        else:
+            apply_batteries(system, batteries, rows)
+        system.cells = dict(self._cells)
+        if system.batteries:
+            self.history.record(system)
         
-        self.last_update_time = now
-        system.energy_in = round(self.system_energy_in, 3)
-        system.energy_out = round(self.system_energy_out, 3)
+        # Update Energy Integration
+        if system.batteries:
+            self.energy.add_sample(time.monotonic(), system.power)
+            self._apply_energy(system)
+        
+        # Update Energy Stored
+        # Formula: Count * Cap * SOC%
+        count = len(system.batteries)
+        if count > 0:
+            system.energy_stored = round(count * self.battery_capacity * (system.soc / 100.0), 3)
+
+        return system
+
+    @property
+    def reads_cells(self) -> bool:
+        """Whether cell tables are read at all, RS485 gets them with every poll."""
+        return self.protocol == PROTOCOL_RS485 or self.cell_collector.budget > 0
+
+    @staticmethod
+    def _topology(system: PylontechSystem) -> dict:
+        """Module id -> cell count of a snapshot, 0 while the count isn't known."""
+        return {
+            module_id: system.cells[module_id].cell_count if module_id in system.cells else system.cell_count or 0
+            for module_id in system.modules
+        }
 
-    def send_raw_command(self, command: str):
-        with self._lock:
+    @callback
+    def async_add_topology_listener(self, update_callback):
+        """Calls `update_callback(added, removed)` when modules come or go.
+
+        A module whose cell count became known, or changed, counts as added
+        again. The counts are in `topology`. Returns a function that
+        removes the listener.
+        """
+        self._topology_listeners.append(update_callback)
+
+        @callback
+        def remove_listener():
+            self._topology_listeners.remove(update_callback)
+
+        return remove_listener
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Checks the module topology before the entities update."""
+        if self.data is not None and self.data.batteries:
+            topology = self._topology(self.data)
+            if topology != self.topology:
+                previous = self.topology or {}
+                self.topology = topology
+                added = {module_id for module_id, cells in topology.items() if previous.get(module_id) != cells}
+                removed = previous.keys() - topology.keys()
+                if topology.keys() != previous.keys():
+                    _LOGGER.info(f"Module topology changed, added: {sorted(topology.keys() - previous.keys())}, removed: {sorted(removed)}")
+                for update_callback in list(self._topology_listeners):
+                    update_callback(added, removed)
+        super().async_update_listeners()
+
+    def start_streaming(self):
+        """Switches 'pwr' data to the console's 'disp' stream.
+
+        Regular refreshes keep running for the slower commands and cells,
+        the transport pauses the stream around them. They only read 'pwr'
+        when no table streamed in since the previous one.
+        """
+        stream_parser = PwrStreamParser()
+
+        @callback
+        def _handle_stream_data(chunk: bytes):
+            for table in stream_parser.feed(chunk):
+                self.raw_responses.append((time.time(), STREAM_COMMAND, table))
+                system = self._build_snapshot(table)
+                if system.batteries:
+                    # Not async_set_updated_data, that would keep postponing the regular refresh
+                    self.changed_fields = changed_fields(self.data, system)
+                    self.data = system
+                    self._streamed = True
+                    self.async_update_listeners()
+
+        # Tables cut by a pause are dropped, not taken for complete ones
+        self.transport.start_stream(STREAM_COMMAND, _handle_stream_data, stream_parser.reset)
+
+    async def _async_collect_cells(self, present: list):
+        """Reads the cells of the next modules in line, `present` are the module ids."""
+        # Forget modules that went away
+        for module_id in list(self._cells):
+            if module_id not in present:
+                del self._cells[module_id]
+
+        modules = self.cell_collector.pick(present)
+        if modules:
+            commands = [f"bat {module_id}" for module_id in modules]
+            start = time.monotonic()
             try:
-                self._open_serial()
-                self.serial.reset_input_buffer()
-                self.serial.write(b"\n")
-                
-                cmd_bytes = command.encode("ascii") + b"\n"
-                self.serial.write(cmd_bytes)
-                time.sleep(0.5)
-                return self.serial.read_all().decode('ascii', errors='ignore')
-            except Exception as e:
-                _LOGGER.error(f"Error sending raw command: {e}")
-                raise e
-
-    def sync_time(self):
+                responses = await self.transport.execute_batch(commands, PRIORITY_POLL)
+            except PylontechTransportError as e:
+                # Keep the 'pwr' data, cells are retried on the next poll
+                _LOGGER.debug(f"Could not read cells: {e}")
+                responses = []
+            now = time.monotonic()
+            self.cell_collector.record(len(responses), now - start)
+
+            for module_id, raw in zip(modules, responses):
+                self._store_cells(module_id, raw, now)
+
+    def _store_cells(self, module_id: int, raw: bytes, now: float):
+        """Parses a 'bat' table into the module's cell table."""
+        with self.metrics.time_parse("bat"):
+            table = PylontechParser.parse_cell_table(raw, module_id, now)
+        if table is not None:
+            self._cells[module_id] = table
+
+    def _apply_energy(self, system: PylontechSystem):
+        system.energy_in = round(self.energy.energy_in, 3)
+        system.energy_out = round(self.energy.energy_out, 3)
+        self._schedule_save(self._energy_store, self.energy.as_dict, ENERGY_SAVE_DELAY)
+
+    def _schedule_save(self, store: Store, data_func, delay: float):
+        """Saves `store` within `delay` seconds.
+
+        async_delay_save alone pushes the write back on every call, with a
+        poll every few seconds it would only happen on shutdown.
+        """
+        now = time.monotonic()
+        if now >= self._save_due.get(store.key, 0):
+            self._save_due[store.key] = now + delay
+            store.async_delay_save(data_func, delay)
+
+    def get_raw_responses(self, command: str = None, limit: int = None) -> list:
+        """Latest raw responses, oldest first, optionally only those to `command` (its first word)."""
+        responses = [
+            {
+                "time": datetime.fromtimestamp(received, timezone.utc).isoformat(),
+                "command": sent,
+                "response": response.decode("ascii", errors="ignore"),
+            }
+            for received, sent, response in self.raw_responses
+            if command is None or sent.split(" ", 1)[0] == command
+        ]
+        return responses[-limit:] if limit else responses
+
+    async def async_send_raw_command(self, command: str) -> str:
+        """Sends a user command ahead of any queued poll."""
+        if self.protocol == PROTOCOL_RS485:
+            raise PylontechTransportError("Console commands aren't available with the RS485 protocol")
+        deadline = asyncio.get_running_loop().time() + USER_COMMAND_DEADLINE
+        try:
+            response = await self.transport.execute(command, PRIORITY_USER, deadline=deadline)
+            return response.decode("ascii", errors="ignore")
+        except Exception as e:
+            _LOGGER.error(f"Error sending raw command: {e}")
+            raise e
+
+    async def async_sync_time(self):
         """Syncs the BMS time with HA time."""
+        if self.protocol == PROTOCOL_RS485:
+            raise PylontechTransportError("The BMS clock can only be set from the console")
         cmd = PylontechParser.generate_time_command(datetime.now())
         _LOGGER.info(f"Syncing time with command: {cmd}")
-        return self.send_raw_command(cmd)
+        deadline = asyncio.get_running_loop().time() + USER_COMMAND_DEADLINE
+        response = await self.transport.execute(cmd, PRIORITY_TIME_SYNC, deadline=deadline)
+        # Read the new clock back on the next poll
+        self.scheduler.invalidate("time")
+        return response.decode("ascii", errors="ignore")
 
     def set_auto_sync(self, enabled: bool):
         self.auto_sync_time = enabled
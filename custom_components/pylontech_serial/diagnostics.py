@@ -0,0 +1,46 @@
+"""Diagnostics support for Pylontech Serial."""
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+
+# Serial numbers identify the owner's modules
+TO_REDACT = {"barcode"}
+REDACTED = "**REDACTED**"
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    """Return diagnostics for a config entry."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    transport = coordinator.transport
+    breaker = transport.breaker
+
+    # 'info' prints the barcode too
+    barcode = coordinator.data.barcode if coordinator.data is not None else None
+    raw_responses = coordinator.get_raw_responses()
+    if barcode:
+        for response in raw_responses:
+            response["response"] = response["response"].replace(barcode, REDACTED)
+
+    snapshot = coordinator.data.as_dict() if coordinator.data is not None else None
+
+    return {
+        "entry": {
+            "data": dict(entry.data),
+            "options": dict(entry.options),
+        },
+        "link": {
+            "protocol": coordinator.protocol,
+            "connected": transport.connected,
+            "connection_id": transport.connection_id,
+            "breaker": breaker.state,
+            "failures": breaker.failures,
+            "retry_in": round(breaker.retry_in, 1),
+        },
+        "poll_interval": coordinator.update_interval.total_seconds() if coordinator.update_interval else None,
+        "last_update_success": coordinator.last_update_success,
+        "metrics": coordinator.metrics.as_dict(),
+        "data": async_redact_data(snapshot, TO_REDACT) if snapshot is not None else None,
+        "raw_responses": raw_responses,
+    }
@@ -0,0 +1,118 @@
+"""Charge and discharge energy accounting for Pylontech Serial."""
+
+# Gaps longer than this are not integrated, the counters cover them
+MAX_INTEGRATION_GAP = 600  # seconds
+
+
+class EnergyCounter:
+    """Charged and discharged energy of the stack, in kWh.
+
+    The BMS keeps its own coulomb counters ('stat': Dsg Cap, the total
+    discharged mAh, and Pwr Coulomb, the charge left). Whenever they are
+    read, the energy since the previous reading is derived from their
+    deltas: discharged = ΔDsg Cap, charged = ΔPwr Coulomb + ΔDsg Cap, times
+    the mean stack voltage. 'stat' describes the addressed module, so the
+    result is scaled by the module count (parallel modules share the
+    current). Between readings, or without counters, power samples are
+    integrated with the trapezoidal rule; that provisional energy is
+    replaced by the counter delta once it's available.
+
+    Reported totals never go down, as they feed TOTAL_INCREASING sensors.
+    """
+
+    def __init__(self):
+        # Energy settled by counter readings (or integration without counters)
+        self._settled_in = 0.0
+        self._settled_out = 0.0
+        # Integrated since the last counter reading
+        self._provisional_in = 0.0
+        self._provisional_out = 0.0
+        self._reported_in = 0.0
+        self._reported_out = 0.0
+        # (discharged mAh, remaining mAh, voltage) at the last counter reading
+        self._anchor = None
+        self._last_sample = None
+
+    @property
+    def energy_in(self) -> float:
+        return self._reported_in
+
+    @property
+    def energy_out(self) -> float:
+        return self._reported_out
+
+    def add_sample(self, timestamp: float, power: float):
+        """Integrates a power reading (W, positive while charging)."""
+        if self._last_sample is not None:
+            last_time, last_power = self._last_sample
+            elapsed = timestamp - last_time
+            if 0 < elapsed <= MAX_INTEGRATION_GAP:
+                charged, discharged = _trapezoid(last_power, power, elapsed)
+                self._provisional_in += charged
+                self._provisional_out += discharged
+        self._last_sample = (timestamp, power)
+        self._report()
+
+    def add_counters(self, discharged: int, remaining: int, voltage: float, modules: int):
+        """Settles the energy since the previous counter reading (mAh, V)."""
+        if discharged is None or remaining is None or not voltage or not modules:
+            return
+
+        anchor = self._anchor
+        self._anchor = (discharged, remaining, voltage)
+        if anchor is None or discharged < anchor[0]:
+            # First reading or counters were reset, keep what was integrated
+            self._settle_provisional()
+            return
+
+        mean_voltage = (voltage + anchor[2]) / 2.0
+        delta_discharged = discharged - anchor[0]
+        delta_charged = max(0, (remaining - anchor[1]) + delta_discharged)
+        # mAh * V = mWh
+        self._settled_in += delta_charged * mean_voltage * modules / 1e6
+        self._settled_out += delta_discharged * mean_voltage * modules / 1e6
+        self._provisional_in = 0.0
+        self._provisional_out = 0.0
+        self._report()
+
+    def _settle_provisional(self):
+        self._settled_in += self._provisional_in
+        self._settled_out += self._provisional_out
+        self._provisional_in = 0.0
+        self._provisional_out = 0.0
+        self._report()
+
+    def _report(self):
+        self._reported_in = max(self._reported_in, self._settled_in + self._provisional_in)
+        self._reported_out = max(self._reported_out, self._settled_out + self._provisional_out)
+
+    def as_dict(self) -> dict:
+        """State to persist, integration in progress is settled as is."""
+        return {
+            "energy_in": self._reported_in,
+            "energy_out": self._reported_out,
+            "anchor": list(self._anchor) if self._anchor else None,
+        }
+
+    def restore(self, data: dict):
+        self._settled_in = self._reported_in = float(data.get("energy_in", 0.0))
+        self._settled_out = self._reported_out = float(data.get("energy_out", 0.0))
+        self._provisional_in = self._provisional_out = 0.0
+        anchor = data.get("anchor")
+        self._anchor = tuple(anchor) if anchor else None
+
+
+def _trapezoid(p0: float, p1: float, seconds: float):
+    """Returns (charged, discharged) kWh between two power readings."""
+    hours = seconds / 3600.0
+    if p0 >= 0 and p1 >= 0:
+        return (p0 + p1) / 2.0 * hours / 1000.0, 0.0
+    if p0 <= 0 and p1 <= 0:
+        return 0.0, -(p0 + p1) / 2.0 * hours / 1000.0
+    # Sign change, split at the zero crossing
+    crossing = p0 / (p0 - p1)
+    first = p0 / 2.0 * crossing * hours / 1000.0
+    second = p1 / 2.0 * (1 - crossing) * hours / 1000.0
+    if p0 > 0:
+        return first, -second
+    return second, -first
@@ -0,0 +1,103 @@
+"""In-memory sample history for windowed statistics."""
+import time
+from array import array
+
+# Samples kept per ring, enough for a long window even in stream mode
+HISTORY_SIZE = 1024
+
+STACK_FIELDS = ("voltage", "current", "power", "soc")
+MODULE_FIELDS = ("voltage", "current", "temperature", "soc", "power")
+
+
+class SampleRing:
+    """Fixed-size ring of timestamped samples, one flat array per field.
+
+    Values are stored as 32-bit floats next to a float64 timestamp column,
+    so a full ring of four fields takes about 24 KB no matter how long the
+    coordinator runs.
+    """
+
+    def __init__(self, fields, capacity: int = HISTORY_SIZE):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._columns = {name: array("f", bytes(4 * capacity)) for name in self.fields}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, source):
+        """Stores one sample, reading every field as an attribute of `source`."""
+        slot = self._next
+        self._times[slot] = timestamp
+        for name, column in self._columns.items():
+            column[slot] = getattr(source, name)
+        self._next = (slot + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _slots(self, seconds: float, now: float):
+        """Yields the slots inside the window, newest first."""
+        cutoff = now - seconds
+        slot = self._next
+        for _ in range(self._count):
+            slot = (slot - 1) % self.capacity
+            if self._times[slot] < cutoff:
+                break
+            yield slot
+
+    def stats(self, field: str, seconds: float, now: float = None):
+        """Returns min/max/avg/count of a field over the last `seconds`, or None."""
+        if now is None:
+            now = time.monotonic()
+        column = self._columns[field]
+        values = [column[slot] for slot in self._slots(seconds, now)]
+        if not values:
+            return None
+        return {
+            "min": min(values),
+            "max": max(values),
+            "avg": sum(values) / len(values),
+            "count": len(values),
+        }
+
+    def peak(self, field: str, seconds: float, now: float = None):
+        """Returns the value with the largest magnitude over the window, or None."""
+        if now is None:
+            now = time.monotonic()
+        column = self._columns[field]
+        return max((column[slot] for slot in self._slots(seconds, now)), key=abs, default=None)
+
+    def rate(self, field: str, seconds: float, now: float = None):
+        """Returns the change of a field per hour over the window, or None."""
+        if now is None:
+            now = time.monotonic()
+        slots = list(self._slots(seconds, now))
+        if len(slots) < 2:
+            return None
+        newest, oldest = slots[0], slots[-1]
+        elapsed = self._times[newest] - self._times[oldest]
+        if elapsed <= 0:
+            return None
+        column = self._columns[field]
+        return (column[newest] - column[oldest]) / elapsed * 3600.0
+
+
+class PylontechHistory:
+    """Recent samples of the stack and of every module."""
+
+    def __init__(self, capacity: int = HISTORY_SIZE):
+        self.capacity = capacity
+        self.stack = SampleRing(STACK_FIELDS, capacity)
+        self.modules = {}
+
+    def record(self, system, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.stack.append(timestamp, system)
+        for bat in system.batteries:
+            ring = self.modules.get(bat.sys_id)
+            if ring is None:
+                ring = self.modules[bat.sys_id] = SampleRing(MODULE_FIELDS, self.capacity)
+            ring.append(timestamp, bat)
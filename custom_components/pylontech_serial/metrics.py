@@ -0,0 +1,203 @@
+"""Timing and traffic counters for the serial link.
+
+Kept free of Home Assistant so pylon2mqtt can export the same numbers.
+Histograms use fixed buckets, like Prometheus: observing is one bisect
+and the memory doesn't grow with the number of samples.
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Upper bounds of the buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PARSE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class Histogram:
+    """Counts observations per bucket, quantiles are estimated from them."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One more for the values above the last bound (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimates the q-quantile, interpolating inside its bucket like histogram_quantile()."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    # Nothing to interpolate towards past the last bound
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def as_dict(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class CommandMetrics:
+    """Round trips of one request, as sent on the wire."""
+
+    __slots__ = ("latency", "bytes_read", "errors", "retries")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.bytes_read = 0
+        self.errors = 0
+        self.retries = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "latency": self.latency.as_dict(),
+            "bytes_read": self.bytes_read,
+            "errors": self.errors,
+            "retries": self.retries,
+        }
+
+
+class LinkMetrics:
+    """Everything measured on one port.
+
+    Commands are keyed by name: the first word of a console command, the
+    commands of a pipelined batch joined with '+', or 'rs485_' and the
+    request (analog, alarm...) for RS485 frames. `queue_wait` is the time a request sat in the transport's
+    queue, behind the port's lock holder, before it was sent.
+    """
+
+    def __init__(self):
+        self.commands: Dict[str, CommandMetrics] = {}
+        self.round_trip = Histogram()
+        self.queue_wait = Histogram()
+        self.parse: Dict[str, Histogram] = {}
+        self.parse_total = Histogram(PARSE_BUCKETS)
+        self.cycle = Histogram()
+        self.cycle_errors = 0
+        self.started = time.time()
+
+    def command(self, name: str) -> CommandMetrics:
+        metrics = self.commands.get(name)
+        if metrics is None:
+            metrics = self.commands[name] = CommandMetrics()
+        return metrics
+
+    def observe_command(self, name: str, seconds: float, size: int):
+        metrics = self.command(name)
+        metrics.latency.observe(seconds)
+        metrics.bytes_read += size
+        self.round_trip.observe(seconds)
+
+    def count_error(self, name: str):
+        self.command(name).errors += 1
+
+    def count_retry(self, name: str):
+        self.command(name).retries += 1
+
+    def observe_parse(self, name: str, seconds: float):
+        histogram = self.parse.get(name)
+        if histogram is None:
+            histogram = self.parse[name] = Histogram(PARSE_BUCKETS)
+        histogram.observe(seconds)
+        self.parse_total.observe(seconds)
+
+    @contextmanager
+    def time_parse(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_parse(name, time.perf_counter() - start)
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(metrics.bytes_read for metrics in self.commands.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(metrics.errors for metrics in self.commands.values())
+
+    @property
+    def retries(self) -> int:
+        return sum(metrics.retries for metrics in self.commands.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "uptime": round(time.time() - self.started),
+            "bytes_read": self.bytes_read,
+            "errors": self.errors,
+            "retries": self.retries,
+            "round_trip": self.round_trip.as_dict(),
+            "queue_wait": self.queue_wait.as_dict(),
+            "cycle": self.cycle.as_dict(),
+            "cycle_errors": self.cycle_errors,
+            "commands": {name: metrics.as_dict() for name, metrics in sorted(self.commands.items())},
+            "parse": {name: histogram.as_dict() for name, histogram in sorted(self.parse.items())},
+        }
+
+    def prometheus(self, prefix: str = "pylontech") -> str:
+        """Renders everything in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f"# HELP {prefix}_{name} {text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def histogram(name, histogram, labels=""):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{prefix}_{name}_sum{suffix} {histogram.sum}")
+            lines.append(f"{prefix}_{name}_count{suffix} {histogram.count}")
+
+        header("command_duration_seconds", "histogram", "Round trip of a request on the serial port.")
+        for name, metrics in sorted(self.commands.items()):
+            histogram("command_duration_seconds", metrics.latency, f'command="{name}"')
+        for name, attr, text in (
+            ("command_bytes_read_total", "bytes_read", "Bytes read in response to a request."),
+            ("command_errors_total", "errors", "Requests that failed on the port."),
+            ("command_retries_total", "retries", "Requests re-sent after a resync."),
+        ):
+            header(name, "counter", text)
+            for command, metrics in sorted(self.commands.items()):
+                lines.append(f'{prefix}_{name}{{command="{command}"}} {getattr(metrics, attr)}')
+
+        header("queue_wait_seconds", "histogram", "Time a request waited for the port.")
+        histogram("queue_wait_seconds", self.queue_wait)
+        header("parse_duration_seconds", "histogram", "Time spent parsing a response.")
+        for name, parse in sorted(self.parse.items()):
+            histogram("parse_duration_seconds", parse, f'parser="{name}"')
+        header("cycle_duration_seconds", "histogram", "Time to read a full snapshot.")
+        histogram("cycle_duration_seconds", self.cycle)
+        header("cycle_errors_total", "counter", "Snapshots that couldn't be read.")
+        lines.append(f"{prefix}_cycle_errors_total {self.cycle_errors}")
+        return "\n".join(lines) + "\n"
@@ -1,80 +1,357 @@
 import re
 import logging
 from datetime import datetime
-from .structs import PylontechSystem, PylontechBattery
+from typing import Dict, List, Optional
+from .structs import PylontechSystem, PylontechBattery, PylontechCell, PylontechCellTable, PylontechHistoryRecord
 
 _LOGGER = logging.getLogger(__name__)
 
+# Header layouts seen so far, keyed by the raw header line. There is one per
+# table and firmware, so this stays tiny.
+_LAYOUTS = {}
+_MAX_LAYOUTS = 16
+
+# Dates in history records: 2025-12-21 20:53:06 or 25-12-21 20:53:06
+_HISTORY_TIME = re.compile(r"(\d{2,4})[-/](\d{1,2})[-/](\d{1,2})[ T]+(\d{1,2}):(\d{2}):(\d{2})")
+
+
+class TableLayout:
+    """Column map of a fixed-width console table, built from its header line.
+
+    Column names may hold a single space ("Base State"), columns are
+    separated by at least two. The first column is the row id and is always
+    on its own ("Power Volt" is two columns). Each column spans from its
+    header start to the start of the next one, so values with spaces
+    ("2025-12-21 20:53:06", "89%      42586 mAH") stay in one field.
+    """
+
+    __slots__ = ("spans",)
+
+    def __init__(self, header: bytes):
+        tokens = [(m.start(), m.end(), m.group()) for m in re.finditer(rb"\S+", header)]
+        merged = []
+        for start, end, name in tokens:
+            if len(merged) > 1 and start - merged[-1][1] == 1:
+                prev_start, _, prev_name = merged[-1]
+                merged[-1] = (prev_start, end, prev_name + b" " + name)
+            else:
+                merged.append((start, end, name))
+
+        self.spans = {}
+        for i, (start, _, name) in enumerate(merged):
+            end = merged[i + 1][0] if i + 1 < len(merged) else None
+            self.spans[name.decode("ascii", errors="ignore")] = (start, end)
+
+    @classmethod
+    def for_header(cls, header: bytes) -> "TableLayout":
+        layout = _LAYOUTS.get(header)
+        if layout is None:
+            if len(_LAYOUTS) >= _MAX_LAYOUTS:
+                _LAYOUTS.clear()
+            layout = _LAYOUTS[header] = cls(header)
+        return layout
+
+    def span(self, *names):
+        """Returns the span of the first column present, or None."""
+        for name in names:
+            if name in self.spans:
+                return self.spans[name]
+        return None
+
+
+def _field(raw: bytes, line_start: int, line_end: int, span) -> bytes:
+    """Slices one column out of a table row without splitting the line."""
+    if span is None:
+        return b""
+    start = line_start + span[0]
+    end = line_end if span[1] is None else min(line_start + span[1], line_end)
+    return raw[start:end]
+
+
+def _to_bytes(raw) -> bytes:
+    if isinstance(raw, str):
+        return raw.encode("ascii", errors="ignore")
+    return bytes(raw)
+
+
+def _table_rows(raw: bytes, header_prefix: bytes):
+    """Finds a table by the start of its header.
+
+    Returns the layout and the (start, end) offsets of every data row, a row
+    being a line that starts with a digit. The table ends at the first line
+    that isn't a row.
+    """
+    pos = raw.find(header_prefix)
+    if pos == -1:
+        return None, []
+    line_end = raw.find(b"\n", pos)
+    if line_end == -1:
+        return None, []
+    layout = TableLayout.for_header(raw[pos:line_end].rstrip(b"\r"))
+
+    rows = []
+    pos = line_end + 1
+    length = len(raw)
+    while pos < length:
+        line_end = raw.find(b"\n", pos)
+        if line_end == -1:
+            line_end = length
+        start = pos
+        while start < line_end and raw[start] == 0x0D:  # \r
+            start += 1
+        end = line_end
+        while end > start and raw[end - 1] == 0x0D:
+            end -= 1
+        if start == end or not 0x30 <= raw[start] <= 0x39:
+            break
+        rows.append((start, end))
+        pos = line_end + 1
+    return layout, rows
+
+
+def _status(raw: bytes, line_start: int, line_end: int, span) -> Optional[str]:
+    if span is None:
+        return None
+    return _field(raw, line_start, line_end, span).strip().decode("ascii", errors="ignore") or None
+
+
+def _percent(value: bytes) -> int:
+    """Parses the leading percentage of a Coulomb column ("89%", "89%  42586 mAH")."""
+    return int(value.split(b"%", 1)[0])
+
+
+class PwrStreamParser:
+    """Incrementally cuts 'pwr' tables out of a continuous console stream.
+
+    'disp' reprints the power table at regular intervals. Chunks are
+    buffered until a table is complete, i.e. its header was followed by
+    rows and then by a blank line or the next header. A table cut short by
+    anything else (a prompt, an echo) is dropped, so is one whose blank
+    line turns out to start the prompt. Each complete table is returned
+    as raw bytes, ready for PylontechParser.parse_pwr.
+
+    Call reset() whenever the stream is interrupted, what follows doesn't
+    continue the buffered table.
+    """
+
+    HEADER = b"Power "
+    PROMPT = b"pylon>"
+    MAX_BUFFER = 65536
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def reset(self):
+        """Drops the partial table, if any."""
+        self._buffer.clear()
+
+    def feed(self, chunk: bytes) -> list:
+        self._buffer += chunk
+        tables = []
+        while True:
+            start = self._buffer.find(self.HEADER)
+            if start == -1:
+                # Keep a possible partial header at the end
+                del self._buffer[:max(0, len(self._buffer) - len(self.HEADER))]
+                break
+            end, rows = self._table_end(start)
+            if end == -1:
+                del self._buffer[:start]
+                if len(self._buffer) > self.MAX_BUFFER:
+                    # Not a table we understand, don't grow forever
+                    self._buffer.clear()
+                break
+            if rows:
+                tables.append(bytes(self._buffer[start:end]))
+            del self._buffer[:end]
+        return tables
+
+    def _table_end(self, start: int):
+        """Returns the end offset and row count of the table at `start`, end is -1 while incomplete."""
+        buffer = self._buffer
+        rows = 0
+        pos = buffer.find(b"\n", start)
+        while pos != -1:
+            line_start = pos + 1
+            while line_start < len(buffer) and buffer[line_start] == 0x0D:  # \r
+                line_start += 1
+            line_end = buffer.find(b"\n", line_start)
+            if line_end == -1:
+                break
+            if line_start == line_end:
+                # The prompt starts with a blank line too ("\n\rpylon>"), see what follows
+                following = line_end + 1
+                while following < len(buffer) and buffer[following] == 0x0D:
+                    following += 1
+                text = bytes(buffer[following:following + len(self.PROMPT)])
+                if self.PROMPT.startswith(text) and len(text) < len(self.PROMPT):
+                    return -1, rows
+                return line_start, 0 if text == self.PROMPT else rows
+            if buffer.startswith(self.HEADER, line_start):
+                return line_start, rows
+            if not 0x30 <= buffer[line_start] <= 0x39:
+                # Cut short by something else, the rows so far may not be all of them
+                return line_start, 0
+            rows += 1
+            pos = line_end
+        return -1, rows
+
+
+def apply_batteries(system: PylontechSystem, batteries: List[PylontechBattery],
+                    rows: Dict[int, PylontechBattery] = None) -> PylontechSystem:
+    """Sets the modules of a snapshot and the stack values derived from them.
+
+    `rows` is the module index the batteries were taken from, if reused
+    (see PylontechSystem.index).
+    """
+    system.batteries = batteries
+    system.index(rows)
+    if batteries:
+        system.voltage = round(sum(bat.voltage for bat in batteries) / len(batteries), 2)
+        system.current = round(sum(bat.current for bat in batteries), 2)
+        system.soc = round(sum(bat.soc for bat in batteries) / len(batteries), 1)
+        system.power = round(system.voltage * system.current, 1)
+    return system
+
+
 class PylontechParser:
     """Parser for Pylontech BMS serial data."""
 
     @staticmethod
-    def parse_pwr(raw_text: str, current_system: PylontechSystem = None) -> PylontechSystem:
-        """Parses 'pwr' command output. Returns updated system object."""
+    def parse_pwr(raw_data, current_system: PylontechSystem = None,
+                  reuse: Dict[int, PylontechBattery] = None) -> PylontechSystem:
+        """Parses 'pwr' command output (bytes or str). Returns updated system object.
+
+        Modules found in `reuse` (the index of a snapshot nobody reads
+        anymore) are updated in place instead of allocated again.
+        """
         if current_system is None:
             # Create dummy initial system if not provided, though usually we update an existing state
             current_system = PylontechSystem(0,0,0,0,0,0,0)
 
+        raw = _to_bytes(raw_data)
+        layout, rows = _table_rows(raw, b"Power ")
+
         batteries = []
-        lines = raw_text.splitlines()
-        
-        valid_lines = 0
-        total_voltage = 0.0
-        total_current = 0.0
-        total_soc = 0.0
-        
-        for line in lines:
-            parts = line.split()
-            # Expecting: ID, Volt, Curr, Temp, Tlow, Thigh, Vlow, Vhigh, Base.St, ...
-            # Clean: "1 50691 3806 17000 ..."
-            # Length check: ID(0)+V(1)+C(2)+T(3)+Tl(4)+Th(5)+Vl(6)+Vh(7)+Stat(8)...
-            
-            if len(parts) > 10 and parts[0].isdigit():
-                if "Absent" in line: continue
+
+        if layout is not None:
+            # Columns are looked up by name, firmware may move or add some
+            id_span = next(iter(layout.spans.values()))
+            volt_span = layout.span("Volt")
+            curr_span = layout.span("Curr")
+            temp_span = layout.span("Tempr")
+            status_span = layout.span("Base.St", "Base State")
+            soc_span = layout.span("Coulomb")
+            volt_status_span = layout.span("Volt.St", "Volt. State")
+            curr_status_span = layout.span("Curr.St", "Curr. State")
+            temp_status_span = layout.span("Temp.St", "Temp. State")
+
+            for start, end in rows:
+                status = _field(raw, start, end, status_span).strip()
+                if status == b"Absent":
+                    continue
                 try:
-                    bat_id = int(parts[0])
-                    voltage = int(parts[1]) / 1000.0
-                    current = int(parts[2]) / 1000.0
-                    temp = int(parts[3]) / 1000.0
-                    # Status is at index 8 (Base.St)
-                    status = parts[8]
-                    # SOC is at index 12 (Coulomb) - usually ends with %
-                    soc = int(parts[12].replace('%', ''))
-                    
+                    bat_id = int(_field(raw, start, end, id_span))
+                    voltage = int(_field(raw, start, end, volt_span)) / 1000.0
+                    current = int(_field(raw, start, end, curr_span)) / 1000.0
+                    temp = int(_field(raw, start, end, temp_span)) / 1000.0
+                    soc = _percent(_field(raw, start, end, soc_span))
+
                     power = round(voltage * current, 2)
-                    
-                    bat = PylontechBattery(
-                        sys_id=bat_id,
-                        voltage=voltage,
-                        current=current,
-                        temperature=temp,
-                        soc=soc,
-                        status=status,
-                        power=power,
-                        raw=line.strip()
-                    )
+                    status = status.decode("ascii", errors="ignore")
+                    voltage_status = _status(raw, start, end, volt_status_span)
+                    current_status = _status(raw, start, end, curr_status_span)
+                    temperature_status = _status(raw, start, end, temp_status_span)
+
+                    bat = reuse.get(bat_id) if reuse else None
+                    if bat is None:
+                        bat = PylontechBattery(
+                            sys_id=bat_id,
+                            voltage=voltage,
+                            current=current,
+                            temperature=temp,
+                            soc=soc,
+                            status=status,
+                            power=power,
+                            voltage_status=voltage_status,
+                            current_status=current_status,
+                            temperature_status=temperature_status,
+                        )
+                    else:
+                        bat.set(voltage, current, temp, soc, status, power,
+                                voltage_status, current_status, temperature_status)
                     batteries.append(bat)
-                    
-                    total_voltage += voltage
-                    total_current += current
-                    total_soc += soc
-                    valid_lines += 1
-                    
+
                 except (ValueError, IndexError) as error:
-                    _LOGGER.error(f"Error parsing pwr line '{line}': {error}")
+                    _LOGGER.error(f"Error parsing pwr line '{raw[start:end]}': {error}")
                     continue
-        
-        current_system.batteries = batteries
-        current_system.raw = raw_text
-        
-        if valid_lines > 0:
-            current_system.voltage = round(total_voltage / valid_lines, 2)
-            current_system.current = round(total_current, 2)
-            current_system.soc = round(total_soc / valid_lines, 1)
-            current_system.power = round(current_system.voltage * current_system.current, 1)
-        
+
+        apply_batteries(current_system, batteries, reuse)
         return current_system
 
+    @staticmethod
+    def parse_bat(raw_data) -> List[PylontechCell]:
+        """Parses 'bat [index]' command output (bytes or str) into per-cell rows."""
+        raw = _to_bytes(raw_data)
+        layout, rows = _table_rows(raw, b"Battery ")
+        if layout is None:
+            return []
+
+        id_span = next(iter(layout.spans.values()))
+        volt_span = layout.span("Volt")
+        curr_span = layout.span("Curr")
+        temp_span = layout.span("Tempr")
+        status_span = layout.span("Base State", "Base.St")
+        coulomb_span = layout.span("Coulomb")
+
+        cells = []
+        for start, end in rows:
+            try:
+                coulomb = _field(raw, start, end, coulomb_span)
+                # "89%      42586 mAH"
+                parts = coulomb.split()
+                capacity = int(parts[1]) if len(parts) > 1 else None
+
+                cells.append(PylontechCell(
+                    cell_id=int(_field(raw, start, end, id_span)),
+                    voltage=int(_field(raw, start, end, volt_span)) / 1000.0,
+                    current=int(_field(raw, start, end, curr_span)) / 1000.0,
+                    temperature=int(_field(raw, start, end, temp_span)) / 1000.0,
+                    status=_field(raw, start, end, status_span).strip().decode("ascii", errors="ignore"),
+                    soc=_percent(coulomb),
+                    capacity=capacity,
+                ))
+            except (ValueError, IndexError) as error:
+                _LOGGER.error(f"Error parsing bat line '{raw[start:end]}': {error}")
+                continue
+        return cells
+
+    @staticmethod
+    def parse_cell_table(raw_data, module_id: int, updated: float) -> Optional[PylontechCellTable]:
+        """Parses 'bat [index]' output straight into a cell table, None if it has no rows.
+
+        Only reads what the table keeps (voltage and temperature), without
+        a PylontechCell per row. Cells are listed in order by the console.
+        """
+        raw = _to_bytes(raw_data)
+        layout, rows = _table_rows(raw, b"Battery ")
+        if layout is None:
+            return None
+
+        volt_span = layout.span("Volt")
+        temp_span = layout.span("Tempr")
+        table = PylontechCellTable(module_id, updated=updated)
+        for start, end in rows:
+            try:
+                voltage = int(_field(raw, start, end, volt_span))
+                temperature = int(_field(raw, start, end, temp_span))
+            except (ValueError, IndexError) as error:
+                _LOGGER.error(f"Error parsing bat line '{raw[start:end]}': {error}")
+                continue
+            table.voltages.append(voltage)
+            table.temperatures.append(temperature)
+        return table if table.voltages else None
+
     @staticmethod
     def parse_info(raw_text: str, system: PylontechSystem) -> PylontechSystem:
         """Parses 'info' command output."""
@@ -118,6 +395,20 @@ class PylontechParser:
         cycle_match = re.search(r"CYCLE Times\s*:\s*(\d+)", raw_text, re.IGNORECASE)
         if cycle_match:
             system.cycles = int(cycle_match.group(1))
+
+        # Coulomb counters, used for energy accounting
+        # Pwr Coulomb     : 153311400   (mAs left, 153311400 / 3600 = 42586 mAh as in 'bat')
+        # Dsg Cap         : 21506462    (mAh discharged over the lifetime)
+        coulomb_match = re.search(r"Pwr Coulomb\s*:\s*(\d+)", raw_text, re.IGNORECASE)
+        if coulomb_match:
+            system.coulomb = int(coulomb_match.group(1)) // 3600
+        dsg_match = re.search(r"Dsg Cap\s*:\s*(\d+)", raw_text, re.IGNORECASE)
+        if dsg_match:
+            system.discharged = int(dsg_match.group(1))
+        # HisData Items   :     1794   (records readable with 'data history N')
+        history_match = re.search(r"HisData Items\s*:\s*(\d+)", raw_text, re.IGNORECASE)
+        if history_match:
+            system.history_items = int(history_match.group(1))
             
         # SOH? The docs 'stat' output doesn't show SOH explicitly as a key value pair in the list?
         # "SOH Times       :        0" ? No that's probably a counter of SOH events.
@@ -148,6 +439,52 @@ class PylontechParser:
              system.bms_time = match.group(1)
         return system
 
+    @staticmethod
+    def parse_history(raw_data, item: int) -> Optional[PylontechHistoryRecord]:
+        """Parses one 'data history N' record, None if it holds no usable data.
+
+        The record layout isn't documented and varies between firmwares, so
+        this is lenient: the first date/time anywhere is the timestamp, and
+        'Key : value' lines are matched on key words (volt, curr, temp, and
+        coulomb/soc/percent). Integer readings are in mV, mA and m°C like
+        in the other tables, values with a decimal point are taken as is.
+        """
+        text = raw_data.decode("ascii", errors="ignore") if isinstance(raw_data, (bytes, bytearray)) else raw_data
+        match = _HISTORY_TIME.search(text)
+        if not match:
+            return None
+        year, month, day, hour, minute, second = (int(group) for group in match.groups())
+        if year < 100:
+            year += 2000
+        try:
+            timestamp = datetime(year, month, day, hour, minute, second)
+        except ValueError:
+            return None
+
+        record = PylontechHistoryRecord(item, timestamp)
+        for line in text.splitlines():
+            key, sep, value = line.partition(":")
+            if not sep:
+                continue
+            key = key.strip().lower()
+            number = re.match(r"\s*(-?\d+(?:\.\d+)?)\s*(%?)", value)
+            if not number or not key:
+                continue
+            reading = float(number.group(1))
+            scaled = reading if "." in number.group(1) else reading / 1000.0
+            if "volt" in key and record.voltage is None:
+                record.voltage = round(scaled, 3)
+            elif "curr" in key and record.current is None:
+                record.current = round(scaled, 3)
+            elif "temp" in key and record.temperature is None:
+                record.temperature = round(scaled, 1)
+            elif (number.group(2) or "soc" in key or "percent" in key) and record.soc is None:
+                record.soc = reading
+
+        if record.voltage is None and record.current is None and record.soc is None:
+            return None
+        return record
+
     @staticmethod
     def generate_time_command(timestamp: datetime) -> str:
         """Generates the 'time' command for specific datetime."""
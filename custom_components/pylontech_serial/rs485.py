@@ -0,0 +1,237 @@
+"""Framing and decoding for the Pylontech RS485 protocol (v3.5).
+
+Frames are ASCII: every byte after SOI is sent as two hex digits.
+
+    ~ VER ADR CID1 CID2 LENGTH INFO CHKSUM \\r
+
+LENGTH holds the number of INFO hex digits (LENID, 12 bits) under a 4-bit
+checksum (LCHKSUM), CHKSUM covers every character between SOI and CHKSUM.
+In responses CID2 is the return code, 0 on success.
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+
+from .structs import PylontechBattery, PylontechCellTable
+
+SOI = b"~"
+EOI = b"\r"
+VERSION = 0x20
+CID1_BATTERY = 0x46
+CID2_ANALOG = 0x42
+CID2_ALARM = 0x44
+CID2_MANUFACTURER = 0x51
+
+# Address of the first module, the next ones count up from there
+FIRST_ADDRESS = 2
+MAX_MODULES = 16
+# Time a module gets to answer one request
+FRAME_TIMEOUT = 1.0  # seconds
+
+# Alarm state bytes
+_STATES = {0x00: "Normal", 0x01: "Low", 0x02: "High", 0xF0: "Error"}
+# Temperatures are sent in 0.1 K
+_KELVIN_OFFSET = 2731
+
+
+class Rs485FrameError(ValueError):
+    """Raised for a frame that is cut, corrupt or reports an error."""
+
+
+@dataclass
+class Rs485Frame:
+    version: int
+    address: int
+    cid1: int
+    cid2: int
+    info: bytes
+
+
+@dataclass
+class Rs485Analog:
+    """Analog values of one module (CID2 0x42)."""
+    address: int
+    cell_voltages: List[float]
+    temperatures: List[float]  # BMS board first, then the cell groups
+    current: float
+    voltage: float
+    remaining: float  # Ah
+    total: float  # Ah
+    cycles: int
+
+
+@dataclass
+class Rs485Alarm:
+    """Alarm states of one module (CID2 0x44)."""
+    address: int
+    cells: List[str]
+    temperatures: List[str]
+    charge_current: str
+    voltage: str
+    discharge_current: str
+    status: bytes = b""
+
+
+@dataclass
+class Rs485Manufacturer:
+    """Manufacturer info (CID2 0x51)."""
+    device: str
+    software: str
+    manufacturer: str
+
+
+class _Reader:
+    """Reads big-endian fields off a decoded INFO block."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def byte(self) -> int:
+        return self.unsigned(1)
+
+    def unsigned(self, size: int) -> int:
+        if self.position + size > len(self.data):
+            raise Rs485FrameError(f"INFO too short, {len(self.data)} bytes")
+        value = int.from_bytes(self.data[self.position:self.position + size], "big")
+        self.position += size
+        return value
+
+    def signed(self, size: int) -> int:
+        value = self.unsigned(size)
+        return value - (1 << (8 * size)) if value >= 1 << (8 * size - 1) else value
+
+    def remaining(self) -> int:
+        return len(self.data) - self.position
+
+
+def length_field(info_length: int) -> int:
+    """LENGTH for `info_length` INFO hex digits."""
+    nibbles = (info_length >> 8) + ((info_length >> 4) & 0xF) + (info_length & 0xF)
+    return ((~nibbles + 1) & 0xF) << 12 | info_length
+
+
+def checksum(body: bytes) -> int:
+    return (~sum(body) + 1) & 0xFFFF
+
+
+def encode_frame(address: int, cid2: int, info: bytes = b"", cid1: int = CID1_BATTERY, version: int = VERSION) -> str:
+    """Builds a request, as the text sent on the wire."""
+    info_hex = info.hex().upper()
+    body = f"{version:02X}{address:02X}{cid1:02X}{cid2:02X}{length_field(len(info_hex)):04X}{info_hex}"
+    return f"~{body}{checksum(body.encode('ascii')):04X}\r"
+
+
+def decode_frame(raw: bytes) -> Rs485Frame:
+    """Decodes the first complete frame in `raw`, checking both checksums and the return code."""
+    start = raw.find(SOI)
+    end = raw.find(EOI, start + 1) if start != -1 else -1
+    if start == -1 or end == -1:
+        raise Rs485FrameError(f"No complete frame in {raw[:64]!r}")
+    body, frame_checksum = raw[start + 1:end - 4], raw[end - 4:end]
+    if len(body) < 12:
+        raise Rs485FrameError(f"Frame too short: {raw[start:end + 1]!r}")
+    try:
+        expected = int(frame_checksum, 16)
+        version, address, cid1, cid2 = (int(body[i:i + 2], 16) for i in range(0, 8, 2))
+        length = int(body[8:12], 16)
+        info = bytes.fromhex(body[12:].decode("ascii"))
+    except ValueError as e:
+        raise Rs485FrameError(f"Malformed frame {raw[start:end + 1]!r}: {e}") from e
+    if expected != checksum(body):
+        raise Rs485FrameError(f"Bad checksum in {raw[start:end + 1]!r}")
+    if length_field(length & 0xFFF) != length or len(body) - 12 != length & 0xFFF:
+        raise Rs485FrameError(f"Bad length in {raw[start:end + 1]!r}")
+    if cid2 != 0:
+        raise Rs485FrameError(f"Module {address} returned error code {cid2:#04x}")
+    return Rs485Frame(version, address, cid1, cid2, info)
+
+
+def parse_analog(info: bytes) -> Rs485Analog:
+    reader = _Reader(info)
+    reader.byte()  # INFOFLAG
+    address = reader.byte()
+    cell_voltages = [reader.unsigned(2) / 1000.0 for _ in range(reader.byte())]
+    temperatures = [round((reader.unsigned(2) - _KELVIN_OFFSET) / 10.0, 1) for _ in range(reader.byte())]
+    current = reader.signed(2) / 100.0
+    voltage = reader.unsigned(2) / 1000.0
+    remaining = reader.unsigned(2)
+    user_defined = reader.byte()
+    total = reader.unsigned(2)
+    cycles = reader.unsigned(2)
+    if user_defined == 4 and reader.remaining() >= 6:
+        # Packs over 65 Ah send both capacities again on 3 bytes
+        remaining = reader.unsigned(3)
+        total = reader.unsigned(3)
+    return Rs485Analog(address, cell_voltages, temperatures, current, voltage, remaining / 100.0, total / 100.0, cycles)
+
+
+def parse_alarm(info: bytes) -> Rs485Alarm:
+    reader = _Reader(info)
+    reader.byte()  # INFOFLAG
+    address = reader.byte()
+    cells = [_state(reader.byte()) for _ in range(reader.byte())]
+    temperatures = [_state(reader.byte()) for _ in range(reader.byte())]
+    charge_current = _state(reader.byte())
+    voltage = _state(reader.byte())
+    discharge_current = _state(reader.byte())
+    return Rs485Alarm(address, cells, temperatures, charge_current, voltage, discharge_current,
+                      info[reader.position:])
+
+
+def parse_manufacturer(info: bytes) -> Rs485Manufacturer:
+    if len(info) < 32:
+        raise Rs485FrameError(f"Manufacturer INFO too short, {len(info)} bytes")
+    return Rs485Manufacturer(
+        device=info[:10].rstrip(b"\x00 ").decode("ascii", errors="ignore"),
+        software=f"{info[10]}.{info[11]}",
+        manufacturer=info[12:32].rstrip(b"\x00 ").decode("ascii", errors="ignore"),
+    )
+
+
+def _state(value: int) -> str:
+    return _STATES.get(value, "Error")
+
+
+def _worst(states) -> Optional[str]:
+    states = [state for state in states if state is not None]
+    if not states:
+        return None
+    return next((state for state in states if state != "Normal"), "Normal")
+
+
+def to_battery(module_id: int, analog: Rs485Analog, alarm: Optional[Rs485Alarm],
+               row: Optional[PylontechBattery] = None) -> PylontechBattery:
+    """Maps one module's analog values and alarms onto a 'pwr' row, `row` if given."""
+    # The console's Tempr is a cell temperature, the first sensor is the BMS board
+    cell_temperatures = analog.temperatures[1:] or analog.temperatures
+    if analog.current > 0:
+        status = "Charge"
+    elif analog.current < 0:
+        status = "Dischg"
+    else:
+        status = "Idle"
+    if row is None:
+        row = PylontechBattery(module_id, 0, 0, 0, 0, status, 0)
+    row.set(
+        voltage=analog.voltage,
+        current=analog.current,
+        temperature=round(sum(cell_temperatures) / len(cell_temperatures), 1) if cell_temperatures else 0.0,
+        soc=round(analog.remaining / analog.total * 100) if analog.total else 0,
+        status=status,
+        power=round(analog.voltage * analog.current, 2),
+        voltage_status=_worst([alarm.voltage] + alarm.cells) if alarm else None,
+        current_status=_worst([alarm.charge_current, alarm.discharge_current]) if alarm else None,
+        temperature_status=_worst(alarm.temperatures) if alarm else None,
+    )
+    return row
+
+
+def to_cell_table(module_id: int, analog: Rs485Analog, updated: float) -> PylontechCellTable:
+    """Cell readings of a module, each cell gets the temperature of its sensor group."""
+    groups = analog.temperatures[1:] or analog.temperatures or [0.0]
+    count = len(analog.cell_voltages)
+    table = PylontechCellTable(module_id, updated=updated)
+    for index, voltage in enumerate(analog.cell_voltages):
+        table.voltages.append(round(voltage * 1000))
+        table.temperatures.append(round(groups[index * len(groups) // count] * 1000))
+    return table
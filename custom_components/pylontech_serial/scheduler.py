@@ -0,0 +1,144 @@
+"""Per-command polling schedule for Pylontech Serial."""
+import time
+
+
+class CommandScheduler:
+    """Tracks which console commands are due on each poll.
+
+    Commands with an interval of 0 run on every poll, the others once their
+    interval has elapsed since the last successful run.
+    """
+
+    def __init__(self, intervals: dict):
+        self.intervals = dict(intervals)
+        self._last_run = {}
+
+    def due(self, now: float = None) -> list:
+        """Returns the commands to send on this poll, in schedule order."""
+        if now is None:
+            now = time.monotonic()
+        return [
+            command for command, interval in self.intervals.items()
+            if command not in self._last_run or now - self._last_run[command] >= interval
+        ]
+
+    def mark_done(self, command: str, now: float = None):
+        self._last_run[command] = time.monotonic() if now is None else now
+
+    def invalidate(self, command: str = None):
+        """Forces a command (or all of them) to run on the next poll."""
+        if command is None:
+            self._last_run.clear()
+        else:
+            self._last_run.pop(command, None)
+
+
+# Assumed bus time of one 'bat N' query until one has been measured
+DEFAULT_CELL_QUERY_TIME = 0.15  # seconds
+
+
+class CellCollector:
+    """Spreads 'bat N' queries for the present modules over successive polls.
+
+    Each poll gets a bus-time budget. The time a query takes is learnt from
+    the previous ones, and as many modules as fit are picked, carrying on
+    round-robin from where the last poll stopped. At least one module is
+    queried per poll so every module is eventually refreshed.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self._last_module = None
+        self._query_time = None
+
+    def pick(self, module_ids) -> list:
+        if self.budget <= 0 or not module_ids:
+            return []
+        ids = sorted(module_ids)
+        start = 0
+        if self._last_module is not None:
+            start = next((i for i, module_id in enumerate(ids) if module_id > self._last_module), 0)
+        ordered = ids[start:] + ids[:start]
+
+        query_time = self._query_time or DEFAULT_CELL_QUERY_TIME
+        count = min(len(ordered), max(1, int(self.budget // query_time)))
+        picked = ordered[:count]
+        self._last_module = picked[-1]
+        return picked
+
+    def record(self, queries: int, elapsed: float):
+        """Learns the time of one query from a finished batch."""
+        if queries <= 0:
+            return
+        sample = elapsed / queries
+        if self._query_time is None:
+            self._query_time = sample
+        else:
+            self._query_time = 0.7 * self._query_time + 0.3 * sample
+
+
+# Changes faster than these between two polls count as activity
+ACTIVITY_CURRENT_RATE = 0.2  # A/s, stack current
+ACTIVITY_POWER_RATE = 10  # W/s, stack power
+# Stack current below this is considered at rest
+IDLE_CURRENT = 0.5  # A
+# Factor applied to the interval on every quiet poll
+BACKOFF_FACTOR = 1.5
+
+
+class AdaptiveInterval:
+    """Picks the next poll interval from how busy the stack is.
+
+    The interval drops to `minimum` as soon as the stack current or power
+    moves quickly between polls, or any module reports a state other than
+    Normal. After that it grows back by BACKOFF_FACTOR per quiet poll up to
+    the configured `base`, and on up to `maximum` while every module is
+    Idle with (almost) no current.
+    """
+
+    def __init__(self, base: float, minimum: float, maximum: float):
+        self.minimum = min(minimum, base)
+        self.maximum = max(maximum, base)
+        self.base = base
+        self.interval = base
+        self._last = None
+
+    def update(self, system, now: float = None) -> float:
+        """Returns the interval to wait before the next poll after `system`."""
+        if now is None:
+            now = time.monotonic()
+        last, self._last = self._last, (now, system.current, system.power)
+
+        if _has_alarm(system):
+            self.interval = self.minimum
+        elif last is not None and _is_ramping(last, now, system):
+            self.interval = self.minimum
+        else:
+            limit = self.maximum if _is_idle(system) else self.base
+            if self.interval > limit:
+                self.interval = limit
+            else:
+                self.interval = min(limit, self.interval * BACKOFF_FACTOR)
+        return self.interval
+
+
+def _has_alarm(system) -> bool:
+    return any(
+        status not in (None, "Normal")
+        for battery in system.batteries
+        for status in (battery.voltage_status, battery.current_status, battery.temperature_status)
+    )
+
+
+def _is_ramping(last, now: float, system) -> bool:
+    then, current, power = last
+    elapsed = now - then
+    if elapsed <= 0:
+        return False
+    return (abs(system.current - current) / elapsed >= ACTIVITY_CURRENT_RATE
+            or abs(system.power - power) / elapsed >= ACTIVITY_POWER_RATE)
+
+
+def _is_idle(system) -> bool:
+    return (bool(system.batteries) and all(battery.status == "Idle" for battery in system.batteries)
+            and abs(system.current) < IDLE_CURRENT)
@@ -1,4 +1,6 @@
 """Sensor platform for Pylontech Serial."""
+import time
+
 from homeassistant.components.sensor import SensorEntity, SensorDeviceClass, SensorStateClass
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (
@@ -7,10 +9,12 @@ from homeassistant.const import (
     UnitOfPower,
     UnitOfTemperature,
     UnitOfEnergy,
+    UnitOfInformation,
+    UnitOfTime,
     PERCENTAGE,
     EntityCategory,
 )
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
@@ -82,12 +86,6 @@ async def async_setup_entry(
         None, None, "cycles",
         state_class=SensorStateClass.MEASUREMENT
     ))
-    # Raw Data (System)
-    entities.append(PylontechSystemSensor(
-        coordinator, unique_id_prefix, "sys_raw", 
-        None, None, "raw",
-        entity_category=EntityCategory.DIAGNOSTIC
-    ))
 
     # Info Sensors (Diagnostic)
     entities.append(PylontechSystemSensor(coordinator, unique_id_prefix, "sys_cell_count", None, None, "cell_count", entity_category=EntityCategory.DIAGNOSTIC))
@@ -96,35 +94,150 @@ async def async_setup_entry(
     entities.append(PylontechSystemSensor(coordinator, unique_id_prefix, "sys_barcode", None, None, "barcode", entity_category=EntityCategory.DIAGNOSTIC))
     entities.append(PylontechSystemSensor(coordinator, unique_id_prefix, "sys_bms_time", None, None, "bms_time", entity_category=EntityCategory.DIAGNOSTIC))
 
+    # Windowed statistics (from the in-memory history, no recorder queries)
+    entities.append(PylontechWindowSensor(coordinator, unique_id_prefix, "sys_power_min", UnitOfPower.WATT, SensorDeviceClass.POWER, "power", "min"))
+    entities.append(PylontechWindowSensor(coordinator, unique_id_prefix, "sys_power_max", UnitOfPower.WATT, SensorDeviceClass.POWER, "power", "max"))
+    entities.append(PylontechWindowSensor(coordinator, unique_id_prefix, "sys_power_avg", UnitOfPower.WATT, SensorDeviceClass.POWER, "power", "avg"))
+    entities.append(PylontechWindowSensor(coordinator, unique_id_prefix, "sys_soc_rate", "%/h", None, "soc", "rate"))
+
+    # Link instrumentation (see metrics.py), disabled by default
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_cycle_time", "cycle"))
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_round_trip", "round_trip"))
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_queue_wait", "queue_wait"))
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_parse_time", "parse_total"))
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_bytes_read", "bytes_read", UnitOfInformation.BYTES, SensorDeviceClass.DATA_SIZE))
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_retries", "retries", None, None))
+    entities.append(PylontechMetricSensor(coordinator, unique_id_prefix, "sys_link_errors", "errors", None, None))
+
 
     # --- Per Battery Sensors ---
-    # We iterate initially available batteries. If batteries increase dynamically, we need execution loop logic or reload.
-    # Standard practice: Iterate current data.
-    if coordinator.data and coordinator.data.batteries:
-        for bat in coordinator.data.batteries:
-            bat_id = bat.sys_id
-            
-            # Standard Sensors
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "volt", UnitOfElectricPotential.VOLT, SensorDeviceClass.VOLTAGE, "voltage"))
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "curr", UnitOfElectricCurrent.AMPERE, SensorDeviceClass.CURRENT, "current"))
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "temp", UnitOfTemperature.CELSIUS, SensorDeviceClass.TEMPERATURE, "temperature"))
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "soc", PERCENTAGE, SensorDeviceClass.BATTERY, "soc"))
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "power", UnitOfPower.WATT, SensorDeviceClass.POWER, "power"))
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "status", None, None, "status"))
-            
-            # Diagnostic
-            entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "raw", None, None, "raw", entity_category=EntityCategory.DIAGNOSTIC))
+    # Modules present now get their entities here, modules that show up
+    # later (e.g. back from Absent) are added by the topology listener.
+    # So are the per-cell sensors, once the module's cell count is known.
+    known_modules = set()
+    known_cells = {}
+
+    def _module_entities(module_ids):
+        created = []
+        for bat_id in sorted(module_ids):
+            if bat_id not in known_modules:
+                known_modules.add(bat_id)
+                created.extend(_create_module_sensors(coordinator, unique_id_prefix, bat_id))
+            if coordinator.reads_cells:
+                cells = coordinator.topology.get(bat_id, 0)
+                created.extend(_create_cell_sensors(coordinator, unique_id_prefix, bat_id, known_cells.get(bat_id, 0), cells))
+                known_cells[bat_id] = max(known_cells.get(bat_id, 0), cells)
+        return created
+
+    if coordinator.topology:
+        entities.extend(_module_entities(coordinator.topology))
 
     async_add_entities(entities)
 
+    @callback
+    def _handle_topology_change(added, removed):
+        # Entities of removed modules stay, they report unavailable until the module is back
+        new_entities = _module_entities(added)
+        if new_entities:
+            async_add_entities(new_entities)
+
+    entry.async_on_unload(coordinator.async_add_topology_listener(_handle_topology_change))
+
+
+def _create_module_sensors(coordinator, unique_id_prefix, bat_id) -> list:
+    """Builds the sensors of one module."""
+    entities = []
+    
+    # Standard Sensors
+    entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "volt", UnitOfElectricPotential.VOLT, SensorDeviceClass.VOLTAGE, "voltage"))
+    entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "curr", UnitOfElectricCurrent.AMPERE, SensorDeviceClass.CURRENT, "current"))
+    entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "temp", UnitOfTemperature.CELSIUS, SensorDeviceClass.TEMPERATURE, "temperature"))
+    entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "soc", PERCENTAGE, SensorDeviceClass.BATTERY, "soc"))
+    entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "power", UnitOfPower.WATT, SensorDeviceClass.POWER, "power"))
+    entities.append(PylontechBatterySensor(coordinator, unique_id_prefix, bat_id, "status", None, None, "status"))
+    
+    entities.append(PylontechWindowSensor(coordinator, unique_id_prefix, f"bat{bat_id}_curr_peak", UnitOfElectricCurrent.AMPERE, SensorDeviceClass.CURRENT, "current", "peak", bat_id=bat_id))
+
+    # Cells (every poll over RS485, otherwise round-robin, a few modules per poll)
+    if coordinator.reads_cells:
+        entities.append(PylontechCellSensor(coordinator, unique_id_prefix, bat_id, "cell_volt_min", UnitOfElectricPotential.VOLT, SensorDeviceClass.VOLTAGE, "min_voltage"))
+        entities.append(PylontechCellSensor(coordinator, unique_id_prefix, bat_id, "cell_volt_max", UnitOfElectricPotential.VOLT, SensorDeviceClass.VOLTAGE, "max_voltage"))
+        entities.append(PylontechCellSensor(coordinator, unique_id_prefix, bat_id, "cell_volt_delta", UnitOfElectricPotential.MILLIVOLT, SensorDeviceClass.VOLTAGE, "voltage_delta"))
+        entities.append(PylontechCellSensor(coordinator, unique_id_prefix, bat_id, "cell_temp_max", UnitOfTemperature.CELSIUS, SensorDeviceClass.TEMPERATURE, "max_temperature"))
+
+    return entities
+
+
+def _create_cell_sensors(coordinator, unique_id_prefix, bat_id, first, count) -> list:
+    """Builds the voltage sensors of cells `first` to `count` - 1 of a module."""
+    # One voltage per cell, disabled by default as it's a lot of entities
+    return [
+        PylontechCellSensor(
+            coordinator, unique_id_prefix, bat_id, f"cell{cell}_volt",
+            UnitOfElectricPotential.VOLT, SensorDeviceClass.VOLTAGE, None, cell_index=cell
+        )
+        for cell in range(first, count)
+    ]
+
+
+class SignificantChangeMixin:
+    """Skips state writes for updates that didn't really move the value.
+
+    `_field_key` is the (module id or None, field) the sensor reads, when
+    the coordinator reports it unchanged the value isn't even looked at.
+    Otherwise the value goes through the coordinator's state filter, with
+    the deadband of `_deadband_kind` (the device class if not set) times
+    `_deadband_scale`. Any availability change, and the heartbeat, always
+    write.
+    """
+    _field_key = None
+    _deadband_kind = None
+    _deadband_scale = 1
+    _last_written = None
+    _last_available = None
+    _last_write_time = None
 
-class PylontechSystemSensor(CoordinatorEntity, SensorEntity):
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        now = time.monotonic()
+        state_filter = self.coordinator.state_filter
+        available = self.available
+        due = self._last_write_time is None or now - self._last_write_time >= state_filter.heartbeat
+        if not due and available == self._last_available:
+            changed = self.coordinator.changed_fields
+            if self._field_key is not None and changed is not None and self._field_key not in changed:
+                return
+            kind = self._deadband_kind or self.device_class
+            if not state_filter.is_significant(kind, self._last_written, self.native_value, self._deadband_scale):
+                return
+
+        self._last_written = self.native_value
+        self._last_available = available
+        self._last_write_time = now
+        self.async_write_ha_state()
+
+
+class ModuleEntityMixin:
+    """Module entities are unavailable while their module is missing from 'pwr'."""
+    _bat_id = None
+
+    @property
+    def available(self) -> bool:
+        if not super().available:
+            return False
+        if self._bat_id is None:
+            return True
+        return self.coordinator.data is not None and self._bat_id in self.coordinator.data.modules
+
+
+class PylontechSystemSensor(SignificantChangeMixin, CoordinatorEntity, SensorEntity):
     """Representation of a System-wide Sensor."""
     _attr_has_entity_name = True
 
     def __init__(self, coordinator, unique_id_prefix, key, unit, device_class, attr_name, state_class=None, entity_category=None):
         super().__init__(coordinator)
         self._attribute_key = attr_name # field name in struct
+        self._field_key = (None, attr_name)
         self._unit = unit
         self._device_class = device_class
         self._attr_state_class = state_class
@@ -134,12 +247,7 @@ class PylontechSystemSensor(CoordinatorEntity, SensorEntity):
         self._attr_translation_key = key
         
         # Info
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, "system")},
-            "name": "Pylontech Stack",
-            "manufacturer": "Pylontech",
-            "model": "US Series Stack", # Fallback, updated from data usually
-        }
+        self._attr_device_info = coordinator.system_device_info()
 
     @property
     def native_value(self):
@@ -164,7 +272,7 @@ class PylontechSystemSensor(CoordinatorEntity, SensorEntity):
         return {}
 
 
-class PylontechBatterySensor(CoordinatorEntity, SensorEntity):
+class PylontechBatterySensor(ModuleEntityMixin, SignificantChangeMixin, CoordinatorEntity, SensorEntity):
     """Representation of a Per-Battery Sensor."""
     _attr_has_entity_name = True
 
@@ -172,6 +280,7 @@ class PylontechBatterySensor(CoordinatorEntity, SensorEntity):
         super().__init__(coordinator)
         self._bat_id = bat_id
         self._attribute_key = attr_name
+        self._field_key = (bat_id, attr_name)
         self._unit = unit
         self._device_class = device_class
         self._attr_entity_category = entity_category
@@ -179,21 +288,14 @@ class PylontechBatterySensor(CoordinatorEntity, SensorEntity):
         self._attr_unique_id = f"{unique_id_prefix}_bat{bat_id}_{suffix}"
         self._attr_translation_key = f"bat_{suffix}"
         
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, f"battery_{bat_id}")},
-            "name": f"Pylontech Module {bat_id}",
-            "manufacturer": "Pylontech",
-            "model": "US Module",
-            "via_device": (DOMAIN, "system"),
-        }
+        self._attr_device_info = coordinator.module_device_info(bat_id)
 
     @property
     def native_value(self):
         if not self.coordinator.data: return None
-        for b in self.coordinator.data.batteries:
-            if b.sys_id == self._bat_id:
-                return getattr(b, self._attribute_key, None)
-        return None
+        bat = self.coordinator.data.modules.get(self._bat_id)
+        if bat is None: return None
+        return getattr(bat, self._attribute_key, None)
 
     @property
     def native_unit_of_measurement(self):
@@ -202,3 +304,134 @@ class PylontechBatterySensor(CoordinatorEntity, SensorEntity):
     @property
     def device_class(self):
         return self._device_class
+
+
+class PylontechCellSensor(ModuleEntityMixin, SignificantChangeMixin, CoordinatorEntity, SensorEntity):
+    """Representation of a Cell-level Sensor of a module."""
+    _attr_has_entity_name = True
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, coordinator, unique_id_prefix, bat_id, suffix, unit, device_class, attr_name, cell_index=None):
+        super().__init__(coordinator)
+        self._bat_id = bat_id
+        self._attribute_key = attr_name # property of PylontechCellTable
+        self._cell_index = cell_index
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+        if device_class == SensorDeviceClass.VOLTAGE:
+            # Cells move a few mV at a time, the stack voltage deadband would hide that
+            self._deadband_kind = "cell_voltage"
+            self._deadband_scale = 1000 if unit == UnitOfElectricPotential.MILLIVOLT else 1
+
+        self._attr_unique_id = f"{unique_id_prefix}_bat{bat_id}_{suffix}"
+        if cell_index is None:
+            self._attr_translation_key = f"bat_{suffix}"
+        else:
+            self._attr_translation_key = "bat_cell_volt"
+            self._attr_translation_placeholders = {"cell": str(cell_index)}
+            self._attr_entity_registry_enabled_default = False
+
+        self._attr_device_info = coordinator.module_device_info(bat_id)
+
+    @property
+    def native_value(self):
+        if not self.coordinator.data: return None
+        table = self.coordinator.data.cells.get(self._bat_id)
+        if table is None: return None
+        if self._cell_index is not None:
+            return table.cell_voltage(self._cell_index)
+        return getattr(table, self._attribute_key, None)
+
+
+class PylontechWindowSensor(ModuleEntityMixin, SignificantChangeMixin, CoordinatorEntity, SensorEntity):
+    """Representation of a Sensor aggregating recent samples of the stack or a module."""
+    _attr_has_entity_name = True
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, coordinator, unique_id_prefix, key, unit, device_class, field, aggregate, bat_id=None):
+        super().__init__(coordinator)
+        self._field = field # sample field in the history
+        self._aggregate = aggregate # min, max, avg, peak or rate
+        self._bat_id = bat_id
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+
+        self._attr_unique_id = f"{unique_id_prefix}_{key}"
+        if bat_id is None:
+            self._attr_translation_key = key
+            self._attr_device_info = coordinator.system_device_info()
+        else:
+            self._attr_translation_key = key.replace(f"bat{bat_id}_", "bat_")
+            self._attr_device_info = coordinator.module_device_info(bat_id)
+
+    @property
+    def native_value(self):
+        history = self.coordinator.history
+        ring = history.stack if self._bat_id is None else history.modules.get(self._bat_id)
+        if ring is None: return None
+
+        window = self.coordinator.stats_window
+        if self._aggregate == "peak":
+            value = ring.peak(self._field, window)
+        elif self._aggregate == "rate":
+            value = ring.rate(self._field, window)
+        else:
+            stats = ring.stats(self._field, window)
+            value = stats[self._aggregate] if stats else None
+        return round(value, 2) if value is not None else None
+
+    @property
+    def extra_state_attributes(self):
+        return {"window": self.coordinator.stats_window}
+
+
+class PylontechMetricSensor(CoordinatorEntity, SensorEntity):
+    """Representation of a Sensor reporting the link's own metrics.
+
+    Histograms report their 95th percentile in ms, with the median and the
+    99th percentile as attributes, counters report their running total.
+    """
+    _attr_has_entity_name = True
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, coordinator, unique_id_prefix, key, metric, unit=UnitOfTime.MILLISECONDS,
+                 device_class=SensorDeviceClass.DURATION):
+        super().__init__(coordinator)
+        self._metric = metric # attribute of LinkMetrics
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+        self._attr_state_class = (
+            SensorStateClass.MEASUREMENT if unit == UnitOfTime.MILLISECONDS else SensorStateClass.TOTAL_INCREASING
+        )
+
+        self._attr_unique_id = f"{unique_id_prefix}_{key}"
+        self._attr_translation_key = key
+        self._attr_device_info = coordinator.system_device_info()
+
+    @property
+    def _histogram(self):
+        value = getattr(self.coordinator.metrics, self._metric)
+        return value if hasattr(value, "quantile") else None
+
+    @property
+    def native_value(self):
+        histogram = self._histogram
+        if histogram is None:
+            return getattr(self.coordinator.metrics, self._metric)
+        return _milliseconds(histogram.quantile(0.95))
+
+    @property
+    def extra_state_attributes(self):
+        histogram = self._histogram
+        if histogram is None:
+            return {}
+        return {
+            "p50": _milliseconds(histogram.quantile(0.5)),
+            "p99": _milliseconds(histogram.quantile(0.99)),
+            "count": histogram.count,
+        }
+
+
+def _milliseconds(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
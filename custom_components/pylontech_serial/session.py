@@ -0,0 +1,71 @@
+"""Failure tracking for the serial port."""
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Consecutive failures before the port is left alone for a while
+BREAKER_THRESHOLD = 3
+# Wait after the breaker opens, doubled on every failed retry
+BACKOFF_BASE = 5  # seconds
+BACKOFF_MAX = 300  # seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops using a failing port instead of retrying it on every poll.
+
+    A few failures in a row are retried right away, a single bad read
+    shouldn't cost a poll. After `threshold` of them the breaker opens and
+    requests fail fast without touching the port. Once the backoff has
+    elapsed one request is let through (half open): success closes the
+    breaker, failure opens it again for twice as long, up to `max_delay`.
+    """
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, base_delay: float = BACKOFF_BASE,
+                 max_delay: float = BACKOFF_MAX, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self.failures = 0
+        self.delay = 0.0
+        self._retry_at = None
+
+    @property
+    def state(self) -> str:
+        if self._retry_at is None:
+            return CLOSED
+        return OPEN if self._clock() < self._retry_at else HALF_OPEN
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the port may be tried again, 0 if it may now."""
+        if self._retry_at is None:
+            return 0.0
+        return max(0.0, self._retry_at - self._clock())
+
+    def allow(self) -> bool:
+        return self.state != OPEN
+
+    def record_success(self):
+        if self._retry_at is not None:
+            _LOGGER.info(f"{self.name} is back after {self.failures} failures")
+        self.failures = 0
+        self.delay = 0.0
+        self._retry_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures < self.threshold:
+            return
+        self.delay = min(self.max_delay, self.delay * 2 if self.delay else self.base_delay)
+        if self._retry_at is None:
+            _LOGGER.warning(f"{self.name} failed {self.failures} times in a row, retrying in {self.delay:.0f}s")
+        else:
+            _LOGGER.debug(f"{self.name} still failing, retrying in {self.delay:.0f}s")
+        self._retry_at = self._clock() + self.delay
@@ -0,0 +1,62 @@
+"""Significant-change filtering of sensor state writes."""
+from dataclasses import fields
+
+from .structs import INFO_FIELDS, PylontechSystem, PylontechBattery
+
+# Snapshot fields compared between updates, containers are left out
+READING_FIELDS = tuple(f.name for f in fields(PylontechSystem) if f.name not in ("info", "batteries", "modules", "cells"))
+SYSTEM_FIELDS = READING_FIELDS + INFO_FIELDS
+BATTERY_FIELDS = tuple(f.name for f in fields(PylontechBattery) if f.name != "sys_id")
+
+
+class StateFilter:
+    """Decides whether a new sensor value is worth a state write.
+
+    Numeric values are written once they move past the deadband of their
+    kind (the sensor device class, or one the sensor picks) from the last
+    written value, that is max(absolute * scale, relative * |last|), with
+    `scale` converting the deadband to the sensor's unit. Kinds without a deadband, and
+    non-numeric values, are written on any change. Every state is written
+    again after `heartbeat` seconds, so flat periods still reach the
+    recorder.
+    """
+
+    def __init__(self, deadbands: dict = None, heartbeat: float = 0):
+        # kind -> (absolute, relative)
+        self.deadbands = dict(deadbands or {})
+        self.heartbeat = heartbeat
+
+    def is_significant(self, kind, last, value, scale: float = 1) -> bool:
+        if value == last:
+            return False
+        if not isinstance(value, (int, float)) or not isinstance(last, (int, float)):
+            return True
+        absolute, relative = self.deadbands.get(kind, (0, 0))
+        threshold = max(absolute * scale, relative * abs(last))
+        # Values are decimal readings, 3.005 - 3.003 mustn't fall short of 0.002
+        return threshold <= 0 or abs(value - last) >= threshold - 1e-9
+
+
+def changed_fields(old: PylontechSystem, new: PylontechSystem):
+    """Returns the (module id or None, field) pairs that differ, or None if unknown.
+
+    None means every field should be treated as changed: there was no
+    previous snapshot or modules came or went.
+    """
+    if old is None or new is None:
+        return None
+    old_batteries = old.modules
+    if len(old_batteries) != len(new.modules):
+        return None
+
+    # Snapshots share their info until 'info', 'stat' or 'time' runs again
+    names = READING_FIELDS if old.info is new.info else SYSTEM_FIELDS
+    changed = {(None, name) for name in names if getattr(old, name) != getattr(new, name)}
+    for bat in new.batteries:
+        previous = old_batteries.get(bat.sys_id)
+        if previous is None:
+            return None
+        for name in BATTERY_FIELDS:
+            if getattr(previous, name) != getattr(bat, name):
+                changed.add((bat.sys_id, name))
+    return changed
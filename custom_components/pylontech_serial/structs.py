@@ -1,7 +1,12 @@
-from dataclasses import dataclass, field
-from typing import List, Optional
+from array import array
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+from typing import Dict, List, Optional
 
-@dataclass
+# A snapshot is built for every poll, slots keep them small. Module rows
+# are reused by later snapshots (see PylontechSystem.index()).
+
+@dataclass(slots=True)
 class PylontechBattery:
     sys_id: int
     voltage: float
@@ -10,19 +15,103 @@ class PylontechBattery:
     soc: int
     status: str
     power: float
-    raw: str
     # Removed soh/cycles as requested per battery
+    # Volt.St, Curr.St and Temp.St columns, None if the firmware doesn't print them
+    voltage_status: Optional[str] = None
+    current_status: Optional[str] = None
+    temperature_status: Optional[str] = None
 
-@dataclass
-class PylontechSystem:
+    def set(self, voltage, current, temperature, soc, status, power,
+            voltage_status=None, current_status=None, temperature_status=None):
+        """Overwrites the readings of a reused row."""
+        self.voltage = voltage
+        self.current = current
+        self.temperature = temperature
+        self.soc = soc
+        self.status = status
+        self.power = power
+        self.voltage_status = voltage_status
+        self.current_status = current_status
+        self.temperature_status = temperature_status
+
+@dataclass(slots=True)
+class PylontechCell:
+    cell_id: int
     voltage: float
     current: float
-    soc: float
-    power: float
-    energy_in: float
-    energy_out: float
-    energy_stored: float
-    
+    temperature: float
+    status: str
+    soc: int
+    capacity: Optional[int] = None # mAh left, from the Coulomb column
+
+@dataclass(slots=True)
+class PylontechCellTable:
+    """Cell readings of one module, packed into arrays (mV and m°C)."""
+    module_id: int
+    voltages: array = field(default_factory=lambda: array("H"))
+    temperatures: array = field(default_factory=lambda: array("i"))
+    updated: float = 0.0 # monotonic time of the 'bat' read
+
+    @classmethod
+    def from_cells(cls, module_id: int, cells: List[PylontechCell], updated: float) -> "PylontechCellTable":
+        table = cls(module_id, updated=updated)
+        for cell in sorted(cells, key=lambda c: c.cell_id):
+            table.voltages.append(round(cell.voltage * 1000))
+            table.temperatures.append(round(cell.temperature * 1000))
+        return table
+
+    @property
+    def cell_count(self) -> int:
+        return len(self.voltages)
+
+    def cell_voltage(self, index: int) -> Optional[float]:
+        if 0 <= index < len(self.voltages):
+            return self.voltages[index] / 1000.0
+        return None
+
+    @property
+    def min_voltage(self) -> Optional[float]:
+        return min(self.voltages) / 1000.0 if self.voltages else None
+
+    @property
+    def max_voltage(self) -> Optional[float]:
+        return max(self.voltages) / 1000.0 if self.voltages else None
+
+    @property
+    def voltage_delta(self) -> Optional[int]:
+        """Cell imbalance in mV."""
+        return max(self.voltages) - min(self.voltages) if self.voltages else None
+
+    @property
+    def max_temperature(self) -> Optional[float]:
+        return max(self.temperatures) / 1000.0 if self.temperatures else None
+
+    def as_dict(self) -> dict:
+        return {"voltages": list(self.voltages), "temperatures": list(self.temperatures)}
+
+    @classmethod
+    def from_dict(cls, module_id: int, data: dict) -> "PylontechCellTable":
+        # The read time was on another run's clock, the table just counts as old
+        return cls(module_id, array("H", data["voltages"]), array("i", data["temperatures"]))
+
+@dataclass
+class PylontechHistoryRecord:
+    """One record of the BMS's own history ('data history N')."""
+    item: int
+    timestamp: datetime # BMS clock, naive local time
+    voltage: Optional[float] = None
+    current: Optional[float] = None
+    temperature: Optional[float] = None
+    soc: Optional[float] = None
+
+@dataclass(slots=True)
+class PylontechInfo:
+    """What 'info', 'stat' and 'time' report, it changes far less often than 'pwr'.
+
+    One instance is shared by every snapshot taken until one of those
+    commands runs again, it's then copied (see dataclasses.replace) and
+    the copy is updated, so older snapshots keep what they had.
+    """
     # Info Command Data
     cell_count: Optional[int] = None
     spec: Optional[str] = None
@@ -37,11 +126,96 @@ class PylontechSystem:
     # Stat Command Data
     cycles: Optional[int] = None
     soh: Optional[int] = None # System average or from stack stat
-    
-    raw: str = ""
-    
+    coulomb: Optional[int] = None # mAh left in the addressed module
+    discharged: Optional[int] = None # mAh discharged over the lifetime
+    history_items: Optional[int] = None # records in the BMS history ('HisData Items')
+
+INFO_FIELDS = tuple(f.name for f in fields(PylontechInfo))
+# Fields of a snapshot that hold other structs
+_CONTAINER_FIELDS = ("info", "batteries", "modules", "cells")
+
+@dataclass(slots=True)
+class PylontechSystem:
+    """One reading of the stack.
+
+    The fields of `info` can be read and set on the snapshot itself, e.g.
+    `system.model`.
+
+    Not a frozen copy: once a snapshot is neither the coordinator's data
+    nor being built, its module rows may be overwritten in place for a
+    new snapshot (see index()). Copy what has to outlive the next poll,
+    e.g. with as_dict().
+    """
+    voltage: float
+    current: float
+    soc: float
+    power: float
+    energy_in: float
+    energy_out: float
+    energy_stored: float
+
+    info: PylontechInfo = field(default_factory=PylontechInfo)
     batteries: List[PylontechBattery] = field(default_factory=list)
+    # Same modules keyed by sys_id, set by index() once per snapshot
+    modules: Dict[int, PylontechBattery] = field(default_factory=dict)
+    # Per-module cell readings, filled a few modules at a time
+    cells: Dict[int, PylontechCellTable] = field(default_factory=dict)
 
     @property
     def battery_count(self) -> int:
         return len(self.batteries)
+
+    def index(self, rows: Dict[int, PylontechBattery] = None):
+        """Sets the id-keyed module index, call it after filling batteries.
+
+        With `rows`, the index of an older snapshot whose rows were reused
+        for this one, that dict is brought up to date and becomes the index
+        instead of a new one. The older snapshot's rows are changed in
+        place, the coordinator only hands in indexes of snapshots that are
+        no longer current.
+        """
+        if rows is None:
+            self.modules = {bat.sys_id: bat for bat in self.batteries}
+            return
+        if len(rows) != len(self.batteries) or any(rows.get(bat.sys_id) is not bat for bat in self.batteries):
+            rows.clear()
+            rows.update((bat.sys_id, bat) for bat in self.batteries)
+        self.modules = rows
+
+    def as_dict(self) -> dict:
+        """JSON-friendly copy, for HA storage."""
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name not in _CONTAINER_FIELDS}
+        data.update(asdict(self.info))
+        data["batteries"] = [asdict(bat) for bat in self.batteries]
+        # JSON keys are strings
+        data["cells"] = {str(module_id): table.as_dict() for module_id, table in self.cells.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PylontechSystem":
+        """Rebuilds a snapshot saved with as_dict()."""
+        system = cls(**{
+            name: value for name, value in data.items() if name not in _CONTAINER_FIELDS and name not in INFO_FIELDS
+        })
+        system.info = PylontechInfo(**{name: value for name, value in data.items() if name in INFO_FIELDS})
+        system.batteries = [PylontechBattery(**bat) for bat in data.get("batteries", [])]
+        system.index()
+        system.cells = {
+            int(module_id): PylontechCellTable.from_dict(int(module_id), table)
+            for module_id, table in data.get("cells", {}).items()
+        }
+        return system
+
+
+def _info_property(name: str) -> property:
+    def getter(self):
+        return getattr(self.info, name)
+
+    def setter(self, value):
+        setattr(self.info, name, value)
+
+    return property(getter, setter)
+
+
+for _name in INFO_FIELDS:
+    setattr(PylontechSystem, _name, _info_property(_name))
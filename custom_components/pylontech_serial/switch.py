@@ -28,11 +28,7 @@ class PylontechAutoSyncSwitch(CoordinatorEntity, SwitchEntity, RestoreEntity):
         super().__init__(coordinator)
         self._attr_unique_id = f"{unique_id_prefix}_auto_sync"
         self._attr_is_on = False # Default off
-        self._attr_device_info = {
-            "identifiers": {(DOMAIN, "system")},
-            "name": "Pylontech Stack",
-            "manufacturer": "Pylontech",
-        }
+        self._attr_device_info = coordinator.system_device_info()
 
     async def async_added_to_hass(self) -> None:
         """Restore last state."""
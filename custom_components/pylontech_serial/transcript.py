@@ -0,0 +1,231 @@
+"""Recording and replay of raw console transcripts.
+
+A transcript is a directory of segment files. Every record in a segment is
+a fixed header (timestamp, command length, compressed payload length), the
+command and the zlib-compressed response:
+
+    <d H I> command payload
+
+Each segment has an index next to it, one <Q d> (offset, timestamp) entry
+per record, so a reader can jump to a time without decompressing anything
+before it. Segments are rotated by size, and the oldest are deleted once
+the directory grows past its limit.
+
+This module doesn't depend on Home Assistant, transcripts can be read with
+a plain Python install.
+"""
+import bisect
+import logging
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("<dHI")
+INDEX_ENTRY = struct.Struct("<Qd")
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+SEGMENT_NAME = re.compile(r"^(\d{6})\.seg$")
+
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024  # bytes
+# Responses are small, a fast level compresses them nearly as well
+COMPRESSION_LEVEL = 3
+
+
+@dataclass(frozen=True)
+class TranscriptRecord:
+    timestamp: float
+    command: str
+    response: bytes
+
+
+def _segment_numbers(directory: str) -> list:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(match.group(1)) for match in map(SEGMENT_NAME.match, names) if match)
+
+
+def _segment_path(directory: str, number: int, suffix: str = SEGMENT_SUFFIX) -> str:
+    return os.path.join(directory, f"{number:06d}{suffix}")
+
+
+class TranscriptRecorder:
+    """Appends console transactions to a transcript directory.
+
+    record() only queues the transaction; compression and file writes
+    happen on a background thread, so it's safe to call from the event
+    loop. A new segment is started on every open, segments are closed at
+    `segment_size` bytes and the oldest are removed to keep the directory
+    under `max_size` bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int, segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = min(segment_size, max_size)
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._segment = None
+        self._index = None
+        self._number = 0
+        self.records = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pylontech transcript", daemon=True)
+            self._thread.start()
+
+    def record(self, timestamp: float, command: str, response: bytes):
+        if self._thread is None:
+            self.dropped += 1
+            return
+        self._queue.put((timestamp, command, response))
+
+    def close(self):
+        """Writes what's queued and stops the thread. Blocks, run it in an executor."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            numbers = _segment_numbers(self.directory)
+            self._number = numbers[-1] if numbers else 0
+            self._open_segment()
+        except OSError as e:
+            _LOGGER.error(f"Can't record transcripts in {self.directory}: {e}")
+            self._thread = None
+            return
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except OSError as e:
+                self.dropped += 1
+                _LOGGER.warning(f"Could not write transcript record: {e}")
+        self._close_segment()
+
+    def _open_segment(self):
+        self._number += 1
+        self._segment = open(_segment_path(self.directory, self._number), "ab")
+        self._index = open(_segment_path(self.directory, self._number, INDEX_SUFFIX), "ab")
+        self._enforce_limit()
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = self._index = None
+
+    def _write(self, timestamp: float, command: str, response: bytes):
+        command = command.encode("ascii", errors="replace")
+        payload = zlib.compress(response, COMPRESSION_LEVEL)
+        offset = self._segment.tell()
+        self._segment.write(RECORD_HEADER.pack(timestamp, len(command), len(payload)) + command + payload)
+        self._segment.flush()
+        # The index is written last, a reader never finds an entry for a partial record
+        self._index.write(INDEX_ENTRY.pack(offset, timestamp))
+        self._index.flush()
+        self.records += 1
+
+        if self._segment.tell() >= self.segment_size:
+            self._close_segment()
+            self._open_segment()
+
+    def _enforce_limit(self):
+        numbers = _segment_numbers(self.directory)
+        sizes = {}
+        for number in numbers:
+            sizes[number] = sum(
+                os.path.getsize(_segment_path(self.directory, number, suffix))
+                for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX)
+                if os.path.exists(_segment_path(self.directory, number, suffix))
+            )
+        total = sum(sizes.values()) + self.segment_size
+        for number in numbers:
+            if total <= self.max_size or number == self._number:
+                break
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+                try:
+                    os.remove(_segment_path(self.directory, number, suffix))
+                except FileNotFoundError:
+                    pass
+            total -= sizes[number]
+
+
+class TranscriptReader:
+    """Reads a transcript directory, oldest record first.
+
+    Segments are memory-mapped and records decompressed one at a time, so
+    months of transcripts can be replayed without loading them. A segment
+    cut short (e.g. by a power loss) is read up to its last whole record.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segments(self) -> list:
+        return [_segment_path(self.directory, number) for number in _segment_numbers(self.directory)]
+
+    def __iter__(self) -> Iterator[TranscriptRecord]:
+        return self.read()
+
+    def read(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[TranscriptRecord]:
+        """Yields the records with since <= timestamp < until."""
+        for path in self.segments():
+            yield from self._read_segment(path, since, until)
+
+    def _read_segment(self, path: str, since, until) -> Iterator[TranscriptRecord]:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = self._start_offset(path, since)
+                size = len(data)
+                while offset + RECORD_HEADER.size <= size:
+                    timestamp, command_length, payload_length = RECORD_HEADER.unpack_from(data, offset)
+                    start = offset + RECORD_HEADER.size
+                    end = start + command_length + payload_length
+                    if end > size:
+                        break
+                    offset = end
+                    if until is not None and timestamp >= until:
+                        return
+                    if since is not None and timestamp < since:
+                        continue
+                    try:
+                        response = zlib.decompress(data[start + command_length:end])
+                    except zlib.error:
+                        _LOGGER.warning(f"Corrupt transcript record in {path}, skipping the rest of the segment")
+                        return
+                    yield TranscriptRecord(timestamp, data[start:start + command_length].decode("ascii"), response)
+
+    @staticmethod
+    def _start_offset(path: str, since) -> int:
+        """Offset of the first record at or after `since`, from the index when there's one."""
+        if since is None:
+            return 0
+        try:
+            with open(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, "rb") as file:
+                index = file.read()
+        except FileNotFoundError:
+            return 0
+        entries = [INDEX_ENTRY.unpack_from(index, position)
+                   for position in range(0, len(index) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+        position = bisect.bisect_left([timestamp for _, timestamp in entries], since)
+        return entries[position][0] if position < len(entries) else (entries[-1][0] if entries else 0)
@@ -0,0 +1,563 @@
+"""Asyncio transport for the Pylontech console port."""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+
+import serial_asyncio_fast
+
+from .console import (
+    COMPLETED,
+    END_MARK,
+    PAGER_EXIT,
+    PROMPT,
+    PROMPT_GRACE,
+    WAKE_TIMEOUT,
+    command_timeout,
+    count_frames,
+    is_paged,
+    is_response,
+    split_responses,
+)
+from .metrics import LinkMetrics
+from .rs485 import CID2_ALARM, CID2_ANALOG, CID2_MANUFACTURER, EOI, FRAME_TIMEOUT, SOI
+from .session import CircuitBreaker
+
+_LOGGER = logging.getLogger(__name__)
+
+# Lower value runs first
+PRIORITY_USER = 0
+PRIORITY_TIME_SYNC = 1
+PRIORITY_POLL = 10
+PRIORITY_BACKFILL = 20
+
+READ_CHUNK = 4096
+# Quiet period used to consider stale input drained
+DRAIN_TIMEOUT = 0.01  # seconds
+# Wait before restarting a stream that failed
+STREAM_RETRY_DELAY = 5  # seconds
+# Latest responses kept in memory for diagnostics
+RECENT_RESPONSES = 32
+
+# Names RS485 requests are counted under in the metrics
+_RS485_NAMES = {CID2_ANALOG: "analog", CID2_ALARM: "alarm", CID2_MANUFACTURER: "manufacturer"}
+
+
+class PylontechTransportError(Exception):
+    """Raised when the console port can't be used."""
+
+
+class PylontechNoAnswerError(PylontechTransportError):
+    """Raised when an RS485 request got no answer in time, the port itself stays open."""
+
+
+class PylontechTransport:
+    """Owns the console port and runs queued commands one at a time.
+
+    Commands are ordered by priority, then by arrival. A command whose
+    deadline passes while it's still queued fails with TimeoutError, and
+    one cancelled by its caller is dropped before it reaches the wire.
+
+    While a stream is set (see start_stream), the port is left running the
+    streaming command whenever the queue is empty, and the stream is paused
+    around every queued command.
+
+    The console session is kept open and warm between commands: as long as
+    every response came back complete, from its echo to the prompt, the next
+    command is written straight away. Only after a response that doesn't
+    match (stale output, a missed prompt) is input drained and a fresh
+    prompt requested before writing. Only poll and backfill commands, which
+    just read, are sent again after such a response; user commands and
+    time syncs are written once and return whatever came back. Paged
+    output ends at the pager's prompt, which is left with a key other than
+    Enter before the next command. Failures go through a CircuitBreaker,
+    so a dead port is retried with a growing backoff instead of on every
+    poll; requests fail fast while it's open.
+
+    The latest responses are kept in `recent`, as (time, command, response),
+    for diagnostics. With a `recorder` (see transcript.py), every response
+    and stream chunk is also handed to it.
+
+    Round trips, bytes read, retries, errors and the time spent waiting in
+    the queue are counted in `metrics` (see metrics.py).
+    """
+
+    def __init__(self, port, baud_rate, open_connection=None, recorder=None):
+        self.port = port
+        self.baud_rate = baud_rate
+        # Overridable so the transport can be driven by other streams
+        self._open_connection = open_connection or self._open_serial_connection
+        self._reader = None
+        self._writer = None
+        # Bumped every time the port is (re)opened
+        self.connection_id = 0
+        self._queue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker = None
+        # Set whenever something is queued, to interrupt the stream
+        self._queued = asyncio.Event()
+        self._stream_command = None
+        self._stream_callback = None
+        self._stream_reset = None
+        self._streaming = False
+        self.recorder = recorder
+        self.recent = deque(maxlen=RECENT_RESPONSES)
+        # Whether the console is known to be sitting at a fresh prompt
+        self._in_sync = False
+        # Whether the console is waiting at the pager instead
+        self._paged = False
+        self.breaker = CircuitBreaker(f"Port {port}")
+        self.metrics = LinkMetrics()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def _open_serial_connection(self):
+        _LOGGER.debug(f"Opening serial port {self.port} at {self.baud_rate}")
+        return await serial_asyncio_fast.open_serial_connection(url=self.port, baudrate=self.baud_rate)
+
+    async def execute(self, command: str, priority: int = PRIORITY_POLL, timeout: float = None, deadline: float = None) -> bytes:
+        """Queues a command and returns its raw response.
+
+        `timeout` bounds the time on the wire, `deadline` (loop time) bounds
+        the whole request including the time spent waiting in the queue.
+        """
+        if timeout is None:
+            timeout = command_timeout(command)
+        return await self._enqueue(command, priority, timeout, deadline)
+
+    async def execute_batch(self, commands: list, priority: int = PRIORITY_POLL, timeout: float = None, deadline: float = None) -> list:
+        """Writes several commands in one go and returns one payload per command.
+
+        The response stream is split on the echo and prompt of each command.
+        Any command whose payload is missing (the console may drop type-ahead
+        input while it's busy printing) is re-sent on its own.
+        """
+        if timeout is None:
+            timeout = sum(command_timeout(command) for command in commands)
+        return await self._enqueue(tuple(commands), priority, timeout, deadline)
+
+    def start_stream(self, command: str, callback, reset=None):
+        """Keeps `command` (e.g. 'disp') running between queued commands.
+
+        `callback` gets every chunk the stream prints, from the event loop.
+        `reset` is called whenever the stream is paused or restarted, the
+        chunks after it don't continue the ones before.
+        """
+        self._stream_command = command
+        self._stream_callback = callback
+        self._stream_reset = reset
+        self._ensure_worker()
+        self._queued.set()
+
+    def stop_stream(self):
+        """Stops restarting the stream, it's interrupted on the next command."""
+        self._stream_command = None
+        self._stream_callback = None
+        self._stream_reset = None
+        self._queued.set()
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _enqueue(self, request, priority, timeout, deadline):
+        # Checked here so a bad command fails its caller, not the worker
+        for command in (request if isinstance(request, tuple) else (request,)):
+            if not isinstance(command, str) or not command.isascii():
+                raise PylontechTransportError(f"Commands must be ASCII text, got {command!r}")
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put_nowait((priority, next(self._sequence), request, timeout, deadline, loop.time(), future))
+        self._queued.set()
+        return await future
+
+    async def close(self):
+        """Stops the worker, fails pending commands and closes the port."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # Already dead, closing should still go through
+                _LOGGER.debug(f"Transport worker had stopped: {e!r}")
+            self._worker = None
+
+        while not self._queue.empty():
+            *_, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(PylontechTransportError("Transport closed"))
+
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+        self._streaming = False
+        self._in_sync = False
+        self._paged = False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._queue.empty():
+                if self._stream_command is not None:
+                    await self._run_stream()
+                else:
+                    # Woken up by a new command or stream
+                    self._queued.clear()
+                    await self._queued.wait()
+                continue
+
+            priority, _, request, timeout, deadline, queued_at, future = self._queue.get_nowait()
+            if future.done():
+                # Cancelled by the caller while waiting
+                continue
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    future.set_exception(TimeoutError(f"Deadline expired before sending {request!r}"))
+                    continue
+                timeout = min(timeout, remaining)
+
+            if not self.breaker.allow():
+                future.set_exception(PylontechTransportError(
+                    f"Port unavailable after {self.breaker.failures} failures, next attempt in {self.breaker.retry_in:.0f}s"
+                ))
+                continue
+
+            name = self._request_name(request)
+            started = loop.time()
+            self.metrics.queue_wait.observe(started - queued_at)
+            try:
+                if self._streaming:
+                    await self._pause_stream()
+                # Reads can be sent again, a user command or time sync mustn't run twice
+                retry = priority >= PRIORITY_POLL
+                if isinstance(request, tuple):
+                    result = await self._transact_batch(request, timeout, retry)
+                else:
+                    result = await self._transact(request, timeout, retry)
+            except asyncio.CancelledError:
+                self._disconnect()
+                if not future.done():
+                    future.set_exception(PylontechTransportError("Transport closed"))
+                raise
+            except PylontechNoAnswerError as e:
+                self.breaker.record_failure()
+                self.metrics.count_error(name)
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            except (OSError, PylontechTransportError) as e:
+                self._disconnect()
+                self.breaker.record_failure()
+                self.metrics.count_error(name)
+                if not future.done():
+                    future.set_exception(PylontechTransportError(f"Serial Error: {e}"))
+                continue
+            except Exception as e:
+                # A bug, not the port: fail this request and keep serving the others
+                _LOGGER.exception(f"Unexpected error running {request!r}")
+                self._in_sync = False
+                self.metrics.count_error(name)
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.breaker.record_success()
+            self.metrics.observe_command(
+                name, loop.time() - started,
+                sum(map(len, result)) if isinstance(request, tuple) else len(result),
+            )
+
+            received = time.time()
+            for command, response in (zip(request, result) if isinstance(request, tuple) else ((request, result),)):
+                self.recent.append((received, command, response))
+                if self.recorder is not None:
+                    self.recorder.record(received, command, response)
+
+            # A caller that gave up keeps its slot on the wire, the result is just dropped
+            if not future.done():
+                future.set_result(result)
+
+    async def _run_stream(self):
+        """Feeds the stream to its callback until something is queued."""
+        if not self.breaker.allow():
+            # Sit out the backoff, a queued command still wakes us up (and fails fast)
+            self._queued.clear()
+            try:
+                await asyncio.wait_for(self._queued.wait(), self.breaker.retry_in)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        try:
+            await self._connect()
+            if not self._streaming:
+                if not self._in_sync:
+                    await self._wake()
+                _LOGGER.debug(f"Starting stream '{self._stream_command}'")
+                self._reset_stream()
+                self._writer.write(self._stream_command.encode("ascii") + b"\n")
+                self._streaming = True
+                self._in_sync = False
+
+            self._queued.clear()
+            while self._queue.empty() and self._stream_command is not None:
+                read = asyncio.ensure_future(self._reader.read(READ_CHUNK))
+                queued = asyncio.ensure_future(self._queued.wait())
+                try:
+                    await asyncio.wait({read, queued}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    read.cancel()
+                    queued.cancel()
+                if read.done() and not read.cancelled():
+                    chunk = read.result()
+                    if not chunk:
+                        raise PylontechTransportError("Port closed")
+                    self.breaker.record_success()
+                    if self.recorder is not None:
+                        self.recorder.record(time.time(), self._stream_command, chunk)
+                    try:
+                        if self._stream_callback is not None:
+                            self._stream_callback(chunk)
+                    except Exception:
+                        _LOGGER.exception("Error handling stream data")
+                self._queued.clear()
+
+            if self._stream_command is None:
+                await self._pause_stream()
+        except (OSError, PylontechTransportError) as e:
+            _LOGGER.warning(f"Stream '{self._stream_command}' failed: {e}")
+            self._disconnect()
+            self.breaker.record_failure()
+            # Don't spin on a dead port, a queued command still wakes us up
+            self._queued.clear()
+            try:
+                await asyncio.wait_for(self._queued.wait(), max(STREAM_RETRY_DELAY, self.breaker.retry_in))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _pause_stream(self):
+        """Interrupts the streaming command and waits for the prompt."""
+        _LOGGER.debug("Pausing stream")
+        self._streaming = False
+        self._reset_stream()
+        # Any key stops the periodic output
+        self._writer.write(b"\n")
+        self._in_sync = (await self._read_frame(WAKE_TIMEOUT)).rstrip().endswith(PROMPT)
+
+    def _reset_stream(self):
+        try:
+            if self._stream_reset is not None:
+                self._stream_reset()
+        except Exception:
+            _LOGGER.exception("Error resetting stream state")
+
+    async def _connect(self):
+        if self._writer is None:
+            self._reader, self._writer = await self._open_connection()
+            self.connection_id += 1
+
+    async def _transact(self, command: str, timeout: float, retry: bool = True) -> bytes:
+        await self._connect()
+        for attempt in range(2):
+            if not self._in_sync:
+                await self._wake()
+            self._writer.write(command.encode("ascii") + b"\n")
+            frame = await self._read_frame(timeout)
+            answered = is_response(frame, command)
+            self._paged = is_paged(frame)
+            self._in_sync = answered and not self._paged
+            if answered or attempt or not retry:
+                break
+            # Whatever we read wasn't ours, resync and ask again
+            _LOGGER.debug(f"Console out of sync on '{command}' ({len(frame)} bytes), resyncing")
+            self.metrics.count_retry(self._command_name(command))
+
+        if not frame:
+            raise PylontechTransportError(f"No answer to '{command}'")
+        return frame
+
+    async def _transact_batch(self, commands: tuple, timeout: float, retry: bool = True) -> list:
+        await self._connect()
+        if not self._in_sync:
+            await self._wake()
+        self._writer.write(b"".join(command.encode("ascii") + b"\n" for command in commands))
+        stream = await self._read_frame(timeout, len(commands))
+        if not stream:
+            self._in_sync = False
+            raise PylontechTransportError(f"No answer to {list(commands)}")
+        payloads = split_responses(stream, commands)
+        last_prompt = stream.rfind(PROMPT)
+        self._paged = is_paged(stream if last_prompt == -1 else stream[last_prompt + len(PROMPT):])
+        # Missing payloads are re-sent one by one, after a resync
+        self._in_sync = all(payloads) and stream.rstrip().endswith(PROMPT)
+
+        for i, command in enumerate(commands):
+            if not payloads[i] and retry:
+                _LOGGER.debug(f"No pipelined response for '{command}', sending it on its own")
+                self.metrics.count_retry(self._command_name(command))
+                payloads[i] = await self._transact(command, command_timeout(command))
+        return payloads
+
+    def _command_name(self, command: str) -> str:
+        """Name the command is counted under in `metrics`, its arguments left out."""
+        return command.split(" ", 1)[0] or "newline"
+
+    def _request_name(self, request) -> str:
+        if isinstance(request, tuple):
+            return "+".join(self._command_name(command) for command in request)
+        return self._command_name(request)
+
+    async def _drain(self):
+        """Drops whatever input is pending."""
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self._reader.read(READ_CHUNK), DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                raise PylontechTransportError("Port closed")
+
+    async def _wake(self):
+        """Drops stale input and waits for a fresh prompt."""
+        await self._drain()
+        if self._paged:
+            # Enter would print the next page
+            self._paged = False
+            self._writer.write(PAGER_EXIT)
+        else:
+            self._writer.write(b"\n")
+        if PROMPT not in await self._read_frame(WAKE_TIMEOUT):
+            _LOGGER.debug("No prompt after waking the console")
+
+    async def _read_frame(self, timeout: float, frames: int = 1) -> bytes:
+        """Reads until `frames` console prompts are seen or the timeout expires."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + timeout
+        buffer = bytearray()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                _LOGGER.debug(f"Console read timed out after {timeout}s ({len(buffer)} bytes)")
+                break
+            try:
+                chunk = await asyncio.wait_for(self._reader.read(READ_CHUNK), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if not chunk:
+                raise PylontechTransportError("Port closed")
+
+            buffer += chunk
+            if count_frames(buffer) >= frames:
+                break
+            if buffer.count(COMPLETED) >= frames or buffer.count(END_MARK) >= frames:
+                # The prompt follows right after, don't wait the full timeout for it
+                deadline = min(deadline, loop.time() + PROMPT_GRACE)
+
+        _LOGGER.debug(f"Console frame: {len(buffer)} bytes in {loop.time() - start:.3f}s")
+        return bytes(buffer)
+
+
+class PylontechRS485Transport(PylontechTransport):
+    """Runs RS485 protocol requests (see rs485.py) instead of console commands.
+
+    Commands are encoded request frames and the response is the raw frame
+    that came back. A request nobody answers in time fails with
+    PylontechNoAnswerError, which counts as a failure for the breaker but
+    keeps the port open. The bus is strictly request/response, so a batch
+    is sent one frame at a time; a frame left unanswered in a batch comes
+    back as b"", and the batch only fails if none was answered.
+    Queueing, priorities and recording work as for the console.
+    """
+
+    def __init__(self, port, baud_rate, open_connection=None, recorder=None):
+        super().__init__(port, baud_rate, open_connection, recorder)
+        # Set when a late answer may still be on its way, the next request drains it first
+        self._stale = True
+
+    async def execute(self, command: str, priority: int = PRIORITY_POLL, timeout: float = None, deadline: float = None) -> bytes:
+        return await self._enqueue(command, priority, FRAME_TIMEOUT if timeout is None else timeout, deadline)
+
+    async def execute_batch(self, commands: list, priority: int = PRIORITY_POLL, timeout: float = None, deadline: float = None) -> list:
+        if timeout is None:
+            timeout = FRAME_TIMEOUT * len(commands)
+        return await self._enqueue(tuple(commands), priority, timeout, deadline)
+
+    def start_stream(self, command: str, callback, reset=None):
+        raise PylontechTransportError("The RS485 protocol has no streaming command")
+
+    def _disconnect(self):
+        super()._disconnect()
+        self._stale = True
+
+    def _command_name(self, command: str) -> str:
+        # The CID2 of the request, after SOI, VER, ADR and CID1
+        cid2 = int(command[7:9], 16)
+        return f"rs485_{_RS485_NAMES.get(cid2, f'{cid2:02x}')}"
+
+    def _request_name(self, request) -> str:
+        # All frames of a batch usually ask the same thing of different modules
+        if isinstance(request, tuple):
+            return "+".join(dict.fromkeys(self._command_name(command) for command in request))
+        return self._command_name(request)
+
+    async def _transact(self, command: str, timeout: float, retry: bool = True) -> bytes:
+        await self._connect()
+        if self._stale:
+            # A late answer to a timed out request would be taken for this one's
+            await self._drain()
+            self._stale = False
+        self._writer.write(command.encode("ascii"))
+        frame = await self._read_frame(timeout)
+        if not frame:
+            raise PylontechNoAnswerError(f"No answer to {command.strip()!r}")
+        return frame
+
+    async def _transact_batch(self, commands: tuple, timeout: float, retry: bool = True) -> list:
+        frames = []
+        for command in commands:
+            try:
+                frames.append(await self._transact(command, timeout / len(commands)))
+            except PylontechNoAnswerError:
+                # A module may be missing, the others still count
+                frames.append(b"")
+        if not any(frames):
+            raise PylontechNoAnswerError(f"No answer to any of {len(commands)} requests")
+        return frames
+
+    async def _read_frame(self, timeout: float, frames: int = 1) -> bytes:
+        """Reads one frame, from SOI to EOI, or returns b"" when the timeout expires."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        buffer = bytearray()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                _LOGGER.debug(f"RS485 read timed out after {timeout}s ({len(buffer)} bytes)")
+                self._stale = True
+                return b""
+            try:
+                chunk = await asyncio.wait_for(self._reader.read(READ_CHUNK), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if not chunk:
+                raise PylontechTransportError("Port closed")
+
+            buffer += chunk
+            start = buffer.find(SOI)
+            if start == -1:
+                buffer.clear()
+                continue
+            end = buffer.find(EOI, start)
+            if end != -1:
+                return bytes(buffer[start:end + 1])
@@ -1,208 +1,358 @@
-import serial
-import time
+"""Bridges a Pylontech console to MQTT, with Home Assistant discovery.
+
+The console is read with the integration's own transport and parser (the
+Docker image copies them into the `pylontech` package). Every field gets
+its own retained topic, published only when its value changes, and
+discovery is published whenever the set of present modules changes.
+
+While the broker can't be reached, samples are kept in an on-disk spool
+and sent to the history topic, with their timestamps, once it's back.
+Home Assistant doesn't read that topic (an MQTT sensor can't take a state
+from the past), it's there for consumers that store their own series,
+e.g. Node-RED or Telegraf into InfluxDB. HA itself shows the outage as a
+gap.
+
+With METRICS_PORT set, the link's round trips, parse times and counters
+(see metrics.py) are served for Prometheus on http://<host>:<port>/metrics.
+"""
+import asyncio
 import json
+import logging
+import os
+import time
+
 import paho.mqtt.client as mqtt
 
+from pylontech.parser import PylontechParser
+from pylontech.structs import PylontechSystem
+from pylontech.transport import PylontechTransport, PylontechTransportError
+from spool import DiskQueue
+
 # --- CONFIGURATION ---
-SERIAL_PORT = '/dev/ttyUSB0'
-BAUD_RATE = 115200
-MQTT_BROKER = "192.168.2.10" # Or IP address
-MQTT_PORT = 1883
-MQTT_USER = "batteries"
-MQTT_PASS = "F90ewxDsif2vWP06"
-
-# Base topic for state updates
-STATE_TOPIC = "pylontech/stack/state"
+# Everything can be overridden with environment variables of the same name
+SERIAL_PORT = os.environ.get("SERIAL_PORT", "/dev/ttyUSB0")
+BAUD_RATE = int(os.environ.get("BAUD_RATE", 115200))
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "192.168.2.10") # Or IP address
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
+MQTT_USER = os.environ.get("MQTT_USER", "batteries")
+MQTT_PASS = os.environ.get("MQTT_PASS", "F90ewxDsif2vWP06")
+MQTT_QOS = int(os.environ.get("MQTT_QOS", 0))
+
+# Seconds between 'pwr' reads
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", 2))
+
+# Base topic for state updates, one topic per field below it
+BASE_TOPIC = os.environ.get("BASE_TOPIC", "pylontech/stack")
+AVAILABILITY_TOPIC = f"{BASE_TOPIC}/availability"
+# Samples taken while the broker was unreachable, as JSON with a timestamp.
+# No discovery for it, HA can't backdate states; meant for external consumers.
+HISTORY_TOPIC = f"{BASE_TOPIC}/history"
 # Base topic for HA Discovery (Standard is 'homeassistant')
-DISCOVERY_PREFIX = "homeassistant" 
+DISCOVERY_PREFIX = os.environ.get("DISCOVERY_PREFIX", "homeassistant")
 NODE_ID = "pylontech_stack"
 
-# How many batteries do you physically have?
-BATTERY_COUNT = 2 
+# Where samples wait during broker outages, and how much of them to keep
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "/data/spool")
+SPOOL_MAX_MB = int(os.environ.get("SPOOL_MAX_MB", 64))
+# Spooled samples are sent in batches of DRAIN_BATCH, at most DRAIN_RATE per second
+DRAIN_BATCH = int(os.environ.get("DRAIN_BATCH", 50))
+DRAIN_RATE = float(os.environ.get("DRAIN_RATE", 20))
 
-def publish_discovery_config(client):
-    """
-    Sends the MQTT Discovery payloads so HA creates the entities automatically.
-    """
-    print("Sending Auto-Discovery Config...")
-
-    # --- 1. DEFINE THE DEVICE ---
-    # This groups all sensors under one "Device" in Home Assistant
-    device_info = {
-        "identifiers": [NODE_ID],
-        "name": "Pylontech Battery Stack",
-        "manufacturer": "Pylontech",
-        "model": "US2000 (Console)",
-        "sw_version": "Console-v1"
+# Port of the Prometheus endpoint, 0 to leave it off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+
+_LOGGER = logging.getLogger("pylon2mqtt")
+
+# (object id, name, unit, device class, field)
+SYSTEM_SENSORS = [
+    ("sys_soc", "System SOC", "%", "battery", "soc"),
+    ("sys_volt", "System Voltage", "V", "voltage", "voltage"),
+    ("sys_curr", "System Current", "A", "current", "current"),
+    ("sys_power", "System Power", "W", "power", "power"),
+]
+
+# (suffix, name, unit, device class, field)
+BATTERY_SENSORS = [
+    ("volt", "Voltage", "V", "voltage", "voltage"),
+    ("curr", "Current", "A", "current", "current"),
+    ("temp", "Temperature", "°C", "temperature", "temperature"),
+    ("soc", "SOC", "%", "battery", "soc"),
+    ("power", "Power", "W", "power", "power"),
+    ("status", "Status", None, None, "status"), # Text sensor
+]
+
+DEVICE_INFO = {
+    "identifiers": [NODE_ID],
+    "name": "Pylontech Battery Stack",
+    "manufacturer": "Pylontech",
+    "model": "US2000 (Console)",
+    "sw_version": "Console-v1"
+}
+
+
+def system_topic(field):
+    return f"{BASE_TOPIC}/system/{field}"
+
+
+def battery_topic(bat_id, field):
+    return f"{BASE_TOPIC}/battery/{bat_id}/{field}"
+
+
+def battery_availability_topic(bat_id):
+    return f"{BASE_TOPIC}/battery/{bat_id}/availability"
+
+
+def sensor_config(object_id, name, unit, device_class, state_topic, availability):
+    payload = {
+        "name": name,
+        "unique_id": f"{NODE_ID}_{object_id}",
+        "state_topic": state_topic,
+        "device": DEVICE_INFO,
+        "availability": [{"topic": topic} for topic in availability],
+        "availability_mode": "all",
     }
+    if unit:
+        payload["unit_of_measurement"] = unit
+        payload["state_class"] = "measurement"
+    if device_class:
+        payload["device_class"] = device_class
+    return payload
 
-    # --- 2. DEFINE SENSORS TO CREATE ---
-    
-    # List of System-wide sensors
-    system_sensors = [
-        {"id": "sys_soc", "name": "System SOC", "unit": "%", "class": "battery", "tpl": "{{ value_json.system.soc }}"},
-        {"id": "sys_volt", "name": "System Voltage", "unit": "V", "class": "voltage", "tpl": "{{ value_json.system.voltage }}"},
-        {"id": "sys_curr", "name": "System Current", "unit": "A", "class": "current", "tpl": "{{ value_json.system.current }}"},
-        {"id": "sys_power", "name": "System Power", "unit": "W", "class": "power", "tpl": "{{ value_json.system.power }}"},
-    ]
-
-    # List of Per-Battery sensors
-    bat_sensors = [
-        {"suffix": "volt", "name": "Voltage", "unit": "V", "class": "voltage", "prop": "voltage"},
-        {"suffix": "curr", "name": "Current", "unit": "A", "class": "current", "prop": "current"},
-        {"suffix": "temp", "name": "Temperature", "unit": "°C", "class": "temperature", "prop": "temp"},
-        {"suffix": "soc", "name": "SOC", "unit": "%", "class": "battery", "prop": "soc"},
-        {"suffix": "status", "name": "Status", "unit": None, "class": None, "prop": "status"}, # Text sensor
-    ]
-
-    # --- 3. PUBLISH SYSTEM CONFIGS ---
-    for s in system_sensors:
-        unique_id = f"{NODE_ID}_{s['id']}"
-        config_topic = f"{DISCOVERY_PREFIX}/sensor/{NODE_ID}/{s['id']}/config"
-        
-        payload = {
-            "name": s["name"],
-            "unique_id": unique_id,
-            "state_topic": STATE_TOPIC,
-            "value_template": s["tpl"],
-            "device": device_info,
-            "availability_topic": STATE_TOPIC,
-            "availability_template": "{{ 'online' if value_json.system.count is defined else 'offline' }}"
-        }
-        if s["unit"]: payload["unit_of_measurement"] = s["unit"]
-        if s["class"]: payload["device_class"] = s["class"]
-
-        client.publish(config_topic, json.dumps(payload), retain=True)
-
-    # --- 4. PUBLISH PER-BATTERY CONFIGS ---
-    for i in range(1, BATTERY_COUNT + 1):
-        for s in bat_sensors:
-            unique_id = f"{NODE_ID}_bat{i}_{s['suffix']}"
-            object_id = f"bat{i}_{s['suffix']}"
-            config_topic = f"{DISCOVERY_PREFIX}/sensor/{NODE_ID}/{object_id}/config"
-            
-            # Access list by index [i-1] because lists are 0-indexed but batteries are 1-indexed
-            template = f"{{{{ value_json.batteries[{i-1}].{s['prop']} }}}}"
-
-            payload = {
-                "name": f"Battery {i} {s['name']}",
-                "unique_id": unique_id,
-                "state_topic": STATE_TOPIC,
-                "value_template": template,
-                "device": device_info
-            }
-            if s["unit"]: payload["unit_of_measurement"] = s["unit"]
-            if s["class"]: payload["device_class"] = s["class"]
-            
-            client.publish(config_topic, json.dumps(payload), retain=True)
-
-    print("Discovery sent. Check Home Assistant devices.")
-
-def parse_pwr_response(raw_text):
-    """
-    Parses the ASCII table from the 'pwr' command.
-    Returns a list of battery objects and a summary object.
+
+class MqttPublisher:
+    """Publishes retained topics, skipping payloads the broker already has.
+
+    Published payloads are remembered per topic. When the connection to
+    the broker is (re)established the memory is dropped, so everything,
+    discovery included, is sent again on the next cycle.
     """
-    batteries = []
-    lines = raw_text.splitlines()
-    for line in lines:
-        parts = line.split()
-        if len(parts) > 10 and parts[0].isdigit():
-            if "Absent" in line: continue
-            try:
-                bat_id = int(parts[0])
-                # Parsing logic based on your provided table
-                voltage = int(parts[1]) / 1000.0
-                current = int(parts[2]) / 1000.0
-                temp = int(parts[3]) / 1000.0
-                status = parts[8]
-                soc = int(parts[12].replace('%', ''))
-                
-                batteries.append({
-                    "id": bat_id,
-                    "voltage": voltage,
-                    "current": current,
-                    "temp": temp,
-                    "soc": soc,
-                    "status": status,
-                    "power": round(voltage * current, 2)
-                })
-            except ValueError as error:
-                print("Could not parse response:")
-                print(error)
-                continue
-
-    total_voltage = 0
-    total_current = 0
-    avg_soc = 0
-    total_power = 0
-    
-    print(f"Found {len(batteries)} batteries.")
-    
-    if batteries:
-        total_voltage = sum(b['voltage'] for b in batteries) / len(batteries)
-        total_current = sum(b['current'] for b in batteries)
-        avg_soc = sum(b['soc'] for b in batteries) / len(batteries)
-        total_power = total_voltage * total_current
 
+    def __init__(self, client: mqtt.Client, qos: int = 0):
+        self.client = client
+        self.qos = qos
+        self._published = {}
+        self._topology = None
+
+    def reset(self):
+        self._published.clear()
+        self._topology = None
+
+    def publish(self, topic: str, payload) -> bool:
+        """Publishes `payload` if it differs from the last one sent to `topic`."""
+        if isinstance(payload, dict):
+            payload = json.dumps(payload)
+        else:
+            payload = str(payload)
+        if self._published.get(topic) == payload:
+            return False
+        self.client.publish(topic, payload, qos=self.qos, retain=True)
+        self._published[topic] = payload
+        return True
+
+    def publish_discovery(self, module_ids):
+        """Publishes discovery when the present modules differ from the last time."""
+        topology = frozenset(module_ids)
+        if topology == self._topology:
+            return
+        previous = self._topology or frozenset()
+        _LOGGER.info(f"Publishing discovery for modules {sorted(topology)}")
+
+        for object_id, name, unit, device_class, field in SYSTEM_SENSORS:
+            self.publish(
+                f"{DISCOVERY_PREFIX}/sensor/{NODE_ID}/{object_id}/config",
+                sensor_config(object_id, name, unit, device_class, system_topic(field), [AVAILABILITY_TOPIC]),
+            )
+        for bat_id in sorted(topology):
+            for suffix, name, unit, device_class, field in BATTERY_SENSORS:
+                object_id = f"bat{bat_id}_{suffix}"
+                self.publish(
+                    f"{DISCOVERY_PREFIX}/sensor/{NODE_ID}/{object_id}/config",
+                    sensor_config(
+                        object_id, f"Battery {bat_id} {name}", unit, device_class,
+                        battery_topic(bat_id, field),
+                        [AVAILABILITY_TOPIC, battery_availability_topic(bat_id)],
+                    ),
+                )
+            self.publish(battery_availability_topic(bat_id), "online")
+        # Modules that went away keep their entities, marked unavailable
+        for bat_id in previous - topology:
+            self.publish(battery_availability_topic(bat_id), "offline")
+        self._topology = topology
+
+    def publish_system(self, system: PylontechSystem) -> int:
+        """Publishes the fields that changed, returns how many did."""
+        changed = 0
+        for *_, field in SYSTEM_SENSORS:
+            changed += self.publish(system_topic(field), getattr(system, field))
+        for bat in system.batteries:
+            for *_, field in BATTERY_SENSORS:
+                changed += self.publish(battery_topic(bat.sys_id, field), getattr(bat, field))
+        return changed
+
+
+def sample_record(system: PylontechSystem) -> dict:
+    """Compact JSON form of a snapshot for the spool and the history topic."""
     return {
-        "system": {
-            "voltage": round(total_voltage, 2),
-            "current": round(total_current, 2),
-            "soc": round(avg_soc, 1),
-            "power": round(total_power, 1),
-            "count": len(batteries)
-        },
-        "batteries": batteries
+        "ts": round(time.time(), 3),
+        "system": {field: getattr(system, field) for *_, field in SYSTEM_SENSORS},
+        "batteries": [
+            {"id": bat.sys_id, **{field: getattr(bat, field) for *_, field in BATTERY_SENSORS}}
+            for bat in system.batteries
+        ],
     }
 
-def main():
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, "PylonDiscovery")
+
+async def drain(queue: DiskQueue, client: mqtt.Client, connected: asyncio.Event):
+    """Sends spooled samples to the history topic while the broker is up."""
+    while True:
+        await connected.wait()
+        batch = queue.read(DRAIN_BATCH)
+        if not batch:
+            await asyncio.sleep(1)
+            continue
+
+        sent = None
+        for record, position in batch:
+            info = client.publish(HISTORY_TOPIC, json.dumps(record), qos=MQTT_QOS)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                break
+            sent = position
+        if sent is not None:
+            queue.commit(sent)
+            _LOGGER.debug(f"Sent {len(batch)} spooled samples")
+        else:
+            # Lost the connection again, wait for the next one
+            await asyncio.sleep(1)
+        # Rate limit so a long backlog doesn't flood the broker
+        await asyncio.sleep(len(batch) / DRAIN_RATE)
+
+
+def create_client(loop: asyncio.AbstractEventLoop, connected: asyncio.Event) -> mqtt.Client:
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "PylonDiscovery")
     client.username_pw_set(MQTT_USER, MQTT_PASS)
-    
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_start()
-        
-        # 1. SEND DISCOVERY CONFIG ONCE ON STARTUP
-        publish_discovery_config(client)
-        
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=2)
-        print(f"Listening on {SERIAL_PORT}...")
+    client.will_set(AVAILABILITY_TOPIC, "offline", qos=MQTT_QOS, retain=True)
+
+    # Callbacks run on paho's network thread, hand them over to the event loop
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            _LOGGER.warning(f"MQTT connection refused: {reason_code}")
+            return
+        _LOGGER.info("Connected to MQTT broker")
+        loop.call_soon_threadsafe(connected.set)
+
+    def on_disconnect(client, userdata, flags, reason_code, properties):
+        _LOGGER.warning(f"Disconnected from MQTT broker: {reason_code}")
+        loop.call_soon_threadsafe(connected.clear)
+
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    return client
+
+
+async def serve_metrics(transport: PylontechTransport, queue: DiskQueue, port: int) -> asyncio.AbstractServer:
+    """Serves the metrics in the Prometheus text format, GET /metrics is all it knows."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # Headers don't matter, just skip to the blank line
+            while (await reader.readline()).strip():
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+                body = (transport.metrics.prometheus() + "# HELP pylon2mqtt_spool_bytes Samples waiting for the broker.\n"
+                        f"# TYPE pylon2mqtt_spool_bytes gauge\npylon2mqtt_spool_bytes {queue.size}\n").encode()
+                status = "200 OK"
+            else:
+                body = b"Not found\n"
+                status = "404 Not Found"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            _LOGGER.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, port=port)
+    _LOGGER.info(f"Serving metrics on port {port}")
+    return server
 
+
+async def run():
+    loop = asyncio.get_running_loop()
+    connected = asyncio.Event()
+    client = create_client(loop, connected)
+    publisher = MqttPublisher(client, MQTT_QOS)
+
+    queue = DiskQueue(SPOOL_DIR, max_bytes=SPOOL_MAX_MB << 20)
+    if queue:
+        _LOGGER.info(f"{queue.size} bytes of spooled samples left from the last run")
+
+    # Connects in the background and keeps retrying, the broker may not be up yet
+    client.reconnect_delay_set(min_delay=1, max_delay=60)
+    client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+    drain_task = asyncio.create_task(drain(queue, client, connected))
+
+    transport = PylontechTransport(SERIAL_PORT, BAUD_RATE)
+    metrics_server = await serve_metrics(transport, queue, METRICS_PORT) if METRICS_PORT else None
+    _LOGGER.info(f"Polling {SERIAL_PORT} every {POLL_INTERVAL}s")
+    was_connected = False
+    try:
         while True:
-            print("Requesting \"pwr\" to batteries...")
-            ser.write(b"\n")
-            time.sleep(0.2)
-            ser.read_all()
-            ser.write(b"pwr\n")
-            time.sleep(1.5)
-            
-            print("Reading response...")
-            raw_data = ser.read_all().decode('ascii', errors='ignore')
-            
-            if "Power Volt" in raw_data:
-                data = parse_pwr_response(raw_data)
-                # Only publish if we actually parsed data
-                if data and data["system"]["count"] > 0:
-                    print("Parsed response:")
-                    print(data)
-                    json_str = json.dumps(data)
-                    client.publish(STATE_TOPIC, json_str)
-                    print("Data published.")
-                else:
-                    print("Could not parse data:")
-                    print(data)
+            started = loop.time()
+            if connected.is_set() and not was_connected:
+                # Fresh session, the broker may have lost what was retained
+                publisher.reset()
+                publisher.publish(AVAILABILITY_TOPIC, "online")
+            was_connected = connected.is_set()
+
+            try:
+                raw = await transport.execute("pwr")
+            except (PylontechTransportError, TimeoutError) as e:
+                _LOGGER.warning(f"Could not read 'pwr': {e}")
+                raw = b""
+
+            if b"Power Volt" in raw:
+                with transport.metrics.time_parse("pwr"):
+                    system = PylontechParser.parse_pwr(raw, PylontechSystem(0, 0, 0, 0, 0, 0, 0))
+                transport.metrics.cycle.observe(loop.time() - started)
+                if system.batteries and was_connected:
+                    publisher.publish_discovery(system.modules)
+                    changed = publisher.publish_system(system)
+                    _LOGGER.debug(f"{len(system.batteries)} modules, {changed} topics published")
+                elif system.batteries:
+                    queue.append(sample_record(system))
             else:
-                print("Got unknown response:")
-                print(raw_data)
-            
-            time.sleep(10)
+                transport.metrics.cycle_errors += 1
+                if raw:
+                    _LOGGER.warning(f"Got unknown response: {raw!r}")
 
-    except KeyboardInterrupt:
+            await asyncio.sleep(max(0, POLL_INTERVAL - (loop.time() - started)))
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        drain_task.cancel()
+        queue.close()
+        await transport.close()
+        client.publish(AVAILABILITY_TOPIC, "offline", qos=MQTT_QOS, retain=True)
+        client.disconnect()
         client.loop_stop()
-        ser.close()
+
+
+def main():
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO"),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
         print("Exiting...")
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,181 @@
+"""Bounded on-disk queue that keeps pylon2mqtt samples through broker outages."""
+import json
+import logging
+import os
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor.json"
+
+DEFAULT_SEGMENT_SIZE = 1 << 20  # bytes
+DEFAULT_MAX_BYTES = 64 << 20  # bytes
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DiskQueue:
+    """Append-only queue of JSON records stored in segment files.
+
+    Records are appended to the newest segment, one JSON document per line,
+    and a new segment is started once it reaches `segment_size` bytes.
+    Reading starts at a cursor (segment, offset) that only moves on
+    commit(), so records that couldn't be published are read again.
+    Segments behind the cursor are deleted, and once the queue takes more
+    than `max_bytes` the oldest segments are dropped, unsent or not.
+
+    On open the queue is compacted: a record cut short by a crash is
+    truncated and the already sent part of the first segment is removed.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Segment number -> size in bytes
+        self._segments = {}
+        for name in os.listdir(directory):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                self._segments[int(name[:-len(SEGMENT_SUFFIX)])] = os.path.getsize(os.path.join(directory, name))
+        self._cursor = self._load_cursor()
+        self._writer = None
+        self._compact()
+
+    def __bool__(self) -> bool:
+        """True while there are records left to read."""
+        if not self._segments:
+            return False
+        segment, offset = self._cursor
+        last = max(self._segments)
+        return segment < last or offset < self._segments.get(segment, 0)
+
+    @property
+    def size(self) -> int:
+        return sum(self._segments.values())
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as file:
+                data = json.load(file)
+            return int(data["segment"]), int(data["offset"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return (min(self._segments) if self._segments else 0), 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump({"segment": self._cursor[0], "offset": self._cursor[1]}, file)
+        os.replace(path + ".tmp", path)
+
+    def _compact(self):
+        if not self._segments:
+            return
+        # A crash may have left half a record at the end of the newest segment
+        last = max(self._segments)
+        with open(self._path(last), "rb+") as file:
+            data = file.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                file.truncate(end)
+                self._segments[last] = end
+
+        segment, offset = self._cursor
+        for old in [number for number in self._segments if number < segment]:
+            self._remove(old)
+        if segment not in self._segments:
+            # The cursor's segment is gone, carry on from the oldest one left
+            self._cursor = (min(self._segments) if self._segments else segment, 0)
+        elif offset > 0:
+            # Drop the sent records at the head of the first segment
+            with open(self._path(segment), "rb") as file:
+                file.seek(offset)
+                rest = file.read()
+            with open(self._path(segment) + ".tmp", "wb") as file:
+                file.write(rest)
+            os.replace(self._path(segment) + ".tmp", self._path(segment))
+            self._segments[segment] = len(rest)
+            self._cursor = (segment, 0)
+        self._save_cursor()
+
+    def _remove(self, segment: int):
+        if self._writer is not None and self._writer[0] == segment:
+            self._writer[1].close()
+            self._writer = None
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+        self._segments.pop(segment, None)
+
+    def append(self, record: dict):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        if not self._segments or self._segments[max(self._segments)] + len(line) > self.segment_size:
+            segment = max(self._segments) + 1 if self._segments else self._cursor[0]
+            self._segments[segment] = 0
+        segment = max(self._segments)
+
+        if self._writer is None or self._writer[0] != segment:
+            if self._writer is not None:
+                self._writer[1].close()
+            self._writer = (segment, open(self._path(segment), "ab"))
+        self._writer[1].write(line)
+        self._writer[1].flush()
+        self._segments[segment] += len(line)
+
+        # Stay within the bound, the oldest samples go first
+        while self.size > self.max_bytes and len(self._segments) > 1:
+            oldest = min(self._segments)
+            _LOGGER.warning(f"Spool over {self.max_bytes} bytes, dropping segment {oldest}")
+            self._remove(oldest)
+            if self._cursor[0] <= oldest:
+                self._cursor = (min(self._segments), 0)
+                self._save_cursor()
+
+    def read(self, limit: int) -> list:
+        """Returns up to `limit` (record, position) pairs from the cursor on.
+
+        Pass the position of the last record handled to commit().
+        """
+        result = []
+        segment, offset = self._cursor
+        while len(result) < limit and segment in self._segments:
+            if offset >= self._segments[segment]:
+                if segment == max(self._segments):
+                    break
+                segment, offset = min(number for number in self._segments if number > segment), 0
+                continue
+            with open(self._path(segment), "rb") as file:
+                file.seek(offset)
+                while len(result) < limit:
+                    line = file.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    try:
+                        result.append((json.loads(line), (segment, offset)))
+                    except ValueError:
+                        _LOGGER.warning(f"Skipping corrupt record in segment {segment}")
+            if offset < self._segments[segment]:
+                # Stopped by the limit (or a partial write), carry on next time
+                break
+        return result
+
+    def commit(self, position):
+        """Marks everything up to `position` as sent."""
+        self._cursor = position
+        segment = position[0]
+        for old in [number for number in self._segments if number < segment]:
+            self._remove(old)
+        if segment == max(self._segments, default=segment) and position[1] >= self._segments.get(segment, 0):
+            # Everything was sent, start over with an empty queue
+            self._remove(segment)
+            self._cursor = (segment + 1, 0)
+        self._save_cursor()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer[1].close()
+            self._writer = None
@@ -0,0 +1,8 @@
+"""Puts the integration package, the benchmark simulator and the MQTT bridge on the path."""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "custom_components"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, os.path.join(ROOT, "docker"))
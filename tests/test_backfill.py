@@ -0,0 +1,212 @@
+"""History backfill cursor, against a fake BMS history."""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from pylontech_serial import backfill
+from pylontech_serial.backfill import BACKFILL_CHUNK, HistoryBackfill
+from pylontech_serial.transport import PylontechTransportError
+
+START = datetime(2025, 12, 21, 10, 0)
+
+
+def _time(n: int) -> datetime:
+    # Six records an hour
+    return START + timedelta(minutes=10 * n)
+
+
+def _record(item: int, timestamp: datetime) -> bytes:
+    return (
+        f"data history {item}\n\r@\r\r\n"
+        f"Time      : {timestamp:%y-%m-%d %H:%M:%S}\r\r\n"
+        f"Voltage   : 50000\r\r\n"
+        f"Current   : -1000\r\r\n"
+        f"Coulomb   : {timestamp.minute}%\r\r\n"
+        "Command completed successfully\r\n\r$$\r\n\rpylon>"
+    ).encode("ascii")
+
+
+class FakeBMS:
+    """The transport of a BMS whose history slots hold the given timestamps."""
+
+    def __init__(self, times):
+        self.slots = list(times)
+        self.reads = []
+        self.fail = False
+
+    async def execute_batch(self, commands, priority):
+        if self.fail:
+            raise PylontechTransportError("port gone")
+        items = [int(command.split()[-1]) for command in commands]
+        self.reads.append(items)
+        return [_record(item, self.slots[item - 1]) for item in items]
+
+
+class FakeStore:
+    def __init__(self):
+        self.data = None
+
+    async def async_load(self):
+        return self.data
+
+    async def async_save(self, data):
+        self.data = data
+
+    def async_delay_save(self, data_func, delay):
+        self.data = data_func()
+
+
+@pytest.fixture
+def imported(monkeypatch):
+    """Hour start -> SOC mean of every imported statistic."""
+    hours = {}
+
+    def add(hass, metadata, statistics):
+        if metadata["statistic_id"].endswith("_soc"):
+            for statistic in statistics:
+                assert statistic["start"] not in hours, "hour imported twice"
+                hours[statistic["start"]] = statistic["mean"]
+
+    monkeypatch.setattr(backfill, "async_add_external_statistics", add)
+    return hours
+
+
+def _backfill(bms, store=None):
+    coordinator = SimpleNamespace(transport=bms, data=SimpleNamespace(history_items=len(bms.slots)))
+    return HistoryBackfill(None, coordinator, store or FakeStore(), "entry")
+
+
+def _catch_up(history, bms):
+    async def run():
+        for _ in range(10):
+            await history._async_run_chunk()
+            if history._item > len(bms.slots):
+                return
+        raise AssertionError("backfill never caught up")
+
+    asyncio.run(run())
+
+
+def test_reads_in_chunks_and_imports_closed_hours(imported):
+    bms = FakeBMS([_time(n) for n in range(20)])
+    store = FakeStore()
+    history = _backfill(bms, store)
+    _catch_up(history, bms)
+
+    assert bms.reads == [list(range(1, 9)), list(range(9, 17)), list(range(17, 21))]
+    # 10:00, 11:00 and 12:00 are complete, 13:00 still open
+    assert [start.hour for start in sorted(imported)] == [10, 11, 12]
+    assert list(imported.values()) == [25.0, 25.0, 25.0]
+    assert store.data["item"] == 21
+    assert store.data["newest_item"] == 20
+    assert datetime.fromisoformat(store.data["newest"]) == _time(19)
+
+
+def test_resumes_from_the_saved_cursor(imported):
+    bms = FakeBMS([_time(n) for n in range(20)])
+    store = FakeStore()
+    first = _backfill(bms, store)
+    asyncio.run(first._async_run_chunk())
+    asyncio.run(first.async_shutdown())
+
+    restarted = _backfill(bms, store)
+    asyncio.run(restarted.async_load())
+    bms.reads.clear()
+    _catch_up(restarted, bms)
+
+    assert bms.reads[0][0] == BACKFILL_CHUNK + 1
+    assert [start.hour for start in sorted(imported)] == [10, 11, 12]
+
+
+def test_overwritten_slots_are_read_in_turn(imported):
+    bms = FakeBMS([_time(n) for n in range(12)])
+    history = _backfill(bms)
+    _catch_up(history, bms)
+
+    # A full history that overwrites its oldest slots
+    bms.slots[0:2] = [_time(12), _time(13)]
+    bms.reads.clear()
+    asyncio.run(history._async_run_chunk())
+    assert bms.reads == [[1, 12]]
+    asyncio.run(history._async_run_chunk())
+
+    assert bms.reads[1] == list(range(1, 9))
+    assert history._newest == _time(13)
+    assert history._newest_item == 2
+    # Past the newest slot, so caught up again
+    assert history._item == 13
+
+
+def test_shifted_history_is_found_by_stepping_back(imported):
+    bms = FakeBMS([_time(n) for n in range(12)])
+    history = _backfill(bms)
+    _catch_up(history, bms)
+
+    # A full history that drops its first records as new ones are appended
+    bms.slots = [_time(n) for n in range(10, 22)]
+    bms.reads.clear()
+    asyncio.run(history._async_run_chunk())
+    assert bms.reads == [[1, 12]]
+    _catch_up(history, bms)
+
+    # All new at the end, so it steps back to the start to find the imported ones
+    assert bms.reads[1:] == [list(range(5, 13)), list(range(1, 9)), list(range(9, 13))]
+    assert history._newest == _time(21)
+    assert history._newest_item == 12
+    assert [start.hour for start in sorted(imported)] == [10, 11, 12]
+
+
+def test_nothing_new_is_checked_once_per_interval(imported):
+    bms = FakeBMS([_time(n) for n in range(12)])
+    history = _backfill(bms)
+    _catch_up(history, bms)
+
+    bms.reads.clear()
+    asyncio.run(history._async_run_chunk())
+    asyncio.run(history._async_run_chunk())
+    assert bms.reads == [[1, 12]]
+    assert history._item == 13
+
+
+def test_cleared_history_is_read_from_the_start(imported):
+    bms = FakeBMS([_time(n) for n in range(12)])
+    history = _backfill(bms)
+    _catch_up(history, bms)
+
+    bms.slots = [_time(n) for n in range(12, 15)]
+    history.coordinator.data.history_items = 3
+    bms.reads.clear()
+    asyncio.run(history._async_run_chunk())
+
+    assert bms.reads == [[1, 2, 3]]
+    assert history._newest == _time(14)
+    assert history._item == 4
+
+
+def test_newest_first_history_stops_the_backfill(imported):
+    bms = FakeBMS([_time(n) for n in reversed(range(12))])
+    history = _backfill(bms)
+    asyncio.run(history._async_run_chunk())
+
+    assert history._stopped
+    assert history._item == 1
+    assert not imported
+    # schedule() no longer starts a read
+    history.schedule()
+    assert history._task is None
+
+
+def test_failed_read_keeps_the_cursor(imported):
+    bms = FakeBMS([_time(n) for n in range(12)])
+    store = FakeStore()
+    history = _backfill(bms, store)
+    bms.fail = True
+    asyncio.run(history._async_run_chunk())
+
+    assert history._item == 1
+    assert store.data is None
+    bms.fail = False
+    asyncio.run(history._async_run_chunk())
+    assert history._item == BACKFILL_CHUNK + 1
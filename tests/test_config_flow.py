@@ -0,0 +1,66 @@
+"""Config and options flow checks."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("homeassistant.helpers.service_info.usb")
+
+from pylontech_serial import config_flow  # noqa: E402
+from pylontech_serial.const import CONF_SERIAL_PORT, DOMAIN  # noqa: E402
+
+
+def _entry(entry_id, port, options_port=None):
+    data = {CONF_SERIAL_PORT: port, "baud_rate": 115200, "poll_interval": 15, "battery_capacity": 2.4}
+    options = {CONF_SERIAL_PORT: options_port} if options_port else {}
+    return SimpleNamespace(entry_id=entry_id, data=data, options=options)
+
+
+def _hass(entries):
+    async def executor(function, *args):
+        # Only called to list the serial ports
+        return [SimpleNamespace(device=f"/dev/ttyUSB{n}", description="USB Serial") for n in range(3)]
+
+    return SimpleNamespace(
+        config_entries=SimpleNamespace(async_entries=lambda domain: entries),
+        async_add_executor_job=executor,
+    )
+
+
+def _options(entry, entries, port):
+    async def run():
+        flow = config_flow.OptionsFlowHandler(entry)
+        flow.hass, flow.flow_id, flow.handler = _hass(entries), "flow", entry.entry_id
+        form = await flow.async_step_user()
+        return await flow.async_step_user(form["data_schema"]({CONF_SERIAL_PORT: port}))
+
+    return asyncio.run(run())
+
+
+def test_options_reject_a_port_used_by_another_entry():
+    # The other stack was moved to ttyUSB1 in its options
+    other = _entry("other", "/dev/ttyUSB0", "/dev/ttyUSB1")
+    entry = _entry("entry", "/dev/ttyUSB2")
+    entries = [other, entry]
+
+    result = _options(entry, entries, "/dev/ttyUSB2")
+    assert result["type"] == "create_entry"
+
+    result = _options(entry, entries, "/dev/ttyUSB1")
+    assert result["type"] == "form"
+    assert result["errors"] == {CONF_SERIAL_PORT: "already_configured"}
+
+    # Free since the other entry moved away from it
+    assert _options(entry, entries, "/dev/ttyUSB0")["type"] == "create_entry"
+
+
+def test_new_entry_checks_the_ports_in_use():
+    async def run(port):
+        flow = config_flow.ConfigFlow()
+        flow.hass, flow.flow_id, flow.handler = _hass([_entry("other", "/dev/ttyUSB0", "/dev/ttyUSB1")]), "flow", DOMAIN
+        return await flow.async_step_user({
+            CONF_SERIAL_PORT: port, "baud_rate": 115200, "poll_interval": 15, "battery_capacity": 2.4,
+        })
+
+    assert asyncio.run(run("/dev/ttyUSB1"))["reason"] == "already_configured"
+    assert asyncio.run(run("/dev/ttyUSB0"))["type"] == "create_entry"
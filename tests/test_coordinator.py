@@ -0,0 +1,106 @@
+"""Coordinator snapshot persistence and shutdown, against the simulated console."""
+import asyncio
+import random
+from dataclasses import replace
+
+from homeassistant.core import HomeAssistant
+
+from pylontech_serial.coordinator import PylontechCoordinator
+from pylontech_serial.parser import PylontechParser
+from simulator import ConsoleSimulator, bat_table
+
+
+def _run(tmp_path, test):
+    async def main():
+        simulator = ConsoleSimulator(3, byte_delay=0)
+        port = await simulator.start_pty()
+        hass = HomeAssistant(str(tmp_path))
+        try:
+            await test(hass, port)
+        finally:
+            simulator.close()
+            await hass.async_stop(force=True)
+
+    asyncio.run(main())
+
+
+def test_snapshot_is_restored(tmp_path):
+    async def test(hass, port):
+        coordinator = PylontechCoordinator(hass, port, 115200, 5, 2.4, entry_id="entry")
+        for _ in range(3):
+            coordinator.data = await coordinator._async_update_data()
+        await coordinator.async_shutdown()
+
+        restored = PylontechCoordinator(hass, port, 115200, 5, 2.4, entry_id="entry")
+        assert await restored.async_restore_snapshot()
+        saved, data = coordinator.data, restored.data
+        assert data.batteries == saved.batteries
+        assert (data.voltage, data.model, data.cell_count, data.barcode) == (
+            saved.voltage, saved.model, saved.cell_count, saved.barcode)
+        assert {module: list(table.voltages) for module, table in data.cells.items()} == {
+            module: list(table.voltages) for module, table in saved.cells.items()}
+        assert restored.topology == {module: 15 for module in saved.modules}
+
+        # The port is still read as usual
+        restored.data = await restored._async_update_data()
+        assert len(restored.data.batteries) == 3
+        await restored.async_shutdown()
+
+        other = PylontechCoordinator(hass, port, 115200, 5, 2.4, entry_id="other")
+        assert not await other.async_restore_snapshot()
+        await other.async_shutdown()
+
+    _run(tmp_path, test)
+
+
+def test_shutdown_runs_once(tmp_path):
+    async def test(hass, port):
+        coordinator = PylontechCoordinator(hass, port, 115200, 5, 2.4, entry_id="entry",
+                                           transcript_dir=str(tmp_path / "transcript"))
+        coordinator.data = await coordinator._async_update_data()
+        calls = []
+
+        def counted(name, function):
+            async def wrapper(*args):
+                calls.append(name)
+                return await function(*args)
+            return wrapper
+
+        coordinator.transport.close = counted("close", coordinator.transport.close)
+        coordinator._snapshot_store.async_save = counted("snapshot", coordinator._snapshot_store.async_save)
+        coordinator._energy_store.async_save = counted("energy", coordinator._energy_store.async_save)
+
+        # Once by the integration, once by the entry's unload callbacks
+        await coordinator.async_shutdown()
+        await coordinator.async_shutdown()
+
+        assert sorted(calls) == ["close", "energy", "snapshot"]
+        assert coordinator.recorder._thread is None
+
+    _run(tmp_path, test)
+
+
+def test_topology_tells_when_cells_become_known(tmp_path):
+    async def test(hass, port):
+        coordinator = PylontechCoordinator(hass, port, 115200, 5, 2.4, entry_id="entry", cell_budget=0)
+        assert not coordinator.reads_cells
+        changes = []
+        coordinator.async_add_topology_listener(lambda added, removed: changes.append((added, removed)))
+
+        system = await coordinator._async_update_data()
+        assert system.cells == {}
+        system.info = replace(system.info, cell_count=None)
+        coordinator.data = system
+        coordinator.async_update_listeners()
+        assert coordinator.topology == {1: 0, 2: 0, 3: 0}
+        assert changes == [({1, 2, 3}, set())]
+
+        # Only the module whose cells were read is announced again
+        system.cells = {1: PylontechParser.parse_cell_table(bat_table(1, 15, random.Random(1)), 1, 0)}
+        coordinator.async_update_listeners()
+        coordinator.async_update_listeners()
+        assert coordinator.topology == {1: 15, 2: 0, 3: 0}
+        assert changes[1:] == [({1}, set())]
+        await coordinator.async_shutdown()
+
+    _run(tmp_path, test)
@@ -0,0 +1,84 @@
+"""Charge and discharge energy accounting."""
+import pytest
+
+from pylontech_serial.energy import MAX_INTEGRATION_GAP, EnergyCounter
+
+
+def test_integrates_power():
+    counter = EnergyCounter()
+    counter.add_sample(0, 1200)
+    counter.add_sample(300, 1200)
+    counter.add_sample(600, -2400)
+
+    # 100 Wh at 1.2 kW, then 1.2 kW down to -2.4 kW crossing zero a third of the way
+    assert counter.energy_in == pytest.approx(0.1 + 1.2 / 2 * 100 / 3600)
+    assert counter.energy_out == pytest.approx(2.4 / 2 * 200 / 3600)
+
+
+def test_skips_long_gaps():
+    counter = EnergyCounter()
+    counter.add_sample(0, 1000)
+    counter.add_sample(MAX_INTEGRATION_GAP + 1, 1000)
+
+    assert counter.energy_in == 0
+
+
+def test_counters_replace_integration():
+    counter = EnergyCounter()
+    counter.add_counters(discharged=1000, remaining=40000, voltage=50.0, modules=2)
+    counter.add_sample(0, 500)
+    counter.add_sample(300, 500)
+    provisional = counter.energy_in
+
+    # 2000 mAh charged and 500 mAh discharged per module since the last reading
+    counter.add_counters(discharged=1500, remaining=41500, voltage=50.0, modules=2)
+
+    assert provisional > 0
+    assert counter.energy_in == pytest.approx(2000 * 50 * 2 / 1e6)
+    assert counter.energy_out == pytest.approx(500 * 50 * 2 / 1e6)
+
+
+def test_totals_never_go_down():
+    counter = EnergyCounter()
+    counter.add_counters(discharged=1000, remaining=40000, voltage=50.0, modules=1)
+    counter.add_sample(0, 3000)
+    counter.add_sample(600, 3000)
+    integrated = counter.energy_in
+
+    # The counters report less than was integrated
+    counter.add_counters(discharged=1000, remaining=40100, voltage=50.0, modules=1)
+
+    assert counter.energy_in == integrated
+
+
+def test_counter_reset_keeps_the_integrated_energy():
+    counter = EnergyCounter()
+    counter.add_counters(discharged=5000, remaining=40000, voltage=50.0, modules=1)
+    counter.add_sample(0, -1000)
+    counter.add_sample(360, -1000)
+    counter.add_counters(discharged=10, remaining=39000, voltage=50.0, modules=1)
+
+    assert counter.energy_out == pytest.approx(0.1)
+    counter.add_counters(discharged=110, remaining=38900, voltage=50.0, modules=1)
+    assert counter.energy_out == pytest.approx(0.1 + 100 * 50 / 1e6)
+
+
+def test_ignores_missing_counters():
+    counter = EnergyCounter()
+    counter.add_counters(discharged=None, remaining=40000, voltage=50.0, modules=1)
+    counter.add_counters(discharged=1000, remaining=40000, voltage=0, modules=1)
+
+    assert counter.as_dict()["anchor"] is None
+
+
+def test_restore():
+    counter = EnergyCounter()
+    counter.add_counters(discharged=1000, remaining=40000, voltage=50.0, modules=1)
+    counter.add_counters(discharged=3000, remaining=38000, voltage=50.0, modules=1)
+
+    restored = EnergyCounter()
+    restored.restore(counter.as_dict())
+    restored.add_counters(discharged=4000, remaining=37000, voltage=50.0, modules=1)
+
+    assert restored.energy_out == pytest.approx(counter.energy_out + 1000 * 50 / 1e6)
+    assert restored.energy_in == counter.energy_in
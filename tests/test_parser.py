@@ -0,0 +1,132 @@
+"""Console table parsing."""
+import random
+from datetime import datetime
+
+from pylontech_serial.parser import PwrStreamParser, PylontechParser
+from simulator import PROMPT, bat_table, pwr_lines, pwr_table
+
+
+def test_parse_pwr_skips_absent_modules():
+    system = PylontechParser.parse_pwr(pwr_table(3, random.Random(1)))
+
+    assert [bat.sys_id for bat in system.batteries] == [1, 2, 3]
+    for bat in system.batteries:
+        assert 50.6 <= bat.voltage <= 50.7
+        assert 3.0 <= bat.current <= 4.2
+        assert bat.status == "Charge"
+        assert bat.voltage_status == "Normal"
+        assert 88 <= bat.soc <= 90
+        assert bat.power == round(bat.voltage * bat.current, 2)
+
+
+def test_parse_pwr_reuses_modules():
+    first = PylontechParser.parse_pwr(pwr_table(2, random.Random(1)))
+    second = PylontechParser.parse_pwr(pwr_table(2, random.Random(2)), reuse=first.modules)
+
+    assert second.batteries[0] is first.modules[1]
+    assert second.batteries[1] is first.modules[2]
+
+
+def test_parse_pwr_without_table():
+    system = PylontechParser.parse_pwr(b"pwr\n\r@\r\r\nCommand completed successfully\r\n\r$$\r\n\rpylon>")
+
+    assert system.batteries == []
+
+
+def test_parse_bat():
+    cells = PylontechParser.parse_bat(bat_table(1, 15, random.Random(1)))
+
+    assert [cell.cell_id for cell in cells] == list(range(15))
+    assert all(3.37 <= cell.voltage <= 3.39 for cell in cells)
+    assert cells[0].current == 4.076
+    assert cells[0].temperature == 14.0
+    assert cells[0].capacity == 42586
+
+
+def test_parse_cell_table():
+    raw = bat_table(2, 15, random.Random(1))
+    table = PylontechParser.parse_cell_table(raw, 2, updated=1.0)
+
+    assert table.cell_count == 15
+    assert list(table.voltages) == [round(cell.voltage * 1000) for cell in PylontechParser.parse_bat(raw)]
+    assert PylontechParser.parse_cell_table(b"bat 2\n\r@\r\r\n", 2, updated=1.0) is None
+
+
+def test_parse_history():
+    raw = (
+        b"data history 12\n\r@\r\r\n"
+        b"Time      : 25-12-21 20:53:06\r\r\n"
+        b"Voltage   : 50612\r\r\n"
+        b"Current   : -3050\r\r\n"
+        b"Temperature : 16000\r\r\n"
+        b"Coulomb   : 89%\r\r\n"
+        b"Command completed successfully\r\n\r$$\r\n\rpylon>"
+    )
+    record = PylontechParser.parse_history(raw, 12)
+
+    assert record.item == 12
+    assert record.timestamp == datetime(2025, 12, 21, 20, 53, 6)
+    assert record.voltage == 50.612
+    assert record.current == -3.05
+    assert record.temperature == 16.0
+    assert record.soc == 89
+
+
+def test_parse_history_without_data():
+    assert PylontechParser.parse_history(b"data history 3\n\r@\r\r\nNo data\r\n", 3) is None
+    assert PylontechParser.parse_history(b"Time : 2025-12-21 20:53:06\r\n", 3) is None
+
+
+def _disp_tables(modules: int, count: int) -> bytes:
+    # 'disp' prints the table over and over, each one ends where the next header starts
+    rng = random.Random(1)
+    return b"".join(("\r\r\n".join(pwr_lines(modules, rng)) + "\r\n").encode("ascii") for _ in range(count))
+
+
+def test_stream_parser_cuts_tables():
+    parser = PwrStreamParser()
+    stream = _disp_tables(2, 4)
+
+    tables = []
+    for offset in range(0, len(stream), 37):
+        tables += parser.feed(stream[offset:offset + 37])
+
+    # The last table isn't known to be complete until the next one starts
+    assert len(tables) == 3
+    for table in tables:
+        assert [bat.sys_id for bat in PylontechParser.parse_pwr(table).batteries] == [1, 2]
+
+
+def test_stream_parser_ends_a_table_at_a_blank_line():
+    parser = PwrStreamParser()
+    table = _disp_tables(2, 1)
+
+    assert parser.feed(table + b"\r\n") == []
+    # Could still be the prompt
+    assert parser.feed(b"\rpy") == []
+    assert len(parser.feed(b"thon")) == 1
+
+
+def test_stream_parser_drops_a_table_cut_by_a_pause():
+    parser = PwrStreamParser()
+    table = _disp_tables(2, 1)
+    cut = table.index(b"\r\r\n", table.index(b"\r\r\n") + 3) + 3
+
+    # A key press stops the table after its first row, the next poll restarts 'disp'
+    assert parser.feed(table[:cut] + PROMPT + b"disp\n\r@\r\r\n") == []
+    tables = parser.feed(_disp_tables(2, 2))
+
+    assert len(tables) == 1
+    assert len(PylontechParser.parse_pwr(tables[0]).batteries) == 2
+
+
+def test_stream_parser_reset_drops_the_partial_table():
+    parser = PwrStreamParser()
+    table = _disp_tables(2, 1)
+    cut = table.index(b"\r\r\n", table.index(b"\r\r\n") + 3) + 3
+
+    assert parser.feed(table[:cut]) == []
+    parser.reset()
+    # Rows that don't follow a header aren't a table
+    assert parser.feed(table[cut:]) == []
+    assert len(parser.feed(_disp_tables(2, 2))) == 1
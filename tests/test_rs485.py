@@ -0,0 +1,117 @@
+"""RS485 frame encoding and decoding."""
+import random
+
+import pytest
+
+from pylontech_serial.rs485 import (
+    Rs485FrameError,
+    decode_frame,
+    encode_frame,
+    length_field,
+    parse_alarm,
+    parse_analog,
+    parse_manufacturer,
+)
+from simulator import Rs485Simulator, rs485_frame
+
+
+def test_encode_frame():
+    # Analog values request for address 2, from the protocol documentation
+    assert encode_frame(2, 0x42, b"\x02") == "~20024642E00202FD33\r"
+
+
+def test_length_field():
+    assert length_field(0) == 0x0000
+    assert length_field(2) == 0xE002
+    assert length_field(0x12) == 0xD012
+
+
+def test_round_trip():
+    info = bytes(range(40))
+    raw = encode_frame(3, 0x00, info).encode("ascii")
+    frame = decode_frame(b"\x00garbage" + raw + b"~2003")
+
+    assert (frame.version, frame.address, frame.cid1, frame.cid2) == (0x20, 3, 0x46, 0)
+    assert frame.info == info
+
+
+def test_decodes_the_simulator_frames():
+    # The simulator encodes independently of the integration
+    frame = decode_frame(rs485_frame(4, 0, b"\x01\x02\x03"))
+
+    assert frame.address == 4
+    assert frame.info == b"\x01\x02\x03"
+
+
+def test_bad_checksum():
+    raw = bytearray(rs485_frame(2, 0, b"\x00\x02"))
+    raw[-2] ^= 0x01
+    with pytest.raises(Rs485FrameError, match="checksum"):
+        decode_frame(bytes(raw))
+
+
+def test_bad_length():
+    raw = rs485_frame(2, 0, b"\x00\x02").replace(b"C004", b"D004")
+    body = raw[1:-5]
+    raw = b"~" + body + b"%04X" % ((~sum(body) + 1) & 0xFFFF) + b"\r"
+    with pytest.raises(Rs485FrameError, match="length"):
+        decode_frame(raw)
+
+
+def test_error_code():
+    with pytest.raises(Rs485FrameError, match="error code 0x04"):
+        decode_frame(rs485_frame(2, 0x04))
+
+
+@pytest.mark.parametrize("raw", [b"", b"~20024600", b"~2002\r", b"~2002460XE00202FD33\r"])
+def test_incomplete_or_malformed(raw):
+    with pytest.raises(Rs485FrameError):
+        decode_frame(raw)
+
+
+def test_parse_analog():
+    simulator = Rs485Simulator(modules=1, cells=15)
+    simulator.rng = random.Random(1)
+    analog = parse_analog(decode_frame(simulator.answer(encode_frame(2, 0x42, b"\x02").encode()[:-1])).info)
+
+    assert analog.address == 2
+    assert len(analog.cell_voltages) == 15
+    assert all(3.37 <= voltage <= 3.39 for voltage in analog.cell_voltages)
+    assert len(analog.temperatures) == 5
+    assert all(15.0 <= temperature <= 17.0 for temperature in analog.temperatures)
+    assert 3.0 <= analog.current <= 4.2
+    assert (analog.remaining, analog.total, analog.cycles) == (44.0, 50.0, 123)
+
+
+def test_parse_analog_negative_current():
+    info = bytes([0, 2, 1]) + (3300).to_bytes(2, "big") + bytes([1]) + (2731 + 250).to_bytes(2, "big")
+    info += (-150).to_bytes(2, "big", signed=True) + (49800).to_bytes(2, "big")
+    info += (4400).to_bytes(2, "big") + bytes([2]) + (5000).to_bytes(2, "big") + (7).to_bytes(2, "big")
+    analog = parse_analog(info)
+
+    assert analog.current == -1.5
+    assert analog.voltage == 49.8
+    assert analog.temperatures == [25.0]
+
+
+def test_parse_analog_too_short():
+    with pytest.raises(Rs485FrameError, match="too short"):
+        parse_analog(bytes([0, 2, 15, 0x0D]))
+
+
+def test_parse_alarm():
+    info = bytes([0, 2, 3, 0, 1, 2, 2, 0, 0xF0, 0, 2, 0, 0x0E])
+    alarm = parse_alarm(info)
+
+    assert alarm.cells == ["Normal", "Low", "High"]
+    assert alarm.temperatures == ["Normal", "Error"]
+    assert (alarm.charge_current, alarm.voltage, alarm.discharge_current) == ("Normal", "High", "Normal")
+    assert alarm.status == b"\x0e"
+
+
+def test_parse_manufacturer():
+    manufacturer = parse_manufacturer(b"US2000C   " + bytes([2, 1]) + b"PYLON".ljust(20, b"\x00"))
+
+    assert (manufacturer.device, manufacturer.software, manufacturer.manufacturer) == ("US2000C", "2.1", "PYLON")
+    with pytest.raises(Rs485FrameError):
+        parse_manufacturer(b"US2000C")
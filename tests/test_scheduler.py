@@ -0,0 +1,99 @@
+"""Poll scheduling: adaptive interval and cell query budget."""
+from types import SimpleNamespace
+
+from pylontech_serial.scheduler import BACKOFF_FACTOR, DEFAULT_CELL_QUERY_TIME, AdaptiveInterval, CellCollector
+
+
+def _system(current=-10.0, status="Dischg", alarm=None):
+    battery = SimpleNamespace(
+        status=status, voltage_status=alarm or "Normal", current_status="Normal", temperature_status="Normal")
+    return SimpleNamespace(current=current, power=current * 50, batteries=[battery, battery])
+
+
+def test_steady_stack_backs_off_to_the_base():
+    interval = AdaptiveInterval(base=10, minimum=2, maximum=60)
+    interval.interval = 2
+
+    intervals = [interval.update(_system(), now=float(n)) for n in range(6)]
+    assert intervals == [3, 4.5, 6.75, 10, 10, 10]
+    assert intervals[1] == intervals[0] * BACKOFF_FACTOR
+
+
+def test_ramping_current_drops_to_the_minimum():
+    interval = AdaptiveInterval(base=10, minimum=2, maximum=60)
+    interval.update(_system(-10.0), now=0.0)
+
+    # 5 A in 10 s is faster than ACTIVITY_CURRENT_RATE
+    assert interval.update(_system(-15.0), now=10.0) == 2
+    # Slower than that, backing off again
+    assert interval.update(_system(-15.5), now=20.0) == 3
+
+
+def test_alarm_drops_to_the_minimum():
+    interval = AdaptiveInterval(base=10, minimum=2, maximum=60)
+    interval.update(_system(), now=0.0)
+
+    assert interval.update(_system(alarm="High"), now=10.0) == 2
+
+
+def test_idle_stack_goes_on_to_the_maximum():
+    interval = AdaptiveInterval(base=10, minimum=2, maximum=60)
+    idle = _system(current=0.1, status="Idle")
+
+    intervals = [interval.update(idle, now=float(n)) for n in range(7)]
+    assert intervals[-1] == 60
+    assert intervals == sorted(intervals)
+
+    # Back to the base at once when it isn't idle anymore
+    assert interval.update(_system(current=0.2, status="Charge"), now=7.0) == 10
+
+
+def test_limits_take_the_base_in():
+    interval = AdaptiveInterval(base=10, minimum=20, maximum=5)
+
+    assert (interval.minimum, interval.maximum) == (10, 10)
+    assert interval.update(_system(), now=0.0) == 10
+
+
+def test_cells_fit_the_budget_round_robin():
+    collector = CellCollector(budget=DEFAULT_CELL_QUERY_TIME * 3.5)
+    modules = [1, 2, 3, 4, 5, 6, 7]
+
+    assert collector.pick(modules) == [1, 2, 3]
+    assert collector.pick(modules) == [4, 5, 6]
+    assert collector.pick(modules) == [7, 1, 2]
+
+
+def test_cell_query_time_is_learnt():
+    collector = CellCollector(budget=1.0)
+    modules = list(range(1, 17))
+    assert len(collector.pick(modules)) == 6
+
+    # 0.5 s a query: only two fit now
+    collector.record(6, 3.0)
+    assert collector.pick(modules) == [7, 8]
+    # Faster queries count in gradually
+    collector.record(2, 0.2)
+    assert len(collector.pick(modules)) == 2
+    collector.record(0, 0.0)
+    assert len(collector.pick(modules)) == 2
+
+
+def test_at_least_one_module_per_poll():
+    collector = CellCollector(budget=0.01)
+
+    assert collector.pick([1, 2]) == [1]
+    assert collector.pick([1, 2]) == [2]
+
+
+def test_modules_that_left_are_skipped():
+    collector = CellCollector(budget=DEFAULT_CELL_QUERY_TIME * 2.5)
+    assert collector.pick([1, 2, 3, 4]) == [1, 2]
+
+    # Module 3 is gone, carry on after the last one queried
+    assert collector.pick([1, 2, 4]) == [4, 1]
+
+
+def test_no_budget_reads_no_cells():
+    assert CellCollector(budget=0).pick([1, 2]) == []
+    assert CellCollector(budget=1.0).pick([]) == []
@@ -0,0 +1,63 @@
+"""Which sensors the platform creates, and when."""
+import asyncio
+from types import SimpleNamespace
+
+from pylontech_serial import sensor
+from pylontech_serial.const import DOMAIN
+from pylontech_serial.history import PylontechHistory
+from pylontech_serial.statefilter import StateFilter
+
+
+def _setup(topology, reads_cells=True):
+    listeners = []
+    coordinator = SimpleNamespace(
+        data=None,
+        topology=topology,
+        reads_cells=reads_cells,
+        state_filter=StateFilter(),
+        history=PylontechHistory(),
+        stats_window=300,
+        async_add_topology_listener=lambda update_callback: listeners.append(update_callback),
+        system_device_info=dict,
+        module_device_info=lambda bat_id: {},
+    )
+    hass = SimpleNamespace(data={DOMAIN: {"entry": coordinator}})
+    entry = SimpleNamespace(entry_id="entry", async_on_unload=lambda remove: None)
+    entities = []
+    asyncio.run(sensor.async_setup_entry(hass, entry, entities.extend))
+    return coordinator, entities, listeners[0]
+
+
+def _unique_ids(entities, part):
+    return sorted(entity.unique_id for entity in entities if part in entity.unique_id)
+
+
+def test_cell_sensors_follow_the_cell_count():
+    # Restored without cells, or not reached by the round-robin yet
+    coordinator, entities, topology_changed = _setup({1: 0, 2: 0})
+
+    assert _unique_ids(entities, "bat1_cell_") == ["entry_bat1_cell_temp_max", "entry_bat1_cell_volt_delta",
+                                                   "entry_bat1_cell_volt_max", "entry_bat1_cell_volt_min"]
+    assert not _unique_ids(entities, "cell0_volt")
+
+    coordinator.topology = {1: 15, 2: 0}
+    topology_changed({1}, set())
+
+    added = entities[-15:]
+    assert [entity.unique_id for entity in added] == [f"entry_bat1_cell{cell}_volt" for cell in range(15)]
+    assert len(_unique_ids(entities, "bat1_volt")) == 1
+
+    # More cells than first read only adds the missing ones, a new module gets everything
+    coordinator.topology = {1: 16, 2: 0, 3: 16}
+    count = len(entities)
+    topology_changed({1, 3}, set())
+    added = [entity.unique_id for entity in entities[count:]]
+    assert "entry_bat1_cell15_volt" in added and "entry_bat1_cell0_volt" not in added
+    assert "entry_bat3_volt" in added and len(_unique_ids(entities[count:], "bat3_cell")) == 16 + 4
+
+
+def test_no_cell_sensors_without_cell_reads():
+    _, entities, _ = _setup({1: 15}, reads_cells=False)
+
+    assert _unique_ids(entities, "bat1_volt") == ["entry_bat1_volt"]
+    assert not _unique_ids(entities, "bat1_cell")
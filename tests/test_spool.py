@@ -0,0 +1,146 @@
+"""Tests for the pylon2mqtt on-disk spool."""
+import json
+import os
+
+from spool import DiskQueue
+
+
+def _records(count, start=0):
+    return [{"ts": start + n, "soc": 50 + n % 10} for n in range(count)]
+
+
+def test_records_come_back_in_order(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    assert not queue
+    for record in _records(5):
+        queue.append(record)
+
+    assert queue
+    read = queue.read(10)
+    assert [record for record, _ in read] == _records(5)
+
+
+def test_cursor_only_moves_on_commit(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for record in _records(5):
+        queue.append(record)
+
+    first = queue.read(3)
+    # Not committed (e.g. the publish failed), the same records again
+    assert queue.read(3) == first
+
+    queue.commit(first[-1][1])
+    rest = queue.read(10)
+    assert [record["ts"] for record, _ in rest] == [3, 4]
+
+    queue.commit(rest[-1][1])
+    assert not queue
+    assert queue.read(10) == []
+
+
+def test_records_span_segments(tmp_path):
+    queue = DiskQueue(str(tmp_path), segment_size=64)
+    for record in _records(20):
+        queue.append(record)
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".seg")]) > 1
+
+    seen = []
+    while queue:
+        batch = queue.read(3)
+        seen += [record for record, _ in batch]
+        queue.commit(batch[-1][1])
+    assert seen == _records(20)
+    # Sent segments are deleted
+    assert queue.size == 0
+
+
+def test_oldest_segments_dropped_over_the_bound(tmp_path):
+    queue = DiskQueue(str(tmp_path), segment_size=64, max_bytes=256)
+    for record in _records(100):
+        queue.append(record)
+
+    assert queue.size <= 256
+    records = [record for record, _ in queue.read(100)]
+    # What's left is the newest samples, still in order
+    assert records == _records(100)[-len(records):]
+
+
+def test_cursor_survives_a_restart(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for record in _records(5):
+        queue.append(record)
+    queue.commit(queue.read(2)[-1][1])
+    queue.close()
+
+    reopened = DiskQueue(str(tmp_path))
+    assert [record["ts"] for record, _ in reopened.read(10)] == [2, 3, 4]
+
+
+def test_restart_compacts_sent_records(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for record in _records(5):
+        queue.append(record)
+    size = queue.size
+    queue.commit(queue.read(3)[-1][1])
+    queue.close()
+
+    reopened = DiskQueue(str(tmp_path))
+    assert reopened.size < size
+    with open(tmp_path / "cursor.json") as file:
+        assert json.load(file) == {"segment": 0, "offset": 0}
+    assert [record["ts"] for record, _ in reopened.read(10)] == [3, 4]
+
+
+def test_record_cut_by_a_crash_is_dropped(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for record in _records(3):
+        queue.append(record)
+    queue.close()
+    segment = next(tmp_path.glob("*.seg"))
+    with open(segment, "ab") as file:
+        file.write(b'{"ts": 3, "so')
+
+    reopened = DiskQueue(str(tmp_path))
+    assert [record for record, _ in reopened.read(10)] == _records(3)
+    # New records go after the last complete one
+    reopened.append({"ts": 4})
+    assert [record["ts"] for record, _ in reopened.read(10)] == [0, 1, 2, 4]
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    queue.append({"ts": 0})
+    queue.close()
+    segment = next(tmp_path.glob("*.seg"))
+    with open(segment, "ab") as file:
+        file.write(b"not json\n")
+    queue = DiskQueue(str(tmp_path))
+    queue.append({"ts": 1})
+
+    assert [record["ts"] for record, _ in queue.read(10)] == [0, 1]
+
+
+def test_unreadable_cursor_starts_at_the_oldest_segment(tmp_path):
+    queue = DiskQueue(str(tmp_path), segment_size=64)
+    for record in _records(10):
+        queue.append(record)
+    queue.close()
+    with open(tmp_path / "cursor.json", "w") as file:
+        file.write("{")
+
+    reopened = DiskQueue(str(tmp_path), segment_size=64)
+    assert [record for record, _ in reopened.read(100)] == _records(10)
+
+
+def test_appends_after_draining(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for record in _records(3):
+        queue.append(record)
+    queue.commit(queue.read(10)[-1][1])
+    assert not queue
+
+    for record in _records(2, start=10):
+        queue.append(record)
+    assert [record["ts"] for record, _ in queue.read(10)] == [10, 11]
+    queue.close()
+    assert [record["ts"] for record, _ in DiskQueue(str(tmp_path)).read(10)] == [10, 11]
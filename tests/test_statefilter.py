@@ -0,0 +1,48 @@
+"""Significant-change filtering of state writes."""
+from pylontech_serial.statefilter import StateFilter
+
+
+def test_absolute_deadband():
+    state_filter = StateFilter({"voltage": (0.05, 0)})
+
+    assert not state_filter.is_significant("voltage", 50.0, 50.04)
+    assert state_filter.is_significant("voltage", 50.0, 50.05)
+    assert state_filter.is_significant("voltage", 50.0, 49.9)
+
+
+def test_relative_deadband():
+    state_filter = StateFilter({"power": (10, 0.05)})
+
+    # 5% of 1000 W is above the absolute 10 W
+    assert not state_filter.is_significant("power", 1000, 1040)
+    assert state_filter.is_significant("power", 1000, 1050)
+    # Near zero the absolute deadband applies
+    assert not state_filter.is_significant("power", 20, 25)
+    assert state_filter.is_significant("power", 20, 30)
+
+
+def test_scale():
+    state_filter = StateFilter({"cell_voltage": (0.002, 0)})
+
+    # Same deadband for a sensor in V and one in mV
+    assert not state_filter.is_significant("cell_voltage", 3.300, 3.301)
+    assert not state_filter.is_significant("cell_voltage", 3300, 3301, scale=1000)
+    assert state_filter.is_significant("cell_voltage", 3300, 3302, scale=1000)
+
+
+def test_decimal_readings_reach_the_deadband():
+    state_filter = StateFilter({"cell_voltage": (0.002, 0)})
+
+    # 3.005 - 3.003 is just below 0.002 in floating point
+    assert 3.005 - 3.003 < 0.002
+    assert state_filter.is_significant("cell_voltage", 3.003, 3.005)
+
+
+def test_without_deadband():
+    state_filter = StateFilter({"voltage": (0.05, 0)})
+
+    assert state_filter.is_significant("current", 1.0, 1.001)
+    assert state_filter.is_significant("voltage", "Normal", "Low")
+    assert state_filter.is_significant("voltage", None, 50.0)
+    assert not state_filter.is_significant("voltage", 50.0, 50.0)
+    assert not state_filter.is_significant("current", "Normal", "Normal")
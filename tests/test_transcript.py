@@ -0,0 +1,98 @@
+"""Transcript recording and replay."""
+import os
+
+from pylontech_serial.transcript import (
+    INDEX_SUFFIX,
+    SEGMENT_SUFFIX,
+    TranscriptReader,
+    TranscriptRecord,
+    TranscriptRecorder,
+)
+
+
+def _response(n: int) -> bytes:
+    return f"pwr\n\r@\r\r\n{n:>5} 50000 -1000 16000\r\n\rpylon>".encode("ascii")
+
+
+def _record(directory, count, start=0, **kwargs) -> TranscriptRecorder:
+    recorder = TranscriptRecorder(str(directory), **{"max_size": 1 << 24, **kwargs})
+    recorder.start()
+    for n in range(start, start + count):
+        recorder.record(1000.0 + n, "pwr", _response(n))
+    recorder.close()
+    return recorder
+
+
+def _files(directory, suffix):
+    return sorted(name for name in os.listdir(directory) if name.endswith(suffix))
+
+
+def test_records_are_read_back(tmp_path):
+    recorder = _record(tmp_path, 5)
+
+    assert recorder.records == 5
+    assert list(TranscriptReader(str(tmp_path))) == [
+        TranscriptRecord(1000.0 + n, "pwr", _response(n)) for n in range(5)
+    ]
+
+
+def test_record_before_start_is_dropped(tmp_path):
+    recorder = TranscriptRecorder(str(tmp_path), max_size=1 << 20)
+    recorder.record(1000.0, "pwr", _response(0))
+
+    assert recorder.dropped == 1
+    recorder.close()
+
+
+def test_every_open_starts_a_segment(tmp_path):
+    _record(tmp_path, 3)
+    _record(tmp_path, 3, start=3)
+
+    assert _files(tmp_path, SEGMENT_SUFFIX) == ["000001.seg", "000002.seg"]
+    assert [record.timestamp for record in TranscriptReader(str(tmp_path))] == [1000.0 + n for n in range(6)]
+
+
+def test_segments_rotate_and_the_oldest_are_removed(tmp_path):
+    _record(tmp_path, 200, max_size=2000, segment_size=500)
+
+    segments = _files(tmp_path, SEGMENT_SUFFIX)
+    assert len(segments) > 1
+    assert segments[0] != "000001.seg"
+    size = sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert size <= 2000 + 500
+    # What's left is the newest records, in order
+    timestamps = [record.timestamp for record in TranscriptReader(str(tmp_path))]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[-1] == 1199.0
+
+
+def test_read_between_times(tmp_path):
+    _record(tmp_path, 50, segment_size=500)
+    reader = TranscriptReader(str(tmp_path))
+
+    assert [record.timestamp for record in reader.read(since=1010.0, until=1015.0)] == [
+        1010.0, 1011.0, 1012.0, 1013.0, 1014.0]
+    assert [record.timestamp for record in reader.read(since=1048.5)] == [1049.0]
+    assert list(reader.read(since=2000.0)) == []
+
+
+def test_read_without_index(tmp_path):
+    _record(tmp_path, 10)
+    for name in _files(tmp_path, INDEX_SUFFIX):
+        os.remove(tmp_path / name)
+
+    assert [record.timestamp for record in TranscriptReader(str(tmp_path)).read(since=1007.0)] == [
+        1007.0, 1008.0, 1009.0]
+
+
+def test_segment_cut_short_is_read_to_its_last_record(tmp_path):
+    _record(tmp_path, 5)
+    path = tmp_path / "000001.seg"
+    with open(path, "rb+") as file:
+        file.truncate(os.path.getsize(path) - 3)
+
+    assert [record.timestamp for record in TranscriptReader(str(tmp_path))] == [1000.0 + n for n in range(4)]
+
+
+def test_missing_directory_reads_nothing(tmp_path):
+    assert list(TranscriptReader(str(tmp_path / "missing"))) == []
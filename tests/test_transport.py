@@ -0,0 +1,235 @@
+"""Console transport: queueing, resync and what goes on the wire."""
+import asyncio
+
+import pytest
+
+from pylontech_serial.console import PAGER_EXIT
+from pylontech_serial.session import CircuitBreaker
+from pylontech_serial.transport import (
+    PRIORITY_POLL,
+    PRIORITY_TIME_SYNC,
+    PRIORITY_USER,
+    PylontechRS485Transport,
+    PylontechTransport,
+    PylontechTransportError,
+)
+from simulator import PROMPT, response
+
+HELP_PAGE = (
+    b"help\n\r@\r\r\nLocal command:\r\n\rbat      Battery data show - bat [pwr][index]\r\r\n"
+    b"Press [Enter] to be continued,other key to exit\r"
+)
+
+
+class FakeConsole:
+    """Answers written lines like the console, and keeps every write.
+
+    `answers` maps a command to the responses to give it in turn, the
+    console's usual empty response is used once they run out.
+    """
+
+    def __init__(self, answers=None):
+        self.answers = {command: list(frames) for command, frames in (answers or {}).items()}
+        self.written = []
+        self.opened = 0
+        self.reader = None
+
+    async def open_connection(self):
+        self.opened += 1
+        self.reader = asyncio.StreamReader()
+        return self.reader, self
+
+    def write(self, data: bytes):
+        self.written.append(data)
+        if data == PAGER_EXIT:
+            self.reader.feed_data(PROMPT)
+            return
+        for command in data.decode("ascii").split("\n")[:-1]:
+            if not command:
+                self.reader.feed_data(PROMPT)
+                continue
+            frames = self.answers.get(command.strip())
+            self.reader.feed_data(frames.pop(0) if frames else response(command, []))
+
+    def close(self):
+        pass
+
+
+def _run(console, coroutine_factory):
+    async def main():
+        transport = PylontechTransport("/dev/null", 115200, open_connection=console.open_connection)
+        try:
+            return await coroutine_factory(transport)
+        finally:
+            await transport.close()
+
+    return asyncio.run(main())
+
+
+def test_commands_in_sync_are_written_once():
+    console = FakeConsole()
+
+    async def run(transport):
+        await transport.execute("pwr")
+        await transport.execute("stat")
+
+    _run(console, run)
+    # Woken once, then every command goes straight out
+    assert console.written == [b"\n", b"pwr\n", b"stat\n"]
+
+
+def test_poll_is_sent_again_after_stale_output():
+    console = FakeConsole({"pwr": [response("bat 1", [])]})
+
+    async def run(transport):
+        return await transport.execute("pwr", PRIORITY_POLL)
+
+    frame = _run(console, run)
+    assert console.written == [b"\n", b"pwr\n", b"\n", b"pwr\n"]
+    assert frame.startswith(b"pwr\n")
+
+
+@pytest.mark.parametrize("priority", [PRIORITY_USER, PRIORITY_TIME_SYNC])
+def test_user_commands_are_never_sent_twice(priority):
+    console = FakeConsole({"time 25 12 21 20 53 06": [response("bat 1", [])]})
+
+    async def run(transport):
+        frame = await transport.execute("time 25 12 21 20 53 06", priority)
+        # Out of sync, so the next command wakes the console first
+        await transport.execute("pwr")
+        return frame
+
+    frame = _run(console, run)
+    assert console.written == [b"\n", b"time 25 12 21 20 53 06\n", b"\n", b"pwr\n"]
+    assert frame.startswith(b"bat 1")
+
+
+def test_trailing_space_still_matches_the_echo():
+    console = FakeConsole()
+
+    async def run(transport):
+        await transport.execute("info ", PRIORITY_USER)
+        await transport.execute("pwr")
+
+    _run(console, run)
+    assert console.written == [b"\n", b"info \n", b"pwr\n"]
+
+
+def test_paged_output_is_one_answer():
+    console = FakeConsole({"help": [HELP_PAGE]})
+
+    async def run(transport):
+        page = await transport.execute("help", PRIORITY_USER)
+        await transport.execute("pwr")
+        return page
+
+    page = _run(console, run)
+    # The pager is left with a key that doesn't print the next page
+    assert console.written == [b"\n", b"help\n", PAGER_EXIT, b"pwr\n"]
+    assert page == HELP_PAGE
+
+
+def test_batch_is_written_in_one_go():
+    console = FakeConsole()
+
+    async def run(transport):
+        return await transport.execute_batch(["pwr", "stat"])
+
+    payloads = _run(console, run)
+    assert console.written == [b"\n", b"pwr\nstat\n"]
+    assert [payload.split(b"\n", 1)[0] for payload in payloads] == [b"pwr", b"stat"]
+
+
+def test_priorities():
+    console = FakeConsole()
+
+    async def run(transport):
+        # All queued before the worker gets to run
+        await asyncio.gather(
+            transport.execute("pwr", PRIORITY_POLL),
+            transport.execute("stat", PRIORITY_POLL),
+            transport.execute("info", PRIORITY_USER),
+            transport.execute("time", PRIORITY_TIME_SYNC),
+        )
+
+    _run(console, run)
+    assert console.written == [b"\n", b"info\n", b"time\n", b"pwr\n", b"stat\n"]
+
+
+def test_expired_deadline_never_reaches_the_wire():
+    console = FakeConsole()
+
+    async def run(transport):
+        deadline = asyncio.get_running_loop().time() - 1
+        with pytest.raises(TimeoutError):
+            await transport.execute("pwr", deadline=deadline)
+        await transport.execute("stat")
+
+    _run(console, run)
+    assert console.written == [b"\n", b"stat\n"]
+
+
+def test_non_ascii_command_is_rejected():
+    console = FakeConsole()
+
+    async def run(transport):
+        with pytest.raises(PylontechTransportError):
+            await transport.execute("pwr é")
+        await transport.execute("pwr")
+
+    _run(console, run)
+    assert console.written == [b"\n", b"pwr\n"]
+
+
+def test_breaker_stops_using_a_dead_port():
+    attempts = []
+
+    async def open_connection():
+        attempts.append(1)
+        raise OSError("No such device")
+
+    async def main():
+        transport = PylontechTransport("/dev/null", 115200, open_connection=open_connection)
+        try:
+            for _ in range(3):
+                with pytest.raises(PylontechTransportError, match="Serial Error"):
+                    await transport.execute("pwr")
+            with pytest.raises(PylontechTransportError, match="unavailable"):
+                await transport.execute("pwr")
+        finally:
+            await transport.close()
+
+    asyncio.run(main())
+    assert len(attempts) == 3
+
+
+def test_breaker_backoff():
+    now = [0.0]
+    breaker = CircuitBreaker("Port", threshold=2, base_delay=5, max_delay=15, clock=lambda: now[0])
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.retry_in == 5
+
+    now[0] = 5
+    # Half open, one failure opens it again for twice as long
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.retry_in == 10
+    now[0] = 15
+    breaker.record_failure()
+    assert breaker.retry_in == 15
+
+    breaker.record_success()
+    assert breaker.allow()
+    assert breaker.failures == 0
+
+
+def test_rs485_has_no_stream():
+    transport = PylontechRS485Transport("/dev/null", 9600)
+
+    # Same arguments as the console transport takes from the coordinator
+    with pytest.raises(PylontechTransportError, match="no streaming"):
+        transport.start_stream("disp", lambda chunk: None, lambda: None)